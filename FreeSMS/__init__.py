@@ -1,20 +1,62 @@
 import os
 import json
-from flask import Flask
-
-from . import event_logger
+import threading
 
 BASE = os.path.dirname(__file__)
-app = Flask(
-    __name__,
-    template_folder=os.path.join(BASE, "../templates"),
-    static_folder=os.path.join(BASE, "../static")
-)
 
-app.config.from_file(os.path.join(BASE, "../config.json"), load=json.load)
-with open(os.path.join(BASE, "../translations.json"), encoding="utf-8") as fh:
-    app.config['TRANSLATIONS'] = json.load(fh)
+# Flask-приложение создаётся при первом обращении к FreeSMS.app, чтобы
+# утилиты (modem_utils, operator_index, скрипты) импортировались без Flask,
+# базы событий и загрузки шаблонов
+_app_lock = threading.RLock()
+
+
+def create_app():
+    from flask import Flask
+
+    from . import event_logger
+    from . import event_retention
+    from . import sms_queue
+    from . import sms_inbox
+    from . import rules
+    from . import forwarding
+    from . import sharding
+    from . import ussd
+    from .backends import read_config
+
+    app = Flask(
+        __name__,
+        template_folder=os.path.join(BASE, "../templates"),
+        static_folder=os.path.join(BASE, "../static")
+    )
+
+    app.config.from_file(os.path.join(BASE, "../config.json"), load=json.load)
+    with open(os.path.join(BASE, "../translations.json"), encoding="utf-8") as fh:
+        app.config['TRANSLATIONS'] = json.load(fh)
+
+    # from_file оставляет в app.config только ключи в ВЕРХНЕМ регистре,
+    # поэтому разделы подсистем берутся из самого config.json
+    config = read_config()
+
+    event_logger.init_db()
+    event_retention.start(config.get("event_retention"))
+    # Обработчики портов запускаются до всего, что обращается к модемам
+    sharding.start(config.get("sharding"))
+    sms_queue.start(config.get("sms_queue"))
+    forwarding.start(config.get("forwarding"))
+    ussd.start(config.get("ussd"))
+    # Правила подключаются до запуска чтения модемов, чтобы не пропустить SMS
+    inbox = sms_inbox.get_inbox(config.get("sms_inbox"))
+    rules.attach(inbox)
+    inbox.start()
+    return app
 
-event_logger.init_db()
 
-import FreeSMS.views
+def __getattr__(name):
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _app_lock:
+        if "app" not in globals():
+            globals()["app"] = create_app()
+            # views регистрирует маршруты на уже созданном app
+            import FreeSMS.views
+    return globals()["app"]
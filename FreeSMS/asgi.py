@@ -0,0 +1,182 @@
+# FreeSMS/asgi.py
+
+"""
+Асинхронный режим сервера (SERVER_MODE=asgi в runserver.py).
+
+Потоковые SSE-эндпоинты /api/monitor, GET /api/connect и GET /api/ussd здесь —
+корутины Starlette: открытое соединение стоит очередь событий и
+несколько килобайт памяти, а не поток. Опрос модемов по-прежнему идёт
+в потоках (общий опросчик monitor и пул CONNECT_WORKERS), в цикл
+asyncio передаются только готовые события. Все остальные маршруты
+обслуживает то же Flask-приложение через a2wsgi.
+
+    SERVER_MODE=asgi python runserver.py
+    uvicorn FreeSMS.asgi:app --host 0.0.0.0 --port 5555
+"""
+
+import json
+import asyncio
+import concurrent.futures
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from . import app as flask_app
+from . import event_logger
+from . import monitor
+from . import ussd
+from .i18n import resolve_language
+from .modem_utils import list_modem_ports
+from .views import MONITOR_KEEPALIVE, _port_call
+
+# Потоков на опрос портов для всех потоков /api/connect вместе
+CONNECT_WORKERS = 32
+# Потоков на обычные (не потоковые) запросы Flask
+WSGI_WORKERS = 32
+
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+_connect_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=CONNECT_WORKERS, thread_name_prefix="asgi-connect"
+)
+
+
+def _event(data):
+    return f"data: {json.dumps(data)}\n\n"
+
+
+async def api_monitor(request):
+    """Stream modem state changes via Server-Sent Events.
+
+    Same stream as the Flask ``/api/monitor``, but each client waits on
+    an asyncio queue fed by the shared poller instead of holding a thread.
+    """
+    ports = request.query_params.getlist("ports")
+    lang = resolve_language(request.cookies.get("lang"))
+    sub = monitor.subscribe(lang, ports, loop=asyncio.get_running_loop())
+
+    async def generate():
+        try:
+            while True:
+                event = await sub.get(timeout=MONITOR_KEEPALIVE)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _event(event)
+        finally:
+            sub.close()
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+
+async def api_connect(request):
+    """Connect to selected ports and stream modem info per port via SSE.
+
+    Ports come from ``?ports=`` (repeated or comma separated); without
+    them every detected port is connected.
+    """
+    ports = request.query_params.getlist("ports")
+    if len(ports) == 1 and "," in ports[0]:
+        ports = [p.strip() for p in ports[0].split(",") if p.strip()]
+    lang = resolve_language(request.cookies.get("lang"))
+    loop = asyncio.get_running_loop()
+    if not ports:
+        ports = await loop.run_in_executor(_connect_executor, list_modem_ports)
+
+    async def info_for(port):
+        try:
+            info = await loop.run_in_executor(
+                _connect_executor, _port_call, port, "get_modem_info", lang, True
+            )
+        except Exception as e:
+            info = {"port": port, "status": str(e)}
+        info.setdefault("port", port)
+        return info
+
+    async def generate():
+        tasks = [asyncio.ensure_future(info_for(p)) for p in ports]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                info = await next_done
+                event_logger.log_event("port_connected", port=info["port"])
+                yield _event(info)
+        except Exception as e:
+            event_logger.log_event("sse_error", details=str(e))
+            yield _event({"error": str(e)})
+        finally:
+            # Клиент ушёл: порты, до которых не дошла очередь, не опрашиваются
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+
+async def api_ussd(request):
+    """Dial a USSD code on several ports and stream results via SSE as ports finish.
+
+    Same parameters as the Flask ``GET /api/ussd``; waiting ports cost a
+    pending future each rather than a thread.
+    """
+    params = request.query_params
+    ports = [p.strip() for item in params.getlist("ports") for p in item.split(",") if p.strip()]
+    engine = ussd.get_engine()
+    try:
+        code, replies = engine.validate(params.get("code"), params.getlist("replies"))
+    except ussd.UssdError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    force = params.get("force", "") in ("1", "true", "yes")
+    loop = asyncio.get_running_loop()
+    if not ports:
+        ports = await loop.run_in_executor(_connect_executor, list_modem_ports)
+
+    def submit_all():
+        return {engine.submit(p, code, replies, force): p for p in dict.fromkeys(ports)}
+
+    def leave(items):
+        # Отмена в процессе-обработчике ждёт его ответа, поэтому не в цикле событий
+        for future, port in items:
+            engine.cancel(port, code, replies, future)
+
+    async def generate():
+        # submit() заглядывает в кэш через sharding, поэтому не в цикле событий
+        futures = await loop.run_in_executor(_connect_executor, submit_all)
+        waiting = {asyncio.wrap_future(f): (f, p) for f, p in futures.items()}
+        deadline = loop.time() + engine.config["request_timeout"]
+        try:
+            while waiting:
+                done, _ = await asyncio.wait(
+                    waiting, timeout=max(0, deadline - loop.time()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    break
+                for future in done:
+                    waiting.pop(future)
+                    yield _event(future.result())
+            timed_out, waiting = waiting, {}
+            if timed_out:
+                _connect_executor.submit(leave, list(timed_out.values()))
+            for _, port in timed_out.values():
+                yield _event(ussd.timeout_result(port, code, replies))
+        except Exception as e:
+            event_logger.log_event("sse_error", details=str(e))
+            yield _event({"error": str(e)})
+        finally:
+            # Клиент отключился: его ожидание снимается, а операция порта —
+            # если её больше никто не ждёт
+            if waiting:
+                _connect_executor.submit(leave, list(waiting.values()))
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+
+app = Starlette(routes=[
+    Route("/api/monitor", api_monitor, methods=["GET"]),
+    # POST /api/connect (JSON-ответ) остаётся во Flask
+    Route("/api/connect", api_connect, methods=["GET"]),
+    # POST /api/ussd, /api/ussd_port и /api/ussd_number остаются во Flask
+    Route("/api/ussd", api_ussd, methods=["GET"]),
+    Mount("/", app=WSGIMiddleware(flask_app, workers=WSGI_WORKERS)),
+])
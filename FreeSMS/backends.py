@@ -0,0 +1,180 @@
+# FreeSMS/backends.py
+
+"""
+Бэкенды ввода-вывода модемов.
+
+Бэкенд открывает соединение с портом и возвращает объект с интерфейсом
+gammu.StateMachine (Init, GetModel, GetSignalQuality, ...), перечисляет
+доступные порты и говорит, после каких ошибок соединение надо переоткрыть.
+Пул сессий и остальной modem_utils работают только через этот интерфейс.
+
+Бэкенд выбирается ключом "modem_backend" в config.json или переменной
+окружения FREESMS_MODEM_BACKEND: "gammu" (по умолчанию, настоящие модемы)
+или "simulator" (виртуальная ферма модемов, см. simulator.py; параметры
+— в разделе "simulator" config.json).
+"""
+
+import os
+import json
+import threading
+
+from .i18n import CONFIG_PATH
+
+DEFAULT_BACKEND = "gammu"
+
+# Базовый алфавит GSM 03.38 и символы расширения (занимают по две септеты)
+GSM7_BASIC = (
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENDED = "^{}\\[~]|€\f"
+_GSM7 = frozenset(GSM7_BASIC + GSM7_EXTENDED)
+
+
+def is_gsm7(text):
+    """True, если текст кодируется 7-битным алфавитом GSM (иначе нужен UCS-2)."""
+    return all(ch in _GSM7 for ch in text)
+
+
+class ModemBackend:
+    """Базовый интерфейс бэкенда."""
+
+    name = ""
+
+    def open(self, port):
+        """Открывает и инициализирует соединение; возвращает StateMachine-подобный объект."""
+        raise NotImplementedError
+
+    def list_ports(self):
+        """Список портов, на которых могут быть модемы."""
+        raise NotImplementedError
+
+    def is_connection_error(self, exc):
+        """True, если после exc соединение нельзя использовать повторно."""
+        return False
+
+    def encode_sms(self, phone, text):
+        """Разбивает текст на части SMS; возвращает словари для StateMachine.SendSMS."""
+        raise NotImplementedError
+
+
+class GammuBackend(ModemBackend):
+    """Настоящие модемы через python-gammu (импортируется при первом обращении)."""
+
+    name = "gammu"
+
+    # Ошибки Gammu, после которых сессию нельзя использовать повторно
+    CONNECTION_ERRORS = (
+        "ERR_TIMEOUT",
+        "ERR_NOTCONNECTED",
+        "ERR_DEVICENOTEXIST",
+        "ERR_DEVICEOPENERROR",
+        "ERR_DEVICEREADERROR",
+        "ERR_DEVICEWRITEERROR",
+        "ERR_DEVICENOTWORK",
+        "ERR_DEVICEBUSY",
+        "ERR_DEVICELOCKED",
+        "ERR_DEVICENOPERMISSION",
+        "ERR_DEVICENODRIVER",
+        "ERR_DEVICECHANGESPEEDERROR",
+        "ERR_DEVICEDTRRTSERROR",
+        "ERR_DEVICEPARITYERROR",
+        "ERR_PHONEOFF",
+    )
+
+    def __init__(self):
+        self._gammu = None
+        self._errors = None
+
+    @property
+    def gammu(self):
+        if self._gammu is None:
+            import gammu
+            self._gammu = gammu
+        return self._gammu
+
+    def open(self, port):
+        sm = self.gammu.StateMachine()
+        sm.ReadConfig()
+        sm.SetConfig(0, {"Device": port, "Connection": "at"})
+        sm.Init()
+        return sm
+
+    def list_ports(self):
+        try:
+            devices = self.gammu.GetConfig(0)
+            ports = [devices.get("Device")] if devices else []
+            if ports and ports[0]:
+                return ports
+        except Exception:
+            ports = []
+
+        # Порт не задан в конфигурации Gammu: берём кэшированный реестр,
+        # который обновляется по hotplug-событиям
+        from .port_registry import get_registry
+        return get_registry().ports()
+
+    def is_connection_error(self, exc):
+        if self._errors is None:
+            gammu = self.gammu
+            self._errors = tuple(
+                getattr(gammu, name) for name in self.CONNECTION_ERRORS
+                if hasattr(gammu, name)
+            )
+        return isinstance(exc, self._errors)
+
+    def encode_sms(self, phone, text):
+        parts = self.gammu.EncodeSMS({
+            "Class": -1,
+            "Unicode": not is_gsm7(text),
+            "Entries": [{"ID": "ConcatenatedTextLong", "Buffer": text}],
+        })
+        for part in parts:
+            part["SMSC"] = {"Location": 1}
+            part["Number"] = phone
+        return parts
+
+
+def read_config():
+    """Содержимое config.json (пустой dict, если файла нет или он испорчен)."""
+    if not CONFIG_PATH:
+        return {}
+    try:
+        with open(CONFIG_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def create_backend(name, options=None):
+    if name == "gammu":
+        return GammuBackend()
+    if name == "simulator":
+        from .simulator import SimulatorBackend
+        return SimulatorBackend(options or {})
+    raise ValueError(f"unknown modem backend: {name}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Бэкенд процесса; выбирается по конфигурации при первом обращении."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                cfg = read_config()
+                name = os.environ.get("FREESMS_MODEM_BACKEND") or cfg.get(
+                    "modem_backend", DEFAULT_BACKEND
+                )
+                _backend = create_backend(name, cfg.get(name))
+    return _backend
+
+
+def set_backend(backend):
+    """Подменяет бэкенд процесса (бенчмарки, нагрузочные прогоны)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,391 @@
+# FreeSMS/campaigns.py
+
+"""
+Массовые рассылки SMS.
+
+Список получателей (CSV или JSONL) читается потоком и попадает в очередь
+sms_queue пачками по INGEST_BATCH строк, поэтому файл любого размера не
+загружается в память целиком. Каждому получателю выбирается порт:
+сначала среди SIM того же оператора, что и номер получателя (внутрисетевые
+SMS дешевле и доходят быстрее), затем среди остальных. Внутри группы
+выигрывает порт с наименьшей очередью с поправкой на уровень сигнала.
+
+Оператор номера определяется по самому длинному совпавшему префиксу.
+Префиксы берутся из ключа "number_prefixes" config.json (значение —
+код оператора из OPS_MAP, например "rus-mts", или MCC+MNC, например
+"25001") и дополняются префиксами собственных номеров SIM в модемах:
+первые LEARN_PREFIX_DIGITS цифр номера SIM относятся к её оператору.
+Перенесённые между операторами номера (MNP) так не распознаются —
+такие SMS просто уходят как межсетевые.
+"""
+
+import io
+import re
+import csv
+import json
+import time
+import heapq
+import uuid
+import sqlite3
+import threading
+import concurrent.futures
+
+from . import modem_utils
+from . import sharding
+from . import sms_queue
+from .backends import read_config
+
+# Сколько получателей маршрутизируется и записывается одной транзакцией
+INGEST_BATCH = 1000
+# Сколько первых цифр собственного номера SIM считать префиксом оператора
+LEARN_PREFIX_DIGITS = 4
+# Сколько портов опрашивается параллельно, если о них ещё нет данных
+PROBE_WORKERS = 16
+
+INGESTING = "ingesting"
+RUNNING = "running"
+PAUSED = "paused"
+DONE = "done"
+# Загрузка списка оборвалась; поставленные сообщения отменены
+FAILED = "failed"
+
+_schema = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL,
+    ingested INTEGER NOT NULL DEFAULT 0,
+    ports TEXT,
+    total INTEGER NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0,
+    on_net INTEGER NOT NULL DEFAULT 0,
+    created_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+"""
+
+_COLUMNS = (
+    "id", "name", "text", "status", "ingested", "ports", "total", "rejected", "on_net",
+    "created_at", "updated_at",
+)
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+class CampaignError(Exception):
+    """Рассылку нельзя создать или изменить (нет портов, неверный статус)."""
+
+
+class CampaignIngestError(CampaignError):
+    """Загрузка списка получателей оборвалась; campaign_id — созданная рассылка."""
+
+    def __init__(self, message, campaign_id):
+        super().__init__(message)
+        self.campaign_id = campaign_id
+
+
+def normalize_phone(phone):
+    """Номер в виде '+<цифры>' или None, если цифр слишком мало."""
+    phone = str(phone or "").strip()
+    digits = _NON_DIGITS.sub("", phone)
+    if len(digits) < 5 or len(digits) > 15:
+        return None
+    return "+" + digits
+
+
+# ---------- префиксы операторов ----------
+def load_prefixes(config=None):
+    """
+    Префиксы номеров из config.json: {"7916": "rus-mts", "7925": "25002"}.
+    Значение MCC+MNC переводится в код оператора через OPS_MAP; коды,
+    которых нет в OPS_MAP, пропускаются.
+    """
+    raw = (config if config is not None else read_config()).get("number_prefixes") or {}
+    ops_map = modem_utils.OPS_MAP
+    known = set(ops_map.values())
+    prefixes = {}
+    for prefix, operator in raw.items():
+        digits = _NON_DIGITS.sub("", str(prefix))
+        operator = ops_map.get(str(operator), str(operator).lower())
+        if digits and operator in known:
+            prefixes[digits] = operator
+    return prefixes
+
+
+def learn_prefixes(ports_info, digits=LEARN_PREFIX_DIGITS):
+    """Префиксы по собственным номерам SIM; неоднозначные отбрасываются."""
+    learned = {}
+    for info in ports_info:
+        phone = normalize_phone(info.get("phone"))
+        if not phone or not info.get("operator"):
+            continue
+        prefix = phone[1:1 + digits]
+        if learned.get(prefix, info["operator"]) != info["operator"]:
+            learned[prefix] = None
+        else:
+            learned[prefix] = info["operator"]
+    return {p: op for p, op in learned.items() if op}
+
+
+class Router:
+    """
+    Выбор порта для каждого получателя.
+
+    Для каждого оператора хранится куча портов по нагрузке
+    (очередь + 1) / вес сигнала; порт берётся с вершины кучи своего
+    оператора, а для чужих номеров — лучший из вершин всех куч.
+    """
+
+    def __init__(self, ports_info, depths=None, prefixes=None):
+        if not ports_info:
+            raise CampaignError("no available ports")
+        depths = depths or {}
+        self.prefixes = dict(learn_prefixes(ports_info))
+        self.prefixes.update(prefixes or {})
+        self._lengths = sorted({len(p) for p in self.prefixes}, reverse=True)
+        self._depth = {}
+        self._weight = {}
+        self._heaps = {}
+        for info in ports_info:
+            port = info["port"]
+            rssi = info.get("rssi", 99)
+            # RSSI 99 — сигнал неизвестен или отсутствует
+            self._weight[port] = 0.2 + (0 if rssi == 99 else min(rssi, 31) / 31)
+            self._depth[port] = depths.get(port, 0)
+            heap = self._heaps.setdefault(info.get("operator"), [])
+            heapq.heappush(heap, (self._load(port), port))
+
+    def _load(self, port):
+        return (self._depth[port] + 1) / self._weight[port]
+
+    def operator_of(self, phone):
+        digits = phone.lstrip("+")
+        for length in self._lengths:
+            operator = self.prefixes.get(digits[:length])
+            if operator:
+                return operator
+        return None
+
+    def route(self, phone):
+        """Возвращает (port, on_net) и учитывает сообщение в нагрузке порта."""
+        operator = self.operator_of(phone)
+        heap = self._heaps.get(operator) if operator else None
+        on_net = heap is not None
+        if heap is None:
+            heap = min((h for h in self._heaps.values()), key=lambda h: h[0][0])
+        _, port = heapq.heappop(heap)
+        self._depth[port] += 1
+        heapq.heappush(heap, (self._load(port), port))
+        return port, on_net
+
+
+# ---------- чтение получателей ----------
+def _iter_csv(stream):
+    reader = csv.reader(stream)
+    phone_col, text_col = 0, None
+    for n, row in enumerate(reader):
+        if not row:
+            continue
+        if n == 0:
+            header = [c.strip().lower() for c in row]
+            if "phone" in header:
+                phone_col = header.index("phone")
+                text_col = header.index("text") if "text" in header else None
+                continue
+        phone = row[phone_col] if phone_col < len(row) else ""
+        text = row[text_col] if text_col is not None and text_col < len(row) else None
+        yield phone, text or None
+
+
+def _iter_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield "", None
+            continue
+        if isinstance(item, dict):
+            yield item.get("phone", ""), item.get("text") or None
+        else:
+            yield item, None
+
+
+def iter_recipients(binary_stream, fmt):
+    """Пары (phone, text или None) из CSV или JSONL по мере чтения потока."""
+    stream = io.TextIOWrapper(binary_stream, encoding="utf-8-sig", newline="")
+    return _iter_jsonl(stream) if fmt == "jsonl" else _iter_csv(stream)
+
+
+class CampaignManager:
+    def __init__(self, queue=None, db_path=None):
+        self.queue = queue or sms_queue.get_queue()
+        self._conn = sqlite3.connect(
+            db_path or self.queue.db_path, timeout=30, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_schema)
+        self._db_lock = threading.Lock()
+        # Держится на время записи пачки и смены статуса, чтобы пауза
+        # не разминулась с очередной пачкой загрузки
+        self._status_lock = threading.Lock()
+
+    def _query(self, sql, params=()):
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _update(self, sql, params=()):
+        with self._db_lock:
+            cur = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cur.rowcount
+
+    # ---------- порты ----------
+    def _ports_info(self, ports=None):
+        ports = ports or modem_utils.list_modem_ports()
+        infos = {p: sharding.call(p, "routing_info") for p in ports}
+        unknown = [p for p, info in infos.items() if info is None and
+                   not modem_utils.PORT_HEALTH.is_suspect(p)]
+        if unknown:
+            # Порты, которые ещё не опрашивались: один раз спрашиваем модемы
+            with concurrent.futures.ThreadPoolExecutor(max_workers=PROBE_WORKERS) as ex:
+                list(ex.map(lambda p: sharding.call(p, "get_modem_info"), unknown))
+            for p in unknown:
+                infos[p] = sharding.call(p, "routing_info")
+        return [info for info in infos.values() if info is not None]
+
+    # ---------- рассылки ----------
+    def create(self, recipients, text, name=None, ports=None):
+        """
+        Создаёт рассылку и ставит получателей в очередь по мере чтения.
+        recipients — итерируемое (phone, text или None); text — текст по
+        умолчанию. Возвращает состояние рассылки.
+        """
+        router = Router(
+            self._ports_info(ports), self.queue.depths(), load_prefixes()
+        )
+        campaign_id = uuid.uuid4().hex
+        now = int(time.time() * 1000)
+        self._update(
+            "INSERT INTO campaigns (id, name, text, status, ports, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (campaign_id, name, text, RUNNING, json.dumps(ports) if ports else None, now, now),
+        )
+        total = rejected = on_net = 0
+        batch = []
+        try:
+            for phone, own_text in recipients:
+                phone = normalize_phone(phone)
+                body = own_text or text
+                if phone is None or not body:
+                    rejected += 1
+                    continue
+                port, local = router.route(phone)
+                on_net += local
+                batch.append((port, phone, body, campaign_id))
+                if len(batch) >= INGEST_BATCH:
+                    total += self._flush(campaign_id, batch)
+                    batch = []
+            total += self._flush(campaign_id, batch)
+        except Exception as e:
+            self._fail(campaign_id, rejected, on_net)
+            message = "recipient list must be UTF-8" if isinstance(e, UnicodeDecodeError) else str(e)
+            raise CampaignIngestError(message or type(e).__name__, campaign_id) from e
+        self._update(
+            "UPDATE campaigns SET ingested = 1, total = ?, rejected = ?, on_net = ?, "
+            "updated_at = ? WHERE id = ?",
+            (total, rejected, on_net, int(time.time() * 1000), campaign_id),
+        )
+        return self.get(campaign_id)
+
+    def _fail(self, campaign_id, rejected, on_net):
+        # Под той же блокировкой, что пауза и пачки: после смены статуса
+        # возобновить рассылку уже нельзя, а отмена снимает всё поставленное
+        with self._status_lock:
+            self._update(
+                "UPDATE campaigns SET status = ?, rejected = ?, on_net = ?, updated_at = ? "
+                "WHERE id = ?",
+                (FAILED, rejected, on_net, int(time.time() * 1000), campaign_id),
+            )
+            self.queue.cancel_campaign(campaign_id)
+
+    def _flush(self, campaign_id, batch):
+        if not batch:
+            return 0
+        with self._status_lock:
+            status = self._query("SELECT status FROM campaigns WHERE id = ?", (campaign_id,))[0][0]
+            self.queue.submit_many(
+                batch, status=sms_queue.PAUSED if status == PAUSED else sms_queue.QUEUED
+            )
+            self._update(
+                "UPDATE campaigns SET total = total + ?, updated_at = ? WHERE id = ?",
+                (len(batch), int(time.time() * 1000), campaign_id),
+            )
+        return len(batch)
+
+    def get(self, campaign_id):
+        """Рассылка с счётчиками сообщений по статусам или None."""
+        rows = self._query(
+            f"SELECT {', '.join(_COLUMNS)} FROM campaigns WHERE id = ?", (campaign_id,)
+        )
+        return self._with_progress(dict(zip(_COLUMNS, rows[0]))) if rows else None
+
+    def list(self, limit=100):
+        rows = self._query(
+            f"SELECT {', '.join(_COLUMNS)} FROM campaigns ORDER BY created_at DESC LIMIT ?",
+            (limit,),
+        )
+        return [self._with_progress(dict(zip(_COLUMNS, r))) for r in rows]
+
+    def _with_progress(self, campaign):
+        counts = self.queue.counts(campaign["id"])
+        campaign["ports"] = json.loads(campaign["ports"]) if campaign["ports"] else None
+        campaign["progress"] = {
+            status: counts.get(status, 0)
+            for status in (sms_queue.QUEUED, sms_queue.SENDING, sms_queue.PAUSED,
+                           sms_queue.SENT, sms_queue.FAILED, sms_queue.CANCELLED)
+        }
+        campaign["ingested"] = bool(campaign["ingested"])
+        pending = sum(counts.get(s, 0) for s in (sms_queue.QUEUED, sms_queue.SENDING, sms_queue.PAUSED))
+        if campaign["status"] == RUNNING:
+            if not campaign["ingested"]:
+                campaign["status"] = INGESTING
+            elif not pending:
+                campaign["status"] = DONE
+        return campaign
+
+    def pause(self, campaign_id):
+        with self._status_lock:
+            if not self._set_status(campaign_id, RUNNING, PAUSED):
+                raise CampaignError("campaign is not running")
+            self.queue.pause_campaign(campaign_id)
+        return self.get(campaign_id)
+
+    def resume(self, campaign_id):
+        with self._status_lock:
+            if not self._set_status(campaign_id, PAUSED, RUNNING):
+                raise CampaignError("campaign is not paused")
+            self.queue.resume_campaign(campaign_id)
+        return self.get(campaign_id)
+
+    def _set_status(self, campaign_id, current, status):
+        return self._update(
+            "UPDATE campaigns SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (status, int(time.time() * 1000), campaign_id, current),
+        )
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = CampaignManager()
+    return _manager
@@ -0,0 +1,116 @@
+# FreeSMS/delta.py
+
+"""
+Вычисление изменений состояния модемов для монитора.
+
+Информация о модеме — плоский dict строк и чисел, поэтому вместо
+рекурсивного DeepDiff достаточно одного прохода по ключам: изменённые,
+добавленные и удалённые ключи получаются напрямую, без разбора путей
+вида root['signal'].
+"""
+
+from typing import NamedTuple
+
+# Ключи, которые не считаются изменением (порт передаётся в событии отдельно)
+IGNORED_KEYS = frozenset(("port",))
+_MISSING = object()
+
+
+class Delta(NamedTuple):
+    changed: dict   # ключ → новое значение (ключ был и раньше)
+    added: dict     # ключ → значение (ключа раньше не было)
+    removed: tuple  # ключи, которых больше нет
+
+
+def compare(old, new, ignore=IGNORED_KEYS):
+    """Разница между двумя плоскими dict."""
+    changed = {}
+    added = {}
+    for key, value in new.items():
+        if key in ignore:
+            continue
+        prev = old.get(key, _MISSING)
+        if prev is _MISSING:
+            added[key] = value
+        elif prev is not value and (prev != value or type(prev) is not type(value)):
+            changed[key] = value
+    removed = tuple(key for key in old if key not in new and key not in ignore)
+    return Delta(changed, added, removed)
+
+
+def diff_flat(old, new, ignore=IGNORED_KEYS):
+    """
+    Изменения одним dict, как их получает браузер: изменённые и
+    добавленные ключи с новыми значениями, удалённые — со значением None.
+    """
+    if not old:
+        return {k: v for k, v in new.items() if k not in ignore}
+    delta = compare(old, new, ignore)
+    diff = delta.changed
+    diff.update(delta.added)
+    for key in delta.removed:
+        diff[key] = None
+    return diff
+
+
+def sim_key(info):
+    """Идентификатор SIM: ICCID, а если его нет — IMSI; None без SIM."""
+    iccid = info.get("iccid")
+    if iccid and iccid != "—":
+        return iccid
+    imsi = info.get("imsi")
+    if imsi and imsi != "—":
+        return imsi
+    return None
+
+
+def diff_states(prev_by_port, prev_by_sim, results):
+    """
+    Сравнивает результаты опроса с предыдущим состоянием.
+
+    results — пары (порт, info или исключение) в порядке опроса.
+    Возвращает (события для подписчиков, новое состояние по портам,
+    новое состояние по SIM). SIM определяется по ICCID, а без него — по
+    IMSI; если SIM переехала на другой порт, в событие добавляется moved_from.
+    """
+    new_by_port = {}
+    new_by_sim = {}
+    events = []
+    for p, info in results:
+        if isinstance(info, Exception):
+            # Порт не ответил: держим последнее известное состояние
+            info = prev_by_port.get(p)
+            if info:
+                new_by_port[p] = info
+                sim = sim_key(info)
+                if sim:
+                    new_by_sim[sim] = info
+            continue
+        port = info.get("port")
+        sim = sim_key(info)
+
+        old_info = prev_by_sim.get(sim) if sim else None
+        if old_info is None:
+            old_info = prev_by_port.get(port)
+        diff = diff_flat(old_info, info)
+
+        old_port = old_info.get("port") if old_info else None
+        if sim and old_port and old_port != port:
+            diff["moved_from"] = old_port
+
+        if diff:
+            diff["port"] = port
+            events.append(diff)
+        new_by_port[port] = info
+        if sim:
+            new_by_sim[sim] = info
+
+    removed_ports = {p for p in prev_by_port if p not in new_by_port}
+    for rp in removed_ports:
+        events.append({"port": rp, "removed": True})
+    for sim, info in prev_by_sim.items():
+        if sim not in new_by_sim:
+            rp = info.get("port")
+            if rp and rp not in removed_ports:
+                events.append({"port": rp, "removed": True})
+    return events, new_by_port, new_by_sim
@@ -1,10 +1,28 @@
 import os
+import queue
+import atexit
 import sqlite3
+import threading
+import time
 from datetime import datetime
 
 BASE_DIR = os.path.dirname(__file__)
 DB_PATH = os.path.join(BASE_DIR, '..', 'events.db')
 
+# Максимальное число событий, ожидающих записи; сверх него события теряются
+QUEUE_SIZE = 10000
+# Сколько событий пишется одной транзакцией
+BATCH_SIZE = 500
+# Как долго (в секундах) событие может ждать в очереди перед записью
+FLUSH_INTERVAL = 0.5
+
+# Размер порции при заполнении колонки ts в старых базах
+MIGRATION_CHUNK = 50000
+# Максимальный размер страницы в query_events
+MAX_PAGE_SIZE = 1000
+
+# ts — время события в миллисекундах Unix: по нему идут диапазонные выборки,
+# timestamp оставлен в прежнем текстовом виде для чтения человеком
 _schema = """
 CREATE TABLE IF NOT EXISTS events (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -12,23 +30,241 @@ CREATE TABLE IF NOT EXISTS events (
     port TEXT,
     event_type TEXT NOT NULL,
     phone TEXT,
-    details TEXT
+    details TEXT,
+    ts INTEGER
 );
 """
 
-def init_db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+# Индексы (x, ts) неявно содержат rowid, поэтому покрывают и сортировку
+# ORDER BY ts DESC, id DESC, и курсор по id без отдельной сортировки
+_indexes = """
+CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts);
+CREATE INDEX IF NOT EXISTS idx_events_port_ts ON events(port, ts);
+CREATE INDEX IF NOT EXISTS idx_events_type_ts ON events(event_type, ts);
+CREATE INDEX IF NOT EXISTS idx_events_phone_ts ON events(phone, ts);
+"""
+
+_INSERT = (
+    "INSERT INTO events (timestamp, port, event_type, phone, details, ts) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    # Действует только на новую базу: до перехода в WAL и создания таблиц
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    # В режиме WAL NORMAL не теряет целостность, но не делает fsync на каждый commit
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _migrate(conn):
+    """Добавляет колонку ts в базы, созданные до её появления, и заполняет её."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(events)")}
+    if "ts" not in columns:
+        conn.execute("ALTER TABLE events ADD COLUMN ts INTEGER")
+        conn.commit()
+    lo, hi = conn.execute("SELECT MIN(id), MAX(id) FROM events WHERE ts IS NULL").fetchone()
+    if lo is None:
+        return
+    # timestamp хранится в локальном времени; порциями, чтобы не держать
+    # блокировку записи на всё время миграции
+    for start in range(lo, hi + 1, MIGRATION_CHUNK):
+        conn.execute(
+            "UPDATE events SET ts = CAST(strftime('%s', timestamp, 'utc') AS INTEGER) * 1000 "
+            "WHERE id >= ? AND id < ? AND ts IS NULL",
+            (start, start + MIGRATION_CHUNK),
+        )
+        conn.commit()
+
+
+def _create_schema(conn):
     conn.execute(_schema)
+    _migrate(conn)
+    conn.executescript(_indexes)
     conn.commit()
+
+
+def init_db():
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = _connect()
+    _create_schema(conn)
     conn.close()
 
+
+class _Writer:
+    """
+    Фоновый писатель событий: одна долгоживущая WAL-сессия SQLite,
+    пакетная запись через executemany по размеру пакета или по таймеру.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="event-writer", daemon=True
+                )
+                self._thread.start()
+
+    def put(self, row):
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            # Вызывающий поток не ждёт диск: событие теряется, но учитывается
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self, timeout=None):
+        """Блокирует, пока всё, что было в очереди до вызова, не записано."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def stop(self, timeout=5.0):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.queue.put(None)
+        self._thread.join(timeout)
+
+    def _take_dropped(self):
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        if not dropped:
+            return None
+        return _row("events_dropped", None, None, str(dropped))
+
+    def _run(self):
+        conn = _connect()
+        try:
+            # init_db вызывает только create_app; скрипты, бенчмарки и
+            # обработчики портов пишут события без него
+            try:
+                _create_schema(conn)
+            except sqlite3.Error as e:
+                print(f"event_logger: failed to create the events table: {e}")
+            while True:
+                batch = []
+                waiters = []
+                stop = False
+                item = self.queue.get()
+                deadline = time.monotonic() + FLUSH_INTERVAL
+                while True:
+                    if item is None:
+                        stop = True
+                    elif isinstance(item, threading.Event):
+                        waiters.append(item)
+                    else:
+                        batch.append(item)
+                    if stop or waiters or len(batch) >= BATCH_SIZE:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self.queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                dropped_row = self._take_dropped()
+                if dropped_row:
+                    batch.append(dropped_row)
+                if batch:
+                    try:
+                        conn.executemany(_INSERT, batch)
+                        conn.commit()
+                    except sqlite3.Error as e:
+                        print(f"event_logger: failed to write {len(batch)} events: {e}")
+                        conn.rollback()
+                for waiter in waiters:
+                    waiter.set()
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+
+_writer = _Writer()
+
+
+def _row(event_type, port, phone, details):
+    now = time.time()
+    stamp = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+    return (stamp, port, event_type, phone, details, int(now * 1000))
+
+
 def log_event(event_type: str, port: str = None, phone: str = None, details: str = ""):
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute(
-        "INSERT INTO events (timestamp, port, event_type, phone, details) VALUES (?, ?, ?, ?, ?)",
-        (ts, port, event_type, phone, details),
-    )
-    conn.commit()
-    conn.close()
+    """Ставит событие в очередь на запись и сразу возвращает управление."""
+    _writer.start()
+    _writer.put(_row(event_type, port, phone, details))
+
+
+def query_events(port=None, event_type=None, phone=None, since=None, until=None,
+                 before_id=None, limit=100):
+    """
+    Возвращает страницу событий от новых к старым и курсор следующей страницы.
+
+    since/until — границы по времени в миллисекундах Unix (включительно),
+    before_id — курсор: id последнего события предыдущей страницы.
+    Результат: (список dict, id для следующего запроса или None).
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    where = []
+    params = []
+    for column, value in (("port", port), ("event_type", event_type), ("phone", phone)):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        where.append("ts >= ?")
+        params.append(int(since))
+    if until is not None:
+        where.append("ts <= ?")
+        params.append(int(until))
+
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        if before_id is not None:
+            cursor_row = conn.execute(
+                "SELECT ts FROM events WHERE id = ?", (int(before_id),)
+            ).fetchone()
+            if cursor_row is None:
+                return [], None
+            # Ключ сортировки — (ts, id); ts <= ? задаёт границу диапазона индекса
+            where.append("ts <= ? AND (ts < ? OR id < ?)")
+            params.extend([cursor_row["ts"], cursor_row["ts"], int(before_id)])
+        sql = "SELECT id, ts, timestamp, port, event_type, phone, details FROM events"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY ts DESC, id DESC LIMIT ?"
+        rows = [dict(r) for r in conn.execute(sql, params + [limit + 1])]
+    finally:
+        conn.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1]["id"]
+    return rows, next_cursor
+
+
+def flush(timeout=None):
+    """Дожидается записи всех поставленных в очередь событий."""
+    _writer.flush(timeout)
+
+
+def shutdown():
+    """Записывает остаток очереди и останавливает фоновый писатель."""
+    _writer.stop()
+
+
+atexit.register(shutdown)
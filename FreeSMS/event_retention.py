@@ -0,0 +1,201 @@
+# FreeSMS/event_retention.py
+
+"""
+Хранение событий events.db: свёртка, удаление и архивирование старых записей.
+
+Сырые события старше ``raw_days`` сворачиваются в почасовые счётчики
+event_rollups (час, порт, тип события), после чего удаляются или
+переносятся в архивную базу. Работа идёт небольшими порциями в отдельных
+транзакциях с паузой между ними, чтобы фоновый писатель event_logger не
+ждал блокировку, а освободившиеся страницы возвращаются через
+incremental_vacuum.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from . import event_logger
+
+DEFAULTS = {
+    # Сколько дней хранить сырые события
+    "raw_days": 7,
+    # Переносить удаляемые события в архивную базу вместо удаления
+    "archive": False,
+    "archive_path": os.path.join(event_logger.BASE_DIR, "..", "events_archive.db"),
+    # Сколько строк обрабатывается одной транзакцией
+    "chunk_size": 5000,
+    # Пауза между порциями, секунды
+    "chunk_pause": 0.05,
+    # Сколько страниц освобождать после каждой порции
+    "vacuum_pages": 1000,
+    # Период запуска фоновой очистки, секунды
+    "interval": 600,
+    # Перестроить базу при старте, если в ней выключен incremental auto_vacuum
+    "vacuum_on_start": False,
+}
+
+HOUR_MS = 3600 * 1000
+
+_schema = """
+CREATE TABLE IF NOT EXISTS event_rollups (
+    hour INTEGER NOT NULL,
+    port TEXT NOT NULL DEFAULT '',
+    event_type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (hour, port, event_type)
+) WITHOUT ROWID;
+"""
+
+_archive_schema = """
+CREATE TABLE IF NOT EXISTS archive.events (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    port TEXT,
+    event_type TEXT NOT NULL,
+    phone TEXT,
+    details TEXT,
+    ts INTEGER
+);
+CREATE INDEX IF NOT EXISTS archive.idx_events_ts ON events(ts);
+"""
+
+_ROLLUP = """
+INSERT INTO event_rollups (hour, port, event_type, count)
+SELECT ts / {hour}, COALESCE(port, ''), event_type, COUNT(*)
+FROM events WHERE id IN (SELECT id FROM temp.retention_chunk)
+GROUP BY 1, 2, 3
+ON CONFLICT (hour, port, event_type) DO UPDATE SET count = count + excluded.count
+""".format(hour=HOUR_MS)
+
+
+def _connect(cfg):
+    conn = sqlite3.connect(event_logger.DB_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(_schema)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS retention_chunk (id INTEGER PRIMARY KEY)")
+    if cfg["archive"]:
+        conn.execute("ATTACH DATABASE ? AS archive", (cfg["archive_path"],))
+        conn.executescript(_archive_schema)
+    return conn
+
+
+def enable_incremental_vacuum():
+    """
+    Включает auto_vacuum=INCREMENTAL в существующей базе.
+
+    Для уже созданной базы режим меняется только полным VACUUM, который
+    перестраивает файл целиком, поэтому вызывается явно (vacuum_on_start).
+    """
+    conn = sqlite3.connect(event_logger.DB_PATH, timeout=30, isolation_level=None)
+    try:
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode != 2:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def run_once(config=None):
+    """
+    Один проход очистки. Возвращает число обработанных сырых событий.
+    """
+    cfg = dict(DEFAULTS, **(config or {}))
+    cutoff = int((time.time() - cfg["raw_days"] * 86400) * 1000)
+    processed = 0
+    conn = _connect(cfg)
+    try:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM temp.retention_chunk")
+                conn.execute(
+                    "INSERT INTO temp.retention_chunk "
+                    "SELECT id FROM events WHERE ts < ? ORDER BY ts LIMIT ?",
+                    (cutoff, cfg["chunk_size"]),
+                )
+                count = conn.execute("SELECT COUNT(*) FROM temp.retention_chunk").fetchone()[0]
+                if count:
+                    conn.execute(_ROLLUP)
+                    if cfg["archive"]:
+                        conn.execute(
+                            "INSERT OR IGNORE INTO archive.events "
+                            "SELECT id, timestamp, port, event_type, phone, details, ts "
+                            "FROM events WHERE id IN (SELECT id FROM temp.retention_chunk)"
+                        )
+                    conn.execute(
+                        "DELETE FROM events WHERE id IN (SELECT id FROM temp.retention_chunk)"
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if not count:
+                break
+            processed += count
+            conn.execute(f"PRAGMA incremental_vacuum({int(cfg['vacuum_pages'])})")
+            # Даём писателю событий занять блокировку между порциями
+            time.sleep(cfg["chunk_pause"])
+    finally:
+        conn.close()
+    return processed
+
+
+def query_rollups(port=None, event_type=None, since=None, until=None):
+    """Почасовые счётчики событий; since/until — миллисекунды Unix."""
+    where = []
+    params = []
+    if port is not None:
+        where.append("port = ?")
+        params.append(port)
+    if event_type is not None:
+        where.append("event_type = ?")
+        params.append(event_type)
+    if since is not None:
+        where.append("hour >= ?")
+        params.append(int(since) // HOUR_MS)
+    if until is not None:
+        where.append("hour <= ?")
+        params.append(int(until) // HOUR_MS)
+    sql = "SELECT hour * ? AS ts, port, event_type, count FROM event_rollups"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY hour"
+    conn = sqlite3.connect(event_logger.DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute(_schema)
+        return [dict(r) for r in conn.execute(sql, [HOUR_MS] + params)]
+    finally:
+        conn.close()
+
+
+_thread = None
+
+
+def start(config=None):
+    """Запускает фоновую очистку с периодом config['interval']."""
+    global _thread
+    cfg = dict(DEFAULTS, **(config or {}))
+    if _thread is not None and _thread.is_alive():
+        return
+
+    def loop():
+        if cfg["vacuum_on_start"]:
+            try:
+                enable_incremental_vacuum()
+            except sqlite3.Error as e:
+                event_logger.log_event("retention_error", details=str(e))
+        while True:
+            try:
+                removed = run_once(cfg)
+                if removed:
+                    event_logger.log_event("retention_compacted", details=str(removed))
+            except sqlite3.Error as e:
+                event_logger.log_event("retention_error", details=str(e))
+            time.sleep(cfg["interval"])
+
+    _thread = threading.Thread(target=loop, name="event-retention", daemon=True)
+    _thread.start()
@@ -0,0 +1,591 @@
+# FreeSMS/forwarding.py
+
+"""
+Пересылка входящих SMS по правилам с действием forward.
+
+Адресаты описываются в разделе "forwarding" config.json под именами,
+которые указываются в target правила; target вида http(s)://... — это
+веб-хук без отдельного описания. Если в адрес веб-хука подставляется
+{extract}, счётчики, ограничение параллельности и записи forward_queue
+относятся к шаблону адреса из правила, а сам адрес хранится у каждой
+задачи, поэтому число адресатов не растёт с числом разных значений.
+Типы адресатов:
+  http   POST с JSON сообщения (url, method, headers, timeout)
+  smtp   письмо через SMTP (host, port, from, to, username, password,
+         starttls, ssl)
+  file   строка JSON в конце файла (path)
+
+Доставка идёт в цикле asyncio в отдельном потоке: HTTP-запросы делят
+общий пул keep-alive соединений aiohttp, SMTP и запись в файл выполняются
+в потоках через asyncio.to_thread. Для каждого адресата одновременно
+выполняется не больше concurrency отправок и в памяти ждёт не больше
+queue_size сообщений. Что не поместилось, и каждая неудачная попытка
+сохраняются в таблицу forward_queue базы sms.db и повторяются с
+экспоненциальной паузой, после max_attempts попыток запись получает
+статус failed. Поэтому медленный адресат не занимает память и не держит
+потоки чтения модемов: submit() только кладёт задачу в очередь или
+пишет её в базу. Первая попытка идёт из памяти, поэтому сообщение, ещё
+не попавшее в forward_queue, при остановке процесса не пересылается.
+
+Параметры (раздел "forwarding" config.json):
+  destinations  {имя: описание адресата}
+  concurrency   одновременных отправок на адресата (4)
+  queue_size    сообщений адресата в памяти (1000)
+  pool_size     HTTP-соединений на все веб-хуки (100)
+  timeout       таймаут одной отправки, с (10)
+  max_attempts  число попыток (8)
+  retry_base    пауза перед второй попыткой, с (5); дальше удваивается
+  retry_max     максимальная пауза между попытками, с (3600)
+"""
+
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import smtplib
+import threading
+from email.message import EmailMessage
+
+from . import event_logger
+from . import sms_queue
+
+DEFAULTS = {
+    "destinations": {},
+    "concurrency": 4,
+    "queue_size": 1000,
+    "pool_size": 100,
+    "timeout": 10,
+    "max_attempts": 8,
+    "retry_base": 5,
+    "retry_max": 3600,
+}
+
+QUEUED = "queued"
+SENDING = "sending"
+FAILED = "failed"
+
+# Сколько записей из forward_queue поднимать за один проход
+PUMP_BATCH = 200
+# Как часто проверять forward_queue, если никто не разбудил раньше, с
+PUMP_INTERVAL = 5.0
+# HTTP-статусы, при которых повтор имеет смысл
+RETRY_STATUSES = (408, 425, 429)
+
+_schema = """
+CREATE TABLE IF NOT EXISTS forward_queue (
+    id INTEGER PRIMARY KEY,
+    destination TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at INTEGER NOT NULL,
+    created_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL,
+    error TEXT,
+    target TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_forward_due ON forward_queue(status, destination, next_attempt_at);
+"""
+
+_COLUMNS = (
+    "id", "destination", "payload", "status", "attempts",
+    "next_attempt_at", "created_at", "updated_at", "error", "target",
+)
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _migrate(conn):
+    """Добавляет колонку target в базы, созданные до веб-хуков с {extract}."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(forward_queue)")}
+    if "target" not in columns:
+        conn.execute("ALTER TABLE forward_queue ADD COLUMN target TEXT")
+
+
+def _is_url(name):
+    return name.startswith(("http://", "https://"))
+
+
+class ForwardError(Exception):
+    """Ошибка доставки; permanent=True — повторять бесполезно."""
+
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+# ---------- адресаты ----------
+class HttpSink:
+    def __init__(self, forwarder, spec):
+        self.forwarder = forwarder
+        self.url = spec["url"]
+        self.method = spec.get("method", "POST").upper()
+        self.headers = dict(spec.get("headers") or {})
+
+    async def send(self, payload, timeout, target=None):
+        import aiohttp
+
+        session = await self.forwarder._http_session()
+        try:
+            async with session.request(
+                self.method, target or self.url, json=payload, headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as resp:
+                # Тело дочитывается, чтобы соединение вернулось в пул
+                await resp.read()
+                if resp.status < 400:
+                    return
+                permanent = resp.status < 500 and resp.status not in RETRY_STATUSES
+                raise ForwardError(f"HTTP {resp.status}", permanent=permanent)
+        except aiohttp.ClientError as e:
+            raise ForwardError(str(e) or type(e).__name__)
+
+
+class SmtpSink:
+    def __init__(self, forwarder, spec):
+        self.spec = spec
+        to = spec.get("to") or []
+        self.to = [to] if isinstance(to, str) else list(to)
+        if not self.to:
+            raise ForwardError("smtp destination has no recipients", permanent=True)
+
+    async def send(self, payload, timeout, target=None):
+        await asyncio.to_thread(self._send, payload, timeout)
+
+    def _send(self, payload, timeout):
+        spec = self.spec
+        msg = EmailMessage()
+        msg["From"] = spec.get("from") or spec.get("username") or "freesms@localhost"
+        msg["To"] = ", ".join(self.to)
+        msg["Subject"] = f"SMS {payload.get('phone') or ''} → {payload.get('port')}"
+        msg.set_content(payload.get("text") or "")
+        smtp_cls = smtplib.SMTP_SSL if spec.get("ssl") else smtplib.SMTP
+        try:
+            with smtp_cls(spec.get("host", "localhost"), spec.get("port", 0), timeout=timeout) as smtp:
+                if spec.get("starttls"):
+                    smtp.starttls()
+                if spec.get("username"):
+                    smtp.login(spec["username"], spec.get("password", ""))
+                smtp.send_message(msg)
+        except smtplib.SMTPResponseException as e:
+            # 4xx — временный отказ сервера, 5xx — окончательный
+            raise ForwardError(f"SMTP {e.smtp_code}", permanent=e.smtp_code >= 500)
+        except (smtplib.SMTPException, OSError) as e:
+            raise ForwardError(str(e) or type(e).__name__)
+
+
+class FileSink:
+    def __init__(self, forwarder, spec):
+        self.path = spec["path"]
+        self._lock = threading.Lock()
+
+    async def send(self, payload, timeout, target=None):
+        await asyncio.to_thread(self._write, json.dumps(payload, ensure_ascii=False) + "\n")
+
+    def _write(self, line):
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as fh:
+                fh.write(line)
+        except OSError as e:
+            raise ForwardError(str(e))
+
+
+SINKS = {"http": HttpSink, "smtp": SmtpSink, "file": FileSink}
+
+
+class _Destination:
+    """Адресат с его ограничителем параллельности и счётчиками."""
+
+    def __init__(self, name, spec, sink, concurrency):
+        self.name = name
+        self.spec = spec
+        self.sink = sink
+        self.concurrency = concurrency
+        self.semaphore = None  # создаётся в цикле пересылки
+        self.in_memory = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.last_error = None
+        self.last_ok = None
+
+    def snapshot(self):
+        return {
+            "type": self.spec.get("type", "http"),
+            "concurrency": self.concurrency,
+            "in_memory": self.in_memory,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "last_error": self.last_error,
+            "last_ok": self.last_ok,
+        }
+
+
+class Forwarder:
+    def __init__(self, config=None, db_path=sms_queue.DB_PATH):
+        self.config = dict(DEFAULTS, **(config or {}))
+        self.db_path = db_path
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._destinations = {}
+        self._loop = None
+        self._thread = None
+        self._wake = None
+        self._session = None
+        self._rng = random.Random()
+
+    # ---------- база ----------
+    def start(self):
+        """Открывает базу, возвращает в очередь прерванные отправки и запускает цикл."""
+        with self._lock:
+            if self._loop is not None:
+                return
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_schema)
+            _migrate(conn)
+            # Процесс остановился посреди отправки: повторяем (возможен дубль)
+            conn.execute(
+                "UPDATE forward_queue SET status = ? WHERE status = ?", (QUEUED, SENDING)
+            )
+            conn.commit()
+            self._conn = conn
+            ready = threading.Event()
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._run_loop, args=(self._loop, ready), name="sms-forwarding",
+                daemon=True,
+            )
+            self._thread.start()
+        ready.wait()
+
+    def stop(self):
+        """Закрывает HTTP-соединения и останавливает цикл; очередь в базе остаётся."""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close_session(), loop).result(10)
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(10)
+
+    def _query(self, sql, params=()):
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _update(self, sql, params=()):
+        with self._db_lock:
+            cur = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cur.rowcount
+
+    def _insert(self, destination, payload, status, attempts, next_at, error=None, target=None):
+        now = _now_ms()
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO forward_queue (destination, payload, status, attempts, "
+                "next_attempt_at, created_at, updated_at, error, target) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (destination, json.dumps(payload, ensure_ascii=False), status, attempts,
+                 next_at, now, now, error, target),
+            )
+            self._conn.commit()
+
+    # ---------- адресаты ----------
+    def destination(self, name):
+        """Адресат по имени из конфигурации или URL веб-хука."""
+        with self._lock:
+            dest = self._destinations.get(name)
+            if dest is not None:
+                return dest
+            spec = self.config["destinations"].get(name)
+            if spec is None and _is_url(name):
+                spec = {"type": "http", "url": name}
+            if spec is None:
+                raise ForwardError(f"unknown destination {name!r}", permanent=True)
+            sink_cls = SINKS.get(spec.get("type", "http"))
+            if sink_cls is None:
+                raise ForwardError(f"unknown destination type {spec.get('type')!r}", permanent=True)
+            dest = _Destination(
+                name, spec, sink_cls(self, spec),
+                max(1, int(spec.get("concurrency", self.config["concurrency"]))),
+            )
+            self._destinations[name] = dest
+            return dest
+
+    def destinations(self):
+        """Описания адресатов из конфигурации без паролей."""
+        return {
+            name: {k: v for k, v in spec.items() if k != "password"}
+            for name, spec in self.config["destinations"].items()
+        }
+
+    # ---------- постановка в очередь ----------
+    def submit(self, destination, payload, target=None):
+        """
+        Ставит payload на доставку адресату destination и сразу возвращает
+        управление. target — адрес веб-хука для этой задачи, если
+        destination — шаблон адреса. Если очередь адресата в памяти
+        заполнена, задача сохраняется в forward_queue и будет отправлена,
+        когда очередь освободится.
+        """
+        dest = self.destination(destination)
+        loop = self._loop
+        with self._lock:
+            accepted = loop is not None and dest.in_memory < self.config["queue_size"]
+            if accepted:
+                dest.in_memory += 1
+        if accepted:
+            loop.call_soon_threadsafe(self._dispatch, dest, None, payload, 0, target)
+        else:
+            self._insert(destination, payload, QUEUED, 0, _now_ms(), target=target)
+
+    def forward(self, record, rule, value):
+        """Обработчик действия forward движка правил."""
+        from .rules import render_target
+
+        payload = dict(record, rule=rule["id"], extract=value)
+        target = render_target(rule, value)
+        if target == rule["target"] or target in self.config["destinations"]:
+            self.submit(target, payload)
+        elif _is_url(target) and _is_url(rule["target"]):
+            self.submit(rule["target"], payload, target)
+        else:
+            raise ForwardError(f"unknown destination {target!r}", permanent=True)
+
+    # ---------- цикл доставки ----------
+    def _run_loop(self, loop, ready):
+        asyncio.set_event_loop(loop)
+        self._wake = asyncio.Event()
+        loop.create_task(self._pump())
+        loop.call_soon(ready.set)
+        loop.run_forever()
+        # После stop(): незавершённые попытки отменяются, задачи из
+        # forward_queue вернутся в очередь при следующем старте
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.close()
+
+    async def _http_session(self):
+        if self._session is None:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.config["pool_size"])
+            )
+        return self._session
+
+    async def _close_session(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _dispatch(self, dest, row_id, payload, attempts, target):
+        self._loop.create_task(self._deliver(dest, row_id, payload, attempts, target))
+
+    async def _deliver(self, dest, row_id, payload, attempts, target):
+        if dest.semaphore is None:
+            dest.semaphore = asyncio.Semaphore(dest.concurrency)
+        timeout = dest.spec.get("timeout", self.config["timeout"])
+        error = None
+        try:
+            async with dest.semaphore:
+                await asyncio.wait_for(dest.sink.send(payload, timeout, target), timeout + 1)
+        except asyncio.TimeoutError:
+            error = ForwardError("timeout")
+        except ForwardError as e:
+            error = e
+        except Exception as e:
+            error = ForwardError(str(e) or type(e).__name__)
+        attempts += 1
+        try:
+            await asyncio.to_thread(self._record, dest, row_id, payload, attempts, error, target)
+        except Exception as e:
+            event_logger.log_event("forward_error", details=f"{dest.name}: {e}")
+        finally:
+            with self._lock:
+                dest.in_memory -= 1
+            self._wake.set()
+
+    def _record(self, dest, row_id, payload, attempts, error, target=None):
+        """Записывает итог попытки в forward_queue (выполняется вне цикла)."""
+        now = _now_ms()
+        if error is None:
+            if row_id is not None:
+                self._update("DELETE FROM forward_queue WHERE id = ?", (row_id,))
+            with self._lock:
+                dest.sent += 1
+                dest.last_ok = now
+            event_logger.log_event(
+                "sms_forward", port=payload.get("port"), phone=payload.get("phone"),
+                details=f"{dest.name} {payload.get('id')}",
+            )
+            return
+        message = str(error) or type(error).__name__
+        final = error.permanent or attempts >= self.config["max_attempts"]
+        with self._lock:
+            dest.last_error = message
+            if final:
+                dest.failed += 1
+            else:
+                dest.retried += 1
+        if final:
+            status, next_at = FAILED, now
+            event_logger.log_event(
+                "forward_failed", port=payload.get("port"), phone=payload.get("phone"),
+                details=f"{dest.name}: {message}",
+            )
+        else:
+            status, next_at = QUEUED, now + int(self._retry_delay(attempts) * 1000)
+        if row_id is None:
+            self._insert(dest.name, payload, status, attempts, next_at, message, target)
+        else:
+            self._update(
+                "UPDATE forward_queue SET status = ?, attempts = ?, next_attempt_at = ?, "
+                "updated_at = ?, error = ? WHERE id = ?",
+                (status, attempts, next_at, now, message, row_id),
+            )
+
+    def _retry_delay(self, attempts):
+        cfg = self.config
+        delay = min(cfg["retry_max"], cfg["retry_base"] * (2 ** (attempts - 1)))
+        return self._rng.uniform(delay / 2, delay)
+
+    async def _pump(self):
+        """Поднимает из forward_queue задачи, которым пора, пока у адресатов есть место."""
+        while True:
+            try:
+                wait = await asyncio.to_thread(self._claim_due)
+            except Exception as e:
+                event_logger.log_event("forward_error", details=str(e))
+                wait = PUMP_INTERVAL
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), min(wait, PUMP_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+
+    def _claim_due(self):
+        """Забирает задачи, которым пора, и возвращает, сколько ждать до следующей."""
+        now = _now_ms()
+        due = self._query(
+            "SELECT destination, COUNT(*) FROM forward_queue "
+            "WHERE status = ? AND next_attempt_at <= ? GROUP BY destination",
+            (QUEUED, now),
+        )
+        for name, _ in due:
+            try:
+                dest = self.destination(name)
+            except ForwardError as e:
+                # Адресат убран из конфигурации: его задачи уже не доставить
+                self._update(
+                    "UPDATE forward_queue SET status = ?, updated_at = ?, error = ? "
+                    "WHERE destination = ? AND status = ?",
+                    (FAILED, now, str(e), name, QUEUED),
+                )
+                continue
+            with self._lock:
+                room = min(PUMP_BATCH, self.config["queue_size"] - dest.in_memory)
+            if room <= 0:
+                continue
+            rows = self._query(
+                "SELECT id, payload, attempts, target FROM forward_queue "
+                "WHERE status = ? AND destination = ? AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (QUEUED, name, now, room),
+            )
+            claimed = []
+            for row_id, payload, attempts, target in rows:
+                if self._update(
+                    "UPDATE forward_queue SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                    (SENDING, now, row_id, QUEUED),
+                ):
+                    claimed.append((row_id, json.loads(payload), attempts, target))
+            with self._lock:
+                dest.in_memory += len(claimed)
+            for row_id, payload, attempts, target in claimed:
+                self._loop.call_soon_threadsafe(
+                    self._dispatch, dest, row_id, payload, attempts, target
+                )
+        upcoming = self._query(
+            "SELECT MIN(next_attempt_at) FROM forward_queue WHERE status = ?", (QUEUED,)
+        )[0][0]
+        return PUMP_INTERVAL if upcoming is None else max(0.05, (upcoming - _now_ms()) / 1000.0)
+
+    # ---------- состояние ----------
+    def status(self):
+        """Счётчики адресатов и число их задач в forward_queue по статусам."""
+        stored = {}
+        for name, status, count in self._query(
+            "SELECT destination, status, COUNT(*) FROM forward_queue GROUP BY destination, status"
+        ):
+            stored.setdefault(name, {})[status] = count
+        with self._lock:
+            active = {name: d.snapshot() for name, d in self._destinations.items()}
+        result = {}
+        for name in set(self.config["destinations"]) | set(active) | set(stored):
+            item = active.get(name) or {
+                "type": self.config["destinations"].get(name, {}).get("type", "http")
+            }
+            item["stored"] = stored.get(name, {})
+            result[name] = item
+        return result
+
+    def failed(self, destination=None, limit=100):
+        """Записи, доставить которые не удалось, новые первыми."""
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM forward_queue WHERE status = ?"
+        params = [FAILED]
+        if destination:
+            sql += " AND destination = ?"
+            params.append(destination)
+        sql += " ORDER BY updated_at DESC LIMIT ?"
+        params.append(limit)
+        result = []
+        for row in self._query(sql, params):
+            item = dict(zip(_COLUMNS, row))
+            item["payload"] = json.loads(item["payload"])
+            result.append(item)
+        return result
+
+    def retry_failed(self, destination=None):
+        """Возвращает неудавшиеся записи в очередь с обнулённым счётчиком попыток."""
+        sql = (
+            "UPDATE forward_queue SET status = ?, attempts = 0, next_attempt_at = ?, "
+            "updated_at = ? WHERE status = ?"
+        )
+        now = _now_ms()
+        params = [QUEUED, now, now, FAILED]
+        if destination:
+            sql += " AND destination = ?"
+            params.append(destination)
+        count = self._update(sql, params)
+        if count and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        return count
+
+
+_forwarder = None
+_forwarder_lock = threading.Lock()
+
+
+def start(config=None):
+    """Создаёт и запускает пересылку процесса с параметрами config."""
+    global _forwarder
+    with _forwarder_lock:
+        if _forwarder is None:
+            _forwarder = Forwarder(config)
+        _forwarder.start()
+    return _forwarder
+
+
+def get_forwarder():
+    """Пересылка процесса; при первом обращении запускается с настройками по умолчанию."""
+    return _forwarder if _forwarder is not None else start()
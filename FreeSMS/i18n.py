@@ -24,15 +24,67 @@ def _find_file(fname: str) -> str:
 TRANSLATIONS_PATH = _find_file("translations.json")
 CONFIG_PATH       = _find_file("config.json")
 
-# Загружаем переводы один раз
-try:
-    if not TRANSLATIONS_PATH:
-        raise FileNotFoundError(f"translations.json not found in {MODULE_PATH} or {PROJECT_ROOT}")
-    with open(TRANSLATIONS_PATH, encoding="utf-8") as f:
-        TRANSLATIONS = json.load(f)
-except Exception as e:
-    print(f"Warning: не удалось загрузить translations.json: {e}")
-    TRANSLATIONS = {}
+# Переводы загружаются один раз, при первом обращении
+_translations = None
+# Плоские таблицы {язык: {"section.key": строка}}, строятся вместе с переводами
+_tables = None
+# Строки без вариантов по языкам: {"section.key": строка}
+_plain = None
+
+
+def get_translations() -> dict:
+    """Возвращает содержимое translations.json, загружая его при первом вызове."""
+    global _translations
+    if _translations is not None:
+        return _translations
+    try:
+        if not TRANSLATIONS_PATH:
+            raise FileNotFoundError(f"translations.json not found in {MODULE_PATH} or {PROJECT_ROOT}")
+        with open(TRANSLATIONS_PATH, encoding="utf-8") as f:
+            _translations = json.load(f)
+    except Exception as e:
+        print(f"Warning: не удалось загрузить translations.json: {e}")
+        _translations = {}
+    return _translations
+
+
+def _is_lang_map(node) -> bool:
+    return isinstance(node, dict) and bool(node) and all(
+        isinstance(v, str) for v in node.values()
+    )
+
+
+def _build_tables():
+    """
+    Разворачивает вложенные переводы в плоские таблицы по языкам,
+    чтобы t() делал один поиск по словарю вместо обхода дерева.
+    """
+    global _tables, _plain
+    tables = {}
+    plain = {}
+    stack = [("", get_translations())]
+    while stack:
+        prefix, node = stack.pop()
+        for name, child in node.items():
+            key = f"{prefix}.{name}" if prefix else name
+            if _is_lang_map(child):
+                for lang, text in child.items():
+                    tables.setdefault(lang, {})[key] = text
+                    # Прямое обращение к варианту: t("section.key.en")
+                    plain[f"{key}.{lang}"] = text
+            elif isinstance(child, dict):
+                stack.append((key, child))
+            elif child:
+                plain[key] = str(child)
+    _plain = plain
+    _tables = tables
+
+
+def available_languages() -> list:
+    """Языки, для которых есть хотя бы один перевод."""
+    if _tables is None:
+        _build_tables()
+    return list(_tables)
 
 # Кэш текущего языка
 _current_lang = None
@@ -61,8 +113,12 @@ def get_language() -> str:
 def set_language(lang: str) -> None:
     """
     Записывает выбранный язык в config.json (ключ "language").
+    Это язык по умолчанию для всего сервера; язык отдельного
+    пользователя берётся из cookie через resolve_language().
     """
     global _current_lang
+    if get_language() == lang:
+        return
     _current_lang = lang
 
     if not PROJECT_ROOT:
@@ -85,22 +141,30 @@ def set_language(lang: str) -> None:
     except Exception as e:
         print(f"Error writing config.json: {e}")
 
+def resolve_language(requested: str = None) -> str:
+    """
+    Язык для одного запроса: requested (обычно из cookie), если для него
+    есть переводы, иначе язык по умолчанию. Ничего не пишет на диск.
+    """
+    if requested and requested in available_languages():
+        return requested
+    return get_language()
+
+
 def t(key: str, lang: str = None) -> str:
     """
     Переводит по ключу "section.sub.key". Если lang не передан — берётся из get_language().
-    Если перевод не найден — возвращает сам ключ.
+    Если перевода на lang нет — берётся английский, если нет и его — возвращает сам ключ.
     """
     if lang is None:
         lang = get_language()
-
-    node = TRANSLATIONS
-    for part in key.split("."):
-        if not isinstance(node, dict):
-            break
-        node = node.get(part, {})
-
-    # Если node — dict, значит не нашли конкретную строку, но можем выдать node[lang]
-    if isinstance(node, dict):
-        return node.get(lang, node.get("en", key))
-    # Иначе node — строка, либо пустое значение
-    return str(node or key)
+    if _tables is None:
+        _build_tables()
+
+    text = _tables.get(lang, {}).get(key)
+    if text is not None:
+        return text
+    text = _plain.get(key)
+    if text is not None:
+        return text
+    return _tables.get("en", {}).get(key, key)
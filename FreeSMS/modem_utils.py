@@ -1,74 +1,376 @@
 # FreeSMS/modem_utils.py
 
-import os
-import json
 import re
-import glob
-
-import pycountry
-import asyncio
-import gammu
+import time
+import threading
+from contextlib import contextmanager
 
+from . import operator_index
+from .backends import get_backend
+from .port_health import PORT_HEALTH, PortUnavailableError
 from .i18n import t, get_language
 
-# Путь к файлу operators.json (лежит в корне проекта)
-BASE = os.path.dirname(__file__)
-OPS_PATH = os.path.abspath(os.path.join(BASE, "..", "operators.json"))
-
-# Загружаем список операторов: MCC+MNC → "ccc-operator" и MCC → страна
-try:
-    with open(OPS_PATH, encoding="utf-8") as f:
-        _ops_list = json.load(f)
-except FileNotFoundError:
-    _ops_list = []
-
-# Собираем маппинги
-OPS_MAP = {}
-COUNTRY_MAP = {}
-for entry in _ops_list:
-    mcc = str(entry.get("mcc", ""))
-    mnc = str(entry.get("mnc", ""))
-    country_code = entry.get("country", "").lower()  # ожидаем трибуквенный код страны
-    operator_code = entry.get("operator", "").lower()
-    if mcc and mnc and country_code and operator_code:
-        OPS_MAP[mcc + mnc] = f"{country_code}-{operator_code}"
-        COUNTRY_MAP.setdefault(mcc, country_code)
+# Поиск операторов и стран идёт по скомпилированному индексу operators.idx
+# (см. operator_index), который загружается при первом обращении.
+
+
+def __getattr__(name):
+    """
+    OPS_MAP (MCC+MNC → "ccc-operator") и COUNTRY_MAP (MCC → страна)
+    строятся из индекса только по требованию: горячий путь ими не пользуется.
+    """
+    if name == "OPS_MAP":
+        value = dict(operator_index.get_index().items())
+    elif name == "COUNTRY_MAP":
+        value = dict(operator_index.get_index().countries())
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+# Сколько секунд сессия может простаивать, прежде чем её закроет фоновый чистильщик
+SESSION_IDLE_TIMEOUT = 300.0
+# Если сессия не использовалась дольше этого времени, перед выдачей её проверяют
+SESSION_HEALTH_INTERVAL = 30.0
+
+def _is_connection_error(exc):
+    """Ошибки, после которых сессию нельзя использовать повторно (решает бэкенд)."""
+    return get_backend().is_connection_error(exc)
+
+
+class SessionOpenError(Exception):
+    """Сессию порта не удалось открыть (Init не прошёл); исходная ошибка — в __cause__."""
+
+
+def _record_error(port, exc):
+    """
+    Учитывает ошибку операции с портом в port_health. Порт отказал, если
+    сессия не открылась или оборвалось соединение; ошибка самой команды
+    значит, что модем ответил, и порт жив.
+    """
+    if isinstance(exc, SessionOpenError) or _is_connection_error(exc):
+        PORT_HEALTH.record_failure(port, exc)
+    else:
+        PORT_HEALTH.record_success(port)
+
+
+class _Session:
+    """Открытое и инициализированное соединение с одним портом."""
+
+    def __init__(self, port):
+        self.port = port
+        self.lock = threading.RLock()
+        self.sm = None
+        self.last_used = 0.0
+
+    def open(self):
+        self.sm = get_backend().open(self.port)
+        self.last_used = time.monotonic()
+
+    def close(self):
+        sm, self.sm = self.sm, None
+        if sm is None:
+            return
+        try:
+            sm.Terminate()
+        except Exception:
+            pass
+
+    def is_healthy(self):
+        """Дешёвый запрос к модему, чтобы убедиться, что порт ещё отвечает."""
+        try:
+            self.sm.GetSignalQuality()
+            return True
+        except Exception:
+            return False
+
+
+class SessionPool:
+    """
+    Пул постоянных сессий модемов: по одному StateMachine на порт.
+
+    Сессия открывается (ReadConfig/SetConfig/Init) при первом обращении
+    и переиспользуется последующими вызовами. Доступ к порту сериализуется
+    блокировкой сессии. Сессии, простоявшие дольше ``idle_timeout``,
+    закрывает фоновый поток.
+    """
+
+    def __init__(self, idle_timeout=SESSION_IDLE_TIMEOUT,
+                 health_interval=SESSION_HEALTH_INTERVAL):
+        self.idle_timeout = idle_timeout
+        self.health_interval = health_interval
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def _get(self, port):
+        with self._lock:
+            session = self._sessions.get(port)
+            if session is None:
+                session = self._sessions[port] = _Session(port)
+            if self._reaper is None:
+                self._reaper = threading.Thread(
+                    target=self._reap_loop, name="modem-session-reaper", daemon=True
+                )
+                self._reaper.start()
+            return session
+
+    @contextmanager
+    def session(self, port):
+        """
+        Выдаёт инициализированный StateMachine для порта.
+
+        Если модем перестал отвечать, сессия переоткрывается; ошибка
+        соединения внутри блока закрывает сессию, и следующий вызов
+        подключится заново. Если сессию открыть не удалось, бросается
+        SessionOpenError, чтобы её не спутать с ошибкой команды в блоке.
+        """
+        session = self._get(port)
+        with session.lock:
+            if session.sm is not None:
+                idle = time.monotonic() - session.last_used
+                if idle > self.health_interval and not session.is_healthy():
+                    session.close()
+            if session.sm is None:
+                try:
+                    session.open()
+                except Exception as exc:
+                    session.close()
+                    raise SessionOpenError(str(exc) or type(exc).__name__) from exc
+            try:
+                yield session.sm
+            except Exception as exc:
+                if _is_connection_error(exc):
+                    session.close()
+                raise
+            finally:
+                session.last_used = time.monotonic()
+
+    def invalidate(self, port):
+        """Принудительно закрывает сессию порта (например, после отключения)."""
+        with self._lock:
+            session = self._sessions.pop(port, None)
+        if session is not None:
+            with session.lock:
+                session.close()
+
+    def close_idle(self):
+        """Закрывает сессии, которые не использовались дольше idle_timeout."""
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            if session.sm is None or now - session.last_used < self.idle_timeout:
+                continue
+            # Не ждём занятый порт: его закроем на следующем проходе
+            if not session.lock.acquire(blocking=False):
+                continue
+            try:
+                if now - session.last_used >= self.idle_timeout:
+                    session.close()
+            finally:
+                session.lock.release()
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            with session.lock:
+                session.close()
+
+    def _reap_loop(self):
+        interval = max(1.0, min(self.idle_timeout, 60.0) / 2)
+        while True:
+            time.sleep(interval)
+            try:
+                self.close_idle()
+            except Exception:
+                pass
+
+
+SESSION_POOL = SessionPool()
 
 
 def list_modem_ports():
     """Возвращает список доступных COM-портов для модемов."""
-    try:
-        devices = gammu.GetConfig(0)
-        ports = [devices.get("Device")] if devices else []
-        if ports and ports[0]:
-            return ports
-    except Exception:
-        ports = []
-
-    # Fallback scanning when Gammu detection fails
-    if os.name == "nt":
-        ports.extend([f"COM{i}" for i in range(1, 257)])
-    else:
-        patterns = ["/dev/ttyUSB*", "/dev/ttyACM*", "/dev/cu.*", "/dev/tty.*"]
-        for pat in patterns:
-            ports.extend(glob.glob(pat))
-    return ports
+    return get_backend().list_ports()
 
 
 def send_at_command(port, command, timeout=1.0):
     """Отправляет AT-команду через библиотеку Gammu и возвращает ответ."""
+    # Порт в паузе после отказа: не ждём таймаута Gammu
+    if not PORT_HEALTH.should_probe(port):
+        return ""
     try:
-        sm = gammu.StateMachine()
-        sm.ReadConfig()
-        sm.SetConfig(0, {"Device": port, "Connection": "at"})
-        sm.Init()
-        return sm.SendATCommand(command)
-    except Exception:
+        with SESSION_POOL.session(port) as sm:
+            response = sm.SendATCommand(command)
+    except Exception as exc:
+        _record_error(port, exc)
         return ""
+    PORT_HEALTH.record_success(port)
+    return response
+
+
+def send_sms(port, phone, text):
+    """
+    Отправляет SMS с порта; длинный текст уходит несколькими частями.
+    Возвращает список MessageReference частей. Ошибки модема пробрасываются,
+    для порта в паузе после отказа — PortUnavailableError.
+    """
+    # Кодируем до should_probe: ошибка кодирования не должна оставить порт
+    # в пробном режиме без record_success/record_failure
+    parts = get_backend().encode_sms(phone, text)
+    if not PORT_HEALTH.should_probe(port):
+        raise PortUnavailableError(f"{port}: port is backing off after failures")
+    try:
+        with SESSION_POOL.session(port) as sm:
+            refs = [sm.SendSMS(part) for part in parts]
+    except Exception as exc:
+        _record_error(port, exc)
+        raise
+    PORT_HEALTH.record_success(port)
+    return refs
+
+
+def read_sms(port, limit=100):
+    """
+    Читает до limit SMS из памяти модема (папка 0) и возвращает их как есть,
+    словарями Gammu. Для порта в паузе после отказа и пустой памяти — [].
+    """
+    if PORT_HEALTH.is_suspect(port):
+        return []
+    messages = []
+    with SESSION_POOL.session(port) as sm:
+        try:
+            status = sm.GetSMSStatus()
+        except Exception as exc:
+            _raise_if_disconnected(exc)
+            return []
+        if not status.get("SIMUsed", 0) + status.get("PhoneUsed", 0):
+            return []
+        start = True
+        location = 0
+        while len(messages) < limit:
+            try:
+                if start:
+                    parts = sm.GetNextSMS(Folder=0, Start=True)
+                    start = False
+                else:
+                    parts = sm.GetNextSMS(Folder=0, Location=location)
+            except Exception as exc:
+                # ERR_EMPTY и подобные — сообщений больше нет
+                _raise_if_disconnected(exc)
+                break
+            if not parts:
+                break
+            location = parts[0]["Location"]
+            messages.extend(parts)
+    return messages
+
+
+def delete_sms(port, locations):
+    """Удаляет SMS из памяти модема по списку (Folder, Location)."""
+    with SESSION_POOL.session(port) as sm:
+        for folder, location in locations:
+            try:
+                sm.DeleteSMS(folder, location)
+            except Exception as exc:
+                _raise_if_disconnected(exc)
+
+
+# Сколько секунд ждать ответ сети на один шаг USSD-сессии
+USSD_STEP_TIMEOUT = 20.0
+# Как часто читать модем, пока ответа нет, с
+USSD_POLL_INTERVAL = 0.1
+
+
+def _wait_ussd(sm, answers, timeout):
+    """Ждёт, пока обработчик входящих положит ответ сети в answers; None по таймауту."""
+    deadline = time.monotonic() + timeout
+    while True:
+        sm.ReadDevice()
+        if answers:
+            return answers.pop(0)
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(USSD_POLL_INTERVAL)
+
+
+def send_ussd(port, code, replies=(), timeout=USSD_STEP_TIMEOUT):
+    """
+    Набирает USSD-код и, пока сеть показывает меню, по очереди отправляет
+    ответы из replies (пункты меню). Возвращает dict:
+      port, iccid  — порт и SIM, для которой получен ответ;
+      status       — последний статус Gammu (NoActionNeeded, ActionNeeded,
+                     Terminated, ...) или Timeout, если сеть не ответила
+                     за timeout секунд;
+      response     — текст последнего ответа;
+      steps        — [{"input", "response", "status"}] по шагам.
+    Меню, оставшееся открытым, закрывается. Ошибки модема пробрасываются,
+    для порта в паузе после отказа — PortUnavailableError.
+    """
+    if not PORT_HEALTH.should_probe(port):
+        raise PortUnavailableError(f"{port}: port is backing off after failures")
+    answers = []
+
+    def on_incoming(sm, kind, data):
+        if kind == "USSD":
+            answers.append(data)
+
+    steps = []
+    status = "Timeout"
+    try:
+        with SESSION_POOL.session(port) as sm:
+            iccid = cached_iccid(port)
+            if iccid is None:
+                try:
+                    iccid = sm.GetICC() or None
+                except Exception as exc:
+                    _raise_if_disconnected(exc)
+            sm.SetIncomingCallback(on_incoming)
+            try:
+                sm.SetIncomingUSSD(True)
+                # Запоздавший ответ на прошлую сессию не должен сойти за новый
+                sm.ReadDevice()
+                for text in [code, *replies]:
+                    del answers[:]
+                    sm.DialService(text)
+                    answer = _wait_ussd(sm, answers, timeout)
+                    if answer is None:
+                        status = "Timeout"
+                        steps.append({"input": text, "response": None, "status": status})
+                        break
+                    status = answer.get("Status", "Unknown")
+                    steps.append({"input": text, "response": answer.get("Text", ""), "status": status})
+                    if status != "ActionNeeded":
+                        break
+                if status in ("ActionNeeded", "Timeout"):
+                    # Не оставляем сессию висеть в сети до её собственного таймаута
+                    try:
+                        sm.SendATCommand("AT+CUSD=2")
+                    except Exception as exc:
+                        _raise_if_disconnected(exc)
+            finally:
+                # Сессию порта используют и другие операции
+                sm.SetIncomingCallback(None)
+    except Exception as exc:
+        _record_error(port, exc)
+        raise
+    PORT_HEALTH.record_success(port)
+    return {
+        "port": port,
+        "iccid": iccid,
+        "status": status,
+        "response": steps[-1]["response"],
+        "steps": steps,
+    }
 
 
 async def send_at_command_async(port, command, timeout=1.0):
     """Асинхронная отправка AT-команды через Gammu."""
+    import asyncio
     return await asyncio.to_thread(send_at_command, port, command, timeout)
 
 
@@ -114,97 +416,95 @@ def get_country_from_imsi(imsi):
     """
     Определяет трёхбуквенный ISO-код страны по MCC из IMSI.
     """
-    if len(imsi) < 3 or not imsi[:3].isdigit():
-        return ""
-    mcc = imsi[:3]
-    if mcc in COUNTRY_MAP:
-        return COUNTRY_MAP[mcc]
-    country = pycountry.countries.get(numeric=mcc)
-    if country:
-        return country.alpha_3.lower()
-    return ""
+    return operator_index.get_index().country(imsi[:3])
 
 
 def get_operator_from_imsi(imsi):
     """
-    Определяет код оператора вида 'ccc-operator' по первым 5 цифрам IMSI.
+    Определяет код оператора вида 'ccc-operator' по MCC+MNC из IMSI
+    (MNC из двух или трёх цифр в зависимости от MCC).
     """
-    if len(imsi) >= 5 and imsi[:5].isdigit():
-        return OPS_MAP.get(imsi[:5], "unknown")
-    return "unknown"
+    return operator_index.get_index().operator(imsi) or "unknown"
+
+
+def _iccid_digits(iccid):
+    if iccid.isdigit():
+        return iccid
+    return "".join(ch for ch in iccid if ch.isdigit())
 
 
 def get_country_from_iccid(iccid: str) -> str:
     """Возвращает трёхбуквенный ISO-код страны по MCC из ICCID."""
-    digits = re.sub(r"\D", "", iccid)
+    digits = _iccid_digits(iccid)
     if not digits.startswith("89") or len(digits) < 5:
         return ""
-    mcc = digits[2:5]
-    if mcc in COUNTRY_MAP:
-        return COUNTRY_MAP[mcc]
-    country = pycountry.countries.get(numeric=mcc)
-    if country:
-        return country.alpha_3.lower()
-    return ""
+    return operator_index.get_index().country(digits[2:5])
 
 
 def get_operator_from_iccid(iccid: str) -> str:
     """Возвращает код оператора вида 'ccc-operator' по ICCID."""
-    digits = re.sub(r"\D", "", iccid)
+    digits = _iccid_digits(iccid)
     if not digits.startswith("89") or len(digits) < 7:
         return "unknown"
-    mcc = digits[2:5]
-    # Сначала пробуем MNC из трёх цифр
-    if len(digits) >= 8:
-        mnc = digits[5:8]
-        code = OPS_MAP.get(mcc + mnc)
-        if code:
-            return code
-    # Затем пробуем двухзначный MNC
-    mnc = digits[5:7]
-    return OPS_MAP.get(mcc + mnc, "unknown")
-
-
-def get_modem_info(port, lang=None):
-    """
-    Собирает информацию по модему на указанном порту.
-    Принимает:
-      - port (строка)
-      - lang (код языка, например 'ru', 'en', 'zh') — опционально.
-    Возвращает dict с полями:
-      port, model, vendor, imsi, operator, sim_country,
-      network, signal, status, sms, voice, imei, iccid, cpin, ussd
-    """
-    if lang is None:
-        lang = get_language()
-
-    info = {"port": port}
+    return operator_index.get_index().operator(digits[2:]) or "unknown"
 
-    sm = gammu.StateMachine()
-    sm.ReadConfig()
-    sm.SetConfig(0, {"Device": port, "Connection": "at"})
 
-    try:
-        sm.Init()
-        info["status"] = t("status.ok", lang)
-    except Exception:
-        info["status"] = t("status.no_response", lang)
-        return info
+def lookup_identifier(code: str) -> dict:
+    """
+    Определяет оператора и страну по IMSI или ICCID.
 
+    ICCID отличается по длине (18–20 цифр против 15 у IMSI) или по
+    нецифровым символам. Возвращает dict: id, type, operator, country.
+    """
+    code = code.strip()
+    if code.isdigit() and 5 <= len(code) <= 15:
+        return {
+            "id": code,
+            "type": "imsi",
+            "operator": get_operator_from_imsi(code),
+            "country": get_country_from_imsi(code),
+        }
+    return {
+        "id": code,
+        "type": "iccid",
+        "operator": get_operator_from_iccid(code),
+        "country": get_country_from_iccid(code),
+    }
+
+
+def lookup_many(codes):
+    """lookup_identifier для списка идентификаторов (пустые строки пропускаются)."""
+    return [lookup_identifier(c) for c in codes if c and c.strip()]
+
+
+def _raise_if_disconnected(exc):
+    """Пробрасывает ошибки соединения, чтобы пул закрыл сломанную сессию."""
+    if _is_connection_error(exc):
+        raise exc
+
+
+def _read_static_fields(sm, info):
+    """
+    Читает редко меняющиеся поля: модель, производитель, IMSI, ICCID,
+    оператор, страна SIM, IMEI и собственный номер.
+    """
     try:
         info["model"] = sm.GetModel().get("Model", "—")
-    except Exception:
+    except Exception as exc:
+        _raise_if_disconnected(exc)
         info["model"] = "—"
 
     try:
         info["vendor"] = sm.GetManufacturer().get("Manufacturer", "—")
-    except Exception:
+    except Exception as exc:
+        _raise_if_disconnected(exc)
         info["vendor"] = "—"
 
     try:
         imsi = sm.GetSIMIMSI()
         info["imsi"] = imsi
-    except Exception:
+    except Exception as exc:
+        _raise_if_disconnected(exc)
         imsi = ""
         info["imsi"] = "—"
     operator = get_operator_from_imsi(imsi)
@@ -213,7 +513,8 @@ def get_modem_info(port, lang=None):
     try:
         iccid = sm.GetICC()
         info["iccid"] = iccid
-    except Exception:
+    except Exception as exc:
+        _raise_if_disconnected(exc)
         iccid = ""
         info["iccid"] = "—"
 
@@ -225,13 +526,33 @@ def get_modem_info(port, lang=None):
     info["operator"] = operator or "—"
     info["sim_country"] = sim_country or "—"
 
+    try:
+        info["imei"] = sm.GetIMEI()
+    except Exception as exc:
+        _raise_if_disconnected(exc)
+        info["imei"] = "—"
+
+    try:
+        nums = sm.GetOwnNumbers()
+        if nums:
+            info["phone"] = nums[0].get("Number", "—")
+        else:
+            info["phone"] = "—"
+    except Exception as exc:
+        _raise_if_disconnected(exc)
+        info["phone"] = "—"
+
+
+def _read_volatile_fields(sm, info, lang):
+    """Читает поля, которые меняются между тиками: сеть, сигнал и CPIN."""
     try:
         net = sm.GetNetworkInfo()
         if net:
             info["network"] = t("network_state.connected", lang)
         else:
             info["network"] = t("network_state.disconnected", lang)
-    except Exception:
+    except Exception as exc:
+        _raise_if_disconnected(exc)
         info["network"] = t("network_state.disconnected", lang)
 
     try:
@@ -239,36 +560,183 @@ def get_modem_info(port, lang=None):
         rssi = sig.get("SignalStrength", 99)
         csq_resp = f"+CSQ: {rssi},0"
         info["signal"] = parse_signal(csq_resp, lang)
-    except Exception:
+    except Exception as exc:
+        _raise_if_disconnected(exc)
         info["signal"] = t("signal.error", lang)
 
-    try:
-        info["imei"] = sm.GetIMEI()
-    except Exception:
-        info["imei"] = "—"
-
     try:
         info["cpin"] = sm.GetSecurityStatus()
-    except Exception:
+    except Exception as exc:
+        _raise_if_disconnected(exc)
         info["cpin"] = "—"
 
-    try:
-        nums = sm.GetOwnNumbers()
-        if nums:
-            info["phone"] = nums[0].get("Number", "—")
+
+# Поля, которые кэшируются между тиками, пока SIM остаётся в слоте
+STATIC_FIELDS = (
+    "model", "vendor", "imsi", "iccid", "operator", "sim_country", "imei", "phone",
+)
+# Как часто (в секундах) статические поля перечитываются принудительно
+FULL_REFRESH_INTERVAL = 300.0
+# Если порт не опрашивался дольше этого (несколько тиков монитора), SIM
+# могли заменить незаметно — CPIN был READY и до, и после, — поэтому
+# статические поля перечитываются
+UNOBSERVED_GAP = 10.0
+
+# port -> {"fields": {...}, "cpin": ..., "refreshed": monotonic time,
+#          "checked": monotonic time последнего чтения сети, сигнала и CPIN}
+_static_cache = {}
+_static_lock = threading.Lock()
+
+
+def invalidate_static_cache(port=None):
+    """Сбрасывает кэш статических полей порта (или всех портов)."""
+    with _static_lock:
+        if port is None:
+            _static_cache.clear()
         else:
-            info["phone"] = "—"
-    except Exception:
-        info["phone"] = "—"
+            _static_cache.pop(port, None)
+
+
+# port -> последний успешно собранный get_modem_info; отдаётся как устаревший,
+# пока порт не отвечает
+_last_info = {}
 
+
+def cached_operator(port):
+    """Оператор SIM на порту из кэша статических полей или None."""
+    with _static_lock:
+        cached = _static_cache.get(port)
+    operator = cached["fields"].get("operator") if cached else None
+    return operator if operator and operator not in ("—", "unknown") else None
+
+
+def cached_iccid(port):
+    """ICCID SIM на порту из кэша статических полей или None."""
+    with _static_lock:
+        cached = _static_cache.get(port)
+    iccid = cached["fields"].get("iccid") if cached else None
+    return iccid if iccid and iccid != "—" else None
+
+
+def routing_info(port):
+    """
+    Оператор, собственный номер и RSSI SIM на порту по последнему успешному
+    опросу — для выбора порта отправки. None, если порт ещё не опрашивался
+    или сейчас в паузе после отказа.
+    """
+    info = _last_info.get(port)
+    if info is None or PORT_HEALTH.is_suspect(port):
+        return None
+    m = re.match(r"(\d+)", str(info.get("signal", "")))
+    return {
+        "port": port,
+        "operator": cached_operator(port),
+        "phone": info.get("phone") if info.get("phone") != "—" else None,
+        "rssi": int(m.group(1)) if m else 99,
+    }
+
+
+def forget_port(port):
+    """Забывает кэши и историю отказов порта: следующий опрос пойдёт к модему сразу."""
+    invalidate_static_cache(port)
+    _last_info.pop(port, None)
+    PORT_HEALTH.forget(port)
+
+
+def release_port(port):
+    """Закрывает сессию порта и забывает его состояние (отключение, передача порта)."""
+    SESSION_POOL.invalidate(port)
+    forget_port(port)
+
+
+def _stale_info(port, lang):
+    info = dict(_last_info.get(port) or {"port": port})
+    info["status"] = t("status.no_response", lang)
+    info["stale"] = True
+    return info
+
+
+def _needs_full_refresh(cached, cpin, now):
+    if cached is None:
+        return True
+    if now - cached["refreshed"] >= FULL_REFRESH_INTERVAL:
+        return True
+    # Между опросами был перерыв: смену SIM можно было не увидеть
+    if now - cached["checked"] >= UNOBSERVED_GAP:
+        return True
+    # Смена состояния CPIN — признак извлечения или замены SIM
+    return cached["cpin"] != cpin
+
+
+def get_modem_info(port, lang=None, full=None):
+    """
+    Собирает информацию по модему на указанном порту.
+    Принимает:
+      - port (строка)
+      - lang (код языка, например 'ru', 'en', 'zh') — опционально.
+      - full — True: перечитать все поля; False/None: перечитать только
+        сеть, сигнал и CPIN, а остальное взять из кэша порта. Кэш
+        обновляется раз в FULL_REFRESH_INTERVAL, при смене CPIN (замена
+        SIM) и если порт не опрашивался дольше UNOBSERVED_GAP.
+    Возвращает dict с полями:
+      port, model, vendor, imsi, operator, sim_country,
+      network, signal, status, sms, voice, imei, iccid, cpin, ussd
+
+    Если порт не ответил, он на время выводится из опроса (см. port_health):
+    до следующей попытки возвращаются последние известные данные со
+    статусом no_response и флагом "stale": True.
+    """
+    if lang is None:
+        lang = get_language()
+
+    if not PORT_HEALTH.should_probe(port):
+        return _stale_info(port, lang)
+
+    info = {"port": port}
+
+    try:
+        with SESSION_POOL.session(port) as sm:
+            info["status"] = t("status.ok", lang)
+            volatile = {}
+            _read_volatile_fields(sm, volatile, lang)
+            now = time.monotonic()
+            with _static_lock:
+                cached = _static_cache.get(port)
+            if full or _needs_full_refresh(cached, volatile["cpin"], now):
+                static = {}
+                _read_static_fields(sm, static)
+                with _static_lock:
+                    _static_cache[port] = {
+                        "fields": static,
+                        "cpin": volatile["cpin"],
+                        "refreshed": now,
+                        "checked": now,
+                    }
+            else:
+                static = cached["fields"]
+                with _static_lock:
+                    cached["checked"] = now
+    except Exception as exc:
+        # Init не прошёл или модем отвалился посреди опроса:
+        # после переподключения SIM может оказаться другой
+        invalidate_static_cache(port)
+        PORT_HEALTH.record_failure(port, exc)
+        return _stale_info(port, lang)
+
+    for key in STATIC_FIELDS:
+        info[key] = static.get(key, "—")
+    info.update(volatile)
     info["sms"] = 0
     info["voice"] = 0
     info["ussd"] = ""
 
-    return info
+    PORT_HEALTH.record_success(port)
+    _last_info[port] = info
+    return dict(info)
 
 
 async def get_modem_info_async(port, lang=None, timeout=1.0):
     """Асинхронное получение информации о модеме через Gammu."""
+    import asyncio
     return await asyncio.to_thread(get_modem_info, port, lang)
 
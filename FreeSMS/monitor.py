@@ -0,0 +1,316 @@
+# FreeSMS/monitor.py
+
+"""
+Общий фоновый опросчик модемов для /api/monitor.
+
+Один поток опрашивает порты раз в ``POLL_INTERVAL`` секунд, хранит
+последнее состояние и рассылает изменения всем подписчикам. Опрос идёт
+на языке POLL_LANG, а переводимые строки (статус, сеть, качество
+сигнала) переводятся на язык подписчика при отправке, так что клиенты
+с разными языками не удваивают опрос.
+Фильтр портов подписчика применяется при отправке события, поэтому
+новые вкладки браузера не создают дополнительного трафика к модемам.
+Подписчики из цикла asyncio (FreeSMS.asgi) получают события через
+call_soon_threadsafe и не занимают по потоку на соединение.
+
+Опрос идёт через очереди портов (scheduler) с приоритетом POLL, поэтому
+команды пользователя и подключение портов не ждут конца обхода.
+"""
+
+import re
+import time
+import queue
+import asyncio
+import threading
+
+from . import event_logger
+from . import sharding
+from .delta import diff_states
+from .i18n import get_translations, t
+from .modem_utils import list_modem_ports
+
+POLL_INTERVAL = 1.0
+# Язык, на котором опрашивает общий опросчик
+POLL_LANG = "en"
+# Сколько событий может накопиться у медленного подписчика
+SUBSCRIBER_QUEUE_SIZE = 1000
+# Через сколько секунд без подписчиков опросчик останавливается
+IDLE_SHUTDOWN = 10.0
+
+# Поля get_modem_info с переведёнными строками и разделы их переводов
+LOCALIZED_FIELDS = ("status", "network", "signal")
+_LOCALIZED_SECTIONS = ("status", "network_state", "signal")
+# "20 (Good)": RSSI и качество сигнала
+_SIGNAL_RE = re.compile(r"^(\d+) \((.*)\)$")
+
+# Строка на POLL_LANG -> ключ перевода
+_reverse = None
+
+
+def _reverse_table():
+    global _reverse
+    if _reverse is None:
+        table = {}
+        translations = get_translations()
+        for section in _LOCALIZED_SECTIONS:
+            for name in translations.get(section, {}):
+                key = f"{section}.{name}"
+                table.setdefault(t(key, POLL_LANG), key)
+        _reverse = table
+    return _reverse
+
+
+def _translate(value, lang):
+    if not isinstance(value, str):
+        return value
+    reverse = _reverse_table()
+    key = reverse.get(value)
+    if key is not None:
+        return t(key, lang)
+    m = _SIGNAL_RE.match(value)
+    if m and m.group(2) in reverse:
+        return f"{m.group(1)} ({t(reverse[m.group(2)], lang)})"
+    return value
+
+
+def localize(event, lang):
+    """Событие или снимок опросчика со строками на языке lang."""
+    if lang == POLL_LANG or not any(f in event for f in LOCALIZED_FIELDS):
+        return event
+    event = dict(event)
+    for field in LOCALIZED_FIELDS:
+        if field in event:
+            event[field] = _translate(event[field], lang)
+    return event
+
+
+class Subscription:
+    """Очередь событий одного SSE-клиента с фильтром по портам."""
+
+    def __init__(self, hub, ports=None, lang=POLL_LANG):
+        self.hub = hub
+        self.ports = set(ports) if ports else None
+        self.lang = lang
+        self._queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+    def wants(self, port):
+        return self.ports is None or port in self.ports
+
+    def push(self, event):
+        """Кладёт событие, не блокируя опросчик."""
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # Клиент не успевает читать: сбрасываем очередь и отдаём
+            # актуальный снимок, чтобы он не потерял состояние
+            self._drain()
+            for snap in self.hub.snapshot(self.ports, self.lang):
+                try:
+                    self._queue.put_nowait(snap)
+                except queue.Full:
+                    break
+
+    def _drain(self):
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def get(self, timeout=None):
+        """Следующее событие или None, если за timeout ничего не пришло."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.hub.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    """
+    Подписка для корутины в цикле loop: опросчик передаёт события в цикл
+    через call_soon_threadsafe, а get() ждёт их без отдельного потока.
+    """
+
+    def __init__(self, hub, loop, ports=None, lang=POLL_LANG):
+        super().__init__(hub, ports, lang)
+        self.loop = loop
+        self._queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def push(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._push_local, event)
+        except RuntimeError:
+            # Цикл уже закрыт: соединение завершилось
+            self.close()
+
+    def _push_local(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self._drain()
+            for snap in self.hub.snapshot(self.ports, self.lang):
+                try:
+                    self._queue.put_nowait(snap)
+                except asyncio.QueueFull:
+                    break
+
+    def _drain(self):
+        try:
+            while True:
+                self._queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+
+    async def get(self, timeout=None):
+        """Следующее событие или None, если за timeout ничего не пришло."""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class MonitorHub:
+    """Владеет состоянием модемов и публикует диффы подписчикам."""
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self._subs = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._prev_by_port = {}
+        self._prev_by_sim = {}
+
+    # ---------- подписки ----------
+    def subscribe(self, ports=None, loop=None, lang=POLL_LANG):
+        if loop is not None:
+            sub = AsyncSubscription(self, loop, ports, lang)
+        else:
+            sub = Subscription(self, ports, lang)
+        with self._lock:
+            # Снимок и регистрация под одной блокировкой: диффы следующего
+            # тика придут подписчику уже после снимка
+            for snap in self.snapshot(sub.ports, sub.lang):
+                sub.push(snap)
+            self._subs.append(sub)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="monitor", daemon=True
+                )
+                self._thread.start()
+        # Новые порты подписчика попадут в ближайший опрос без ожидания
+        self._wakeup.set()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+
+    def snapshot(self, ports=None, lang=POLL_LANG):
+        # Состояние не меняется на месте, а заменяется новым dict (см. _tick),
+        # поэтому читается без _lock: снимок берёт и push() переполненного
+        # подписчика, который вызывается под _lock
+        by_port = self._prev_by_port
+        return [
+            dict(localize(info, lang)) for port, info in by_port.items()
+            if ports is None or port in ports
+        ]
+
+    def _publish(self, event):
+        port = event.get("port")
+        with self._lock:
+            subs = list(self._subs)
+        # Перевод делается один раз на язык, а не на подписчика
+        by_lang = {}
+        for sub in subs:
+            if port is None or sub.wants(port):
+                localized = by_lang.get(sub.lang)
+                if localized is None:
+                    localized = by_lang[sub.lang] = localize(event, sub.lang)
+                sub.push(localized)
+
+    # ---------- опрос ----------
+    def _wanted_ports(self):
+        with self._lock:
+            subs = list(self._subs)
+        wanted = []
+        for sub in subs:
+            if sub.ports is None:
+                return list_modem_ports()
+            for p in sub.ports:
+                if p not in wanted:
+                    wanted.append(p)
+        return wanted
+
+    def _run(self):
+        idle_since = None
+        while True:
+            with self._lock:
+                if self._subs:
+                    idle_since = None
+                elif idle_since is None:
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since >= IDLE_SHUTDOWN:
+                    # Никто не смотрит: останавливаемся и забываем состояние
+                    self._thread = None
+                    self._prev_by_port = {}
+                    self._prev_by_sim = {}
+                    return
+            if idle_since is None:
+                try:
+                    self._tick()
+                except Exception as e:
+                    event_logger.log_event("monitor_stream_error", details=str(e))
+                    self._publish({"error": str(e)})
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _tick(self):
+        current_ports = self._wanted_ports()
+        # Порты опрашиваются параллельно, каждый в своей очереди (или у
+        # процесса-владельца, если порты поделены между процессами)
+        results = sharding.poll(current_ports, POLL_LANG)
+        for p, result in results.items():
+            if isinstance(result, Exception):
+                event_logger.log_event("monitor_error", port=p, details=str(result))
+
+        events, new_by_port, new_by_sim = diff_states(
+            self._prev_by_port, self._prev_by_sim,
+            [(p, results[p]) for p in current_ports],
+        )
+        # Состояние обновляется до рассылки, чтобы снимок для нового
+        # подписчика не расходился с уже отправленными диффами
+        with self._lock:
+            self._prev_by_port = new_by_port
+            self._prev_by_sim = new_by_sim
+        for event in events:
+            self._publish(event)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    """Общий опросчик процесса."""
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = MonitorHub()
+        return _hub
+
+
+def subscribe(lang, ports=None, loop=None):
+    """
+    Подписывает SSE-клиента на изменения модемов (опционально только ports)
+    со строками на языке lang. С loop возвращает AsyncSubscription, чей
+    get() — корутина этого цикла.
+    """
+    return get_hub().subscribe(ports, loop, lang)
@@ -0,0 +1,239 @@
+# FreeSMS/operator_index.py
+
+"""
+Скомпилированный индекс операторов и стран по MCC/MNC.
+
+operators.json один раз компилируется в компактный бинарный файл
+operators.idx, который затем отображается в память (mmap) при первом
+поиске. В индексе заранее посчитан запасной маппинг MCC → ISO3 из
+pycountry, поэтому во время работы pycountry не загружается вовсе:
+он нужен только при сборке индекса.
+
+Формат (little-endian):
+  заголовок   MAGIC, source_mtime_ns (u64), source_size (u64),
+              n_keys (u32), n_strings (u32)
+  MCC-таблица 1000 × (индекс строки страны u16, маска длин MNC u8, 0 u8)
+  ключи       n_keys × u32, отсортированы: mcc*10000 + len(mnc)*1000 + mnc
+  значения    n_keys × u16 — индекс строки оператора
+  строки      (n_strings + 1) × u32 смещений, затем UTF-8
+"""
+
+import os
+import json
+import mmap
+import struct
+import threading
+from bisect import bisect_left
+
+BASE = os.path.dirname(__file__)
+OPS_PATH = os.path.abspath(os.path.join(BASE, "..", "operators.json"))
+INDEX_PATH = os.path.abspath(os.path.join(BASE, "..", "operators.idx"))
+
+MAGIC = b"FSOPIDX1"
+_HEADER = struct.Struct("<8sQQII")
+_MCC_ENTRY = struct.Struct("<HBB")
+_NO_STRING = 0xFFFF
+# Биты маски длин MNC в MCC-таблице
+_MNC2 = 1
+_MNC3 = 2
+
+
+def _key(mcc, mnc):
+    return int(mcc) * 10000 + len(mnc) * 1000 + int(mnc)
+
+
+def _load_source(ops_path):
+    try:
+        with open(ops_path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def _pycountry_fallback(known_mccs):
+    """MCC → ISO3 по числовому коду страны для MCC, которых нет в operators.json."""
+    try:
+        import pycountry
+    except ImportError:
+        return {}
+    result = {}
+    for country in pycountry.countries:
+        numeric = getattr(country, "numeric", None)
+        if numeric and numeric not in known_mccs:
+            result[numeric] = country.alpha_3.lower()
+    return result
+
+
+def build(ops_path=OPS_PATH, index_path=INDEX_PATH):
+    """Компилирует operators.json в бинарный индекс и возвращает его байты."""
+    entries = _load_source(ops_path)
+    operators = {}
+    countries = {}
+    for entry in entries:
+        mcc = str(entry.get("mcc", ""))
+        mnc = str(entry.get("mnc", ""))
+        country_code = entry.get("country", "").lower()
+        operator_code = entry.get("operator", "").lower()
+        if not (mcc.isdigit() and len(mcc) == 3 and mnc.isdigit() and len(mnc) in (2, 3)):
+            continue
+        if country_code and operator_code:
+            operators.setdefault(_key(mcc, mnc), f"{country_code}-{operator_code}")
+            countries.setdefault(mcc, country_code)
+    for mcc, code in _pycountry_fallback(set(countries)).items():
+        countries.setdefault(mcc, code)
+
+    strings = []
+    string_ids = {}
+
+    def intern(value):
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    mcc_table = [[_NO_STRING, 0] for _ in range(1000)]
+    for mcc, code in countries.items():
+        mcc_table[int(mcc)][0] = intern(code)
+    keys = sorted(operators)
+    values = [intern(operators[k]) for k in keys]
+    for k in keys:
+        mcc, rest = divmod(k, 10000)
+        mcc_table[mcc][1] |= _MNC3 if rest // 1000 == 3 else _MNC2
+
+    try:
+        st = os.stat(ops_path)
+        mtime_ns, size = st.st_mtime_ns, st.st_size
+    except FileNotFoundError:
+        mtime_ns, size = 0, 0
+
+    blob = bytearray(_HEADER.pack(MAGIC, mtime_ns, size, len(keys), len(strings)))
+    for country_id, mask in mcc_table:
+        blob += _MCC_ENTRY.pack(country_id, mask, 0)
+    blob += struct.pack(f"<{len(keys)}I", *keys)
+    blob += struct.pack(f"<{len(values)}H", *values)
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = [0]
+    for item in encoded:
+        offsets.append(offsets[-1] + len(item))
+    blob += struct.pack(f"<{len(offsets)}I", *offsets)
+    blob += b"".join(encoded)
+
+    tmp_path = index_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(blob)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        print(f"Warning: не удалось сохранить {index_path}: {e}")
+    return bytes(blob)
+
+
+class OperatorIndex:
+    """Поиск оператора и страны по скомпилированному индексу."""
+
+    def __init__(self, buf):
+        self._buf = buf
+        magic, _, _, n_keys, n_strings = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError("operators.idx: неверный формат")
+        view = memoryview(buf)
+        pos = _HEADER.size
+        self._mcc = view[pos:pos + 1000 * _MCC_ENTRY.size]
+        pos += 1000 * _MCC_ENTRY.size
+        self._keys = view[pos:pos + 4 * n_keys].cast("I")
+        pos += 4 * n_keys
+        self._values = view[pos:pos + 2 * n_keys].cast("H")
+        pos += 2 * n_keys
+        offsets = view[pos:pos + 4 * (n_strings + 1)].cast("I")
+        pos += 4 * (n_strings + 1)
+        data = bytes(view[pos:pos + offsets[-1]])
+        # Строк немного (сотни), декодируем их один раз
+        self._strings = [
+            data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(n_strings)
+        ]
+
+    def _mcc_entry(self, mcc):
+        return _MCC_ENTRY.unpack_from(self._mcc, int(mcc) * _MCC_ENTRY.size)
+
+    def _find(self, key):
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return self._strings[self._values[i]]
+        return None
+
+    def country(self, mcc):
+        """Трёхбуквенный код страны по MCC ('250' → 'rus') или ''."""
+        if len(mcc) != 3 or not mcc.isdigit():
+            return ""
+        country_id, _, _ = self._mcc_entry(mcc)
+        return "" if country_id == _NO_STRING else self._strings[country_id]
+
+    def operator(self, digits):
+        """
+        Код оператора по строке цифр, начинающейся с MCC+MNC, или None.
+
+        По MCC-таблице сразу видно, какие длины MNC встречаются у этого MCC,
+        так что проверяются только возможные варианты (сначала трёхзначный).
+        """
+        if len(digits) < 5 or not digits[:5].isdigit():
+            return None
+        mcc = int(digits[:3])
+        _, mask, _ = self._mcc_entry(mcc)
+        if mask & _MNC3 and len(digits) >= 6 and digits[5].isdigit():
+            found = self._find(_key(mcc, digits[3:6]))
+            if found:
+                return found
+        if mask & _MNC2:
+            return self._find(_key(mcc, digits[3:5]))
+        return None
+
+    def items(self):
+        """Пары ('MCCMNC', 'ccc-operator') — для построения OPS_MAP."""
+        for key, value in zip(self._keys, self._values):
+            mcc, rest = divmod(key, 10000)
+            length, mnc = divmod(rest, 1000)
+            yield f"{mcc:03d}{mnc:0{length}d}", self._strings[value]
+
+    def countries(self):
+        """Пары ('MCC', 'iso3') для всех MCC с известной страной."""
+        for mcc in range(1000):
+            code = self.country(f"{mcc:03d}")
+            if code:
+                yield f"{mcc:03d}", code
+
+
+def _is_fresh(index_path, ops_path):
+    try:
+        with open(index_path, "rb") as f:
+            header = f.read(_HEADER.size)
+        magic, mtime_ns, size, _, _ = _HEADER.unpack(header)
+    except (OSError, struct.error):
+        return False
+    try:
+        st = os.stat(ops_path)
+    except FileNotFoundError:
+        return magic == MAGIC
+    return magic == MAGIC and mtime_ns == st.st_mtime_ns and size == st.st_size
+
+
+def load(index_path=INDEX_PATH, ops_path=OPS_PATH):
+    """Открывает индекс через mmap, пересобирая его, если operators.json новее."""
+    if not _is_fresh(index_path, ops_path):
+        return OperatorIndex(build(ops_path, index_path))
+    with open(index_path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return OperatorIndex(buf)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Общий индекс процесса; загружается при первом обращении."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load()
+    return _index
@@ -0,0 +1,118 @@
+# FreeSMS/port_health.py
+
+"""
+Отслеживание неотвечающих портов с экспоненциальной паузой между попытками.
+
+После неудачного подключения порт помечается подозрительным, и следующие
+обращения к нему не ждут таймаута Gammu, а сразу получают последнее
+известное (устаревшее) состояние. Повторная попытка разрешается через
+BACKOFF_BASE·2^(n-1) секунд (не больше BACKOFF_MAX) со случайным
+разбросом, чтобы мёртвые порты не проверялись все одновременно. Пока
+идёт проверка, остальные вызовы тоже получают устаревшие данные.
+"""
+
+import time
+import random
+import threading
+
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+
+
+class PortUnavailableError(Exception):
+    """Порт в паузе после отказа; обращение к модему не выполнялось."""
+
+
+class _PortState:
+    __slots__ = ("failures", "next_retry", "probing", "last_error", "last_ok", "suspect_since")
+
+    def __init__(self):
+        self.failures = 0
+        self.next_retry = 0.0
+        self.probing = False
+        self.last_error = ""
+        self.last_ok = None
+        self.suspect_since = None
+
+
+class PortHealth:
+    def __init__(self, base=BACKOFF_BASE, maximum=BACKOFF_MAX, rng=None):
+        self.base = base
+        self.maximum = maximum
+        self._rng = rng or random.Random()
+        self._ports = {}
+        self._lock = threading.Lock()
+
+    def _get(self, port):
+        state = self._ports.get(port)
+        if state is None:
+            state = self._ports[port] = _PortState()
+        return state
+
+    def backoff(self, failures):
+        """Пауза после failures неудач подряд: половина фиксирована, половина случайна."""
+        delay = min(self.maximum, self.base * (2 ** (failures - 1)))
+        return self._rng.uniform(delay / 2, delay)
+
+    def should_probe(self, port):
+        """
+        True, если к порту можно обращаться сейчас. Для подозрительного
+        порта разрешает ровно одну проверку после окончания паузы.
+        """
+        with self._lock:
+            state = self._ports.get(port)
+            if state is None or not state.failures:
+                return True
+            if state.probing or time.monotonic() < state.next_retry:
+                return False
+            state.probing = True
+            return True
+
+    def record_success(self, port):
+        with self._lock:
+            state = self._get(port)
+            state.failures = 0
+            state.probing = False
+            state.next_retry = 0.0
+            state.suspect_since = None
+            state.last_ok = time.time()
+
+    def record_failure(self, port, error=""):
+        with self._lock:
+            state = self._get(port)
+            state.failures += 1
+            state.probing = False
+            state.last_error = str(error)
+            if state.suspect_since is None:
+                state.suspect_since = time.time()
+            state.next_retry = time.monotonic() + self.backoff(state.failures)
+
+    def is_suspect(self, port):
+        with self._lock:
+            state = self._ports.get(port)
+            return bool(state and state.failures)
+
+    def forget(self, port):
+        """Сбрасывает историю порта (например, после ручного отключения)."""
+        with self._lock:
+            self._ports.pop(port, None)
+
+    def snapshot(self):
+        """Состояние всех известных портов для API."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                port: {
+                    "state": "suspect" if st.failures else "ok",
+                    "failures": st.failures,
+                    "retry_in": round(max(0.0, st.next_retry - now), 1) if st.failures else 0,
+                    "probing": st.probing,
+                    "last_error": st.last_error,
+                    "last_ok": st.last_ok,
+                    "suspect_since": st.suspect_since,
+                }
+                for port, st in self._ports.items()
+            }
+
+
+PORT_HEALTH = PortHealth()
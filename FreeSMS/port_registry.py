@@ -0,0 +1,241 @@
+# FreeSMS/port_registry.py
+
+"""
+Реестр портов модемов с обновлением по событиям горячего подключения.
+
+Вместо glob по /dev на каждом тике монитора список портов хранится в
+памяти и пересканируется, только когда ядро сообщает о добавлении или
+удалении tty-устройства (netlink uevent). Если netlink недоступен
+(не Linux, контейнер без сети ядра), список обновляется опросом раз
+в FALLBACK_POLL_INTERVAL секунд.
+
+На Linux в список попадают только tty на USB-устройствах известных
+производителей модемов (см. MODEM_USB_IDS, переопределяется ключом
+"modem_usb_ids" в config.json), что отсекает консоли, псевдотерминалы
+и встроенные UART. Для USB-UART мостов можно дополнительно включить
+проверку "AT" → "OK" (ключ "port_probe").
+"""
+
+import os
+import glob
+import time
+import socket
+import threading
+
+from .backends import read_config
+
+# Производители USB-модемов (idVendor) и отдельные устройства (idVendor:idProduct)
+MODEM_USB_IDS = (
+    "12d1",  # Huawei
+    "19d2",  # ZTE
+    "2c7c",  # Quectel
+    "1e0e",  # SIMCom
+    "1199",  # Sierra Wireless
+    "1bc7",  # Telit
+    "1546",  # u-blox
+    "2cb7",  # Fibocom
+    "05c6",  # Qualcomm
+    "1782",  # Spreadtrum/UNISOC
+    "0403",  # FTDI — мосты в модемных пулах
+    "067b",  # Prolific
+    "1a86",  # WCH CH340
+    "10c4",  # Silicon Labs CP210x
+)
+
+# Пауза после события: модем создаёт несколько tty подряд
+DEBOUNCE = 0.5
+FALLBACK_POLL_INTERVAL = 5.0
+PROBE_TIMEOUT = 0.3
+
+NETLINK_KOBJECT_UEVENT = 15
+
+
+def _usb_ids(sys_tty):
+    """(idVendor, idProduct) USB-устройства, которому принадлежит tty, или None."""
+    device = os.path.join(sys_tty, "device")
+    if not os.path.exists(device):
+        return None
+    path = os.path.realpath(device)
+    while path and path != "/":
+        vendor_file = os.path.join(path, "idVendor")
+        if os.path.isfile(vendor_file):
+            try:
+                with open(vendor_file) as f:
+                    vendor = f.read().strip().lower()
+                with open(os.path.join(path, "idProduct")) as f:
+                    product = f.read().strip().lower()
+            except OSError:
+                return None
+            return vendor, product
+        path = os.path.dirname(path)
+    return None
+
+
+def probe_at(device, timeout=PROBE_TIMEOUT):
+    """Дешёвая проверка: отвечает ли устройство "OK" на "AT"."""
+    import select
+    import termios
+    try:
+        fd = os.open(device, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    except OSError:
+        return False
+    try:
+        attrs = termios.tcgetattr(fd)
+        attrs[3] &= ~(termios.ICANON | termios.ECHO)
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        termios.tcflush(fd, termios.TCIOFLUSH)
+        os.write(fd, b"AT\r")
+        deadline = time.monotonic() + timeout
+        buf = b""
+        while time.monotonic() < deadline:
+            ready, _, _ = select.select([fd], [], [], deadline - time.monotonic())
+            if not ready:
+                break
+            buf += os.read(fd, 256)
+            if b"OK" in buf:
+                return True
+        return False
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+
+class PortRegistry:
+    """Кэш списка портов модемов, обновляемый по hotplug-событиям."""
+
+    def __init__(self, usb_ids=None, probe=False):
+        self.usb_ids = {i.lower() for i in (usb_ids or MODEM_USB_IDS)}
+        self.probe = probe
+        self._ports = None
+        self._probed = {}
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._thread = None
+        self.mode = None
+
+    # ---------- сканирование ----------
+    def _wanted(self, vendor, product):
+        return vendor in self.usb_ids or f"{vendor}:{product}" in self.usb_ids
+
+    def _scan_linux(self):
+        ports = []
+        for sys_tty in sorted(glob.glob("/sys/class/tty/tty*")):
+            name = os.path.basename(sys_tty)
+            ids = _usb_ids(sys_tty)
+            if ids is None:
+                continue
+            device = os.path.join("/dev", name)
+            if not os.path.exists(device):
+                continue
+            if self._wanted(*ids):
+                ports.append(device)
+            elif self.probe and name.startswith(("ttyUSB", "ttyACM")):
+                key = (device, ids)
+                if key not in self._probed:
+                    self._probed[key] = probe_at(device)
+                if self._probed[key]:
+                    ports.append(device)
+        return ports
+
+    def scan(self):
+        """Полное сканирование устройств (не использует кэш)."""
+        if os.name == "nt":
+            return [f"COM{i}" for i in range(1, 257)]
+        if os.path.isdir("/sys/class/tty"):
+            return self._scan_linux()
+        # macOS: /dev/tty.* дублируют /dev/cu.*; служебные порты пропускаем
+        return [
+            p for p in sorted(glob.glob("/dev/cu.*"))
+            if "Bluetooth" not in p and "debug-console" not in p
+        ]
+
+    # ---------- кэш ----------
+    def ports(self):
+        """Текущий список портов; при первом вызове сканирует и запускает наблюдение."""
+        with self._lock:
+            if self._ports is None:
+                self._ports = self.scan()
+                self._start_watcher()
+            return list(self._ports)
+
+    def refresh(self):
+        # Сканируем без блокировки: проверка портов может занять время,
+        # а ports() в это время отдаёт прежний список
+        ports = self.scan()
+        # Отключённые устройства не должны держать кэш результатов проверки
+        self._probed = {k: v for k, v in self._probed.items() if os.path.exists(k[0])}
+        with self._lock:
+            self._ports = ports
+            return list(ports)
+
+    # ---------- наблюдение ----------
+    def _start_watcher(self):
+        if self._thread is not None:
+            return
+        sock = None
+        if hasattr(socket, "AF_NETLINK"):
+            try:
+                sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+                sock.bind((0, 1))
+            except OSError:
+                if sock is not None:
+                    sock.close()
+                sock = None
+        if sock is not None:
+            self.mode = "netlink"
+            target, args = self._netlink_loop, (sock,)
+        else:
+            self.mode = "polling"
+            target, args = self._poll_loop, ()
+        self._thread = threading.Thread(
+            target=target, args=args, name="port-registry", daemon=True
+        )
+        self._thread.start()
+        threading.Thread(target=self._refresh_loop, name="port-registry-refresh", daemon=True).start()
+
+    def _netlink_loop(self, sock):
+        while True:
+            try:
+                data = sock.recv(8192)
+            except OSError:
+                # Сокет сломался: переходим на опрос
+                self.mode = "polling"
+                return self._poll_loop()
+            # "add@/devices/.../tty/ttyUSB0\0ACTION=add\0SUBSYSTEM=tty\0..."
+            fields = data.split(b"\0")
+            if b"SUBSYSTEM=tty" in fields or b"SUBSYSTEM=usb-serial" in fields:
+                self._dirty.set()
+
+    def _poll_loop(self):
+        while True:
+            time.sleep(FALLBACK_POLL_INTERVAL)
+            self._dirty.set()
+
+    def _refresh_loop(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(DEBOUNCE)
+            self._dirty.clear()
+            try:
+                self.refresh()
+            except Exception:
+                pass
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Реестр процесса с настройками из config.json."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                cfg = read_config()
+                _registry = PortRegistry(
+                    usb_ids=cfg.get("modem_usb_ids"),
+                    probe=bool(cfg.get("port_probe", False)),
+                )
+    return _registry
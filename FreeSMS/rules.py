@@ -0,0 +1,434 @@
+# FreeSMS/rules.py
+
+"""
+Правила обработки входящих SMS.
+
+Правило задаёт условия (отправитель, порт, оператор SIM, регулярное
+выражение по тексту) и действие: forward — переслать, tag — пометить,
+reply — ответить отправителю, drop — удалить сообщение. Правила хранятся
+в rules.json и применяются к каждому сохранённому входящему SMS.
+
+Весь набор правил компилируется в один сопоставитель. Для каждого
+правила выбирается «якорь» — самое избирательное условие: обязательная
+подстрока его регулярного выражения (ищется сразу для всех правил одним
+проходом автомата Ахо — Корасик по тексту), точный отправитель, порт
+или оператор (поиск в словаре). Полная проверка с регулярным выражением
+выполняется только для правил, чей якорь сработал, поэтому стоимость
+сообщения почти не зависит от числа правил.
+"""
+
+import os
+import re
+import json
+import uuid
+import threading
+from functools import lru_cache
+from collections import deque
+
+try:
+    import re._parser as sre_parse
+    from re._constants import (
+        LITERAL, SUBPATTERN, BRANCH, MAX_REPEAT, MIN_REPEAT,
+    )
+except ImportError:  # Python < 3.11
+    import sre_parse
+    from sre_constants import (
+        LITERAL, SUBPATTERN, BRANCH, MAX_REPEAT, MIN_REPEAT,
+    )
+
+from . import event_logger
+from . import sharding
+
+BASE_DIR = os.path.dirname(__file__)
+RULES_PATH = os.path.abspath(os.path.join(BASE_DIR, "..", "rules.json"))
+
+ACTIONS = ("forward", "tag", "reply", "drop")
+# Подстроки короче этого слишком часты, чтобы служить якорем
+MIN_ANCHOR = 3
+
+FIELDS = {
+    "id": "",
+    "name": "",
+    "enabled": True,
+    "sender": "",        # точный номер/имя отправителя или префикс со '*' в конце
+    "port": "",
+    "operator": "",      # код оператора SIM на порту приёма ("rus-mts")
+    "pattern": "",       # регулярное выражение по тексту, без учёта регистра
+    "extract_index": 0,  # номер группы pattern, значение которой извлекается
+    "action": "tag",
+    "target": "",        # адрес пересылки, метка или текст ответа ({extract} — извлечённое)
+    "stop": False,       # не применять следующие правила после срабатывания
+}
+
+
+class RuleError(ValueError):
+    """Правило не прошло проверку."""
+
+
+# ---------- обязательные подстроки регулярного выражения ----------
+def _anchor(seq):
+    """
+    Лучший набор подстрок, одна из которых обязательно встречается в
+    любом совпадении последовательности seq, или None. «Лучший» — с
+    самой длинной кратчайшей подстрокой.
+    """
+    candidates = []
+    run = []
+
+    def close_run():
+        if run:
+            candidates.append({"".join(run)})
+            run.clear()
+
+    for op, arg in seq:
+        if op == LITERAL:
+            run.append(chr(arg).lower())
+            continue
+        close_run()
+        if op == SUBPATTERN:
+            sub = _anchor(arg[-1])
+        elif op == BRANCH:
+            alts = [_anchor(alt) for alt in arg[1]]
+            sub = set().union(*alts) if alts and all(alts) else None
+        elif op in (MAX_REPEAT, MIN_REPEAT) and arg[0] >= 1:
+            sub = _anchor(arg[2])
+        else:
+            sub = None
+        if sub:
+            candidates.append(sub)
+    close_run()
+    if not candidates:
+        return None
+    return max(candidates, key=lambda lits: min(len(lit) for lit in lits))
+
+
+def required_literals(pattern):
+    """Подстроки (в нижнем регистре), одна из которых есть в любом совпадении, или None."""
+    try:
+        lits = _anchor(sre_parse.parse(pattern))
+    except Exception:
+        return None
+    if not lits or min(len(lit) for lit in lits) < MIN_ANCHOR:
+        return None
+    return lits
+
+
+@lru_cache(maxsize=1 << 16)
+def _pattern_info(pattern):
+    """
+    Скомпилированное выражение и его якорные подстроки. Кэшируется, чтобы
+    правка одного правила не разбирала заново тысячи остальных.
+    """
+    if not pattern:
+        return None, None
+    return re.compile(pattern, re.IGNORECASE), required_literals(pattern)
+
+
+# ---------- Ахо — Корасик ----------
+class AhoCorasick:
+    """Поиск множества подстрок за один проход по тексту."""
+
+    def __init__(self, words):
+        # узел: переходы, ссылка неудачи, номера слов, заканчивающихся здесь
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for value, word in words:
+            node = 0
+            for ch in word:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                node = nxt
+            self._out[node] = self._out[node] + (value,)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def search(self, text):
+        """Множество значений всех слов, встретившихся в text."""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+# ---------- правила ----------
+def normalize(rule):
+    """Проверяет правило и возвращает его с заполненными полями по умолчанию."""
+    if not isinstance(rule, dict):
+        raise RuleError("rule must be an object")
+    unknown = set(rule) - set(FIELDS)
+    if unknown:
+        raise RuleError(f"unknown fields: {', '.join(sorted(unknown))}")
+    rule = dict(FIELDS, **rule)
+    rule["id"] = str(rule["id"] or uuid.uuid4().hex)
+    for key in ("name", "sender", "port", "operator", "pattern", "target", "action"):
+        if not isinstance(rule[key], str):
+            raise RuleError(f"{key} must be a string")
+    if rule["action"] not in ACTIONS:
+        raise RuleError(f"action must be one of {', '.join(ACTIONS)}")
+    if rule["action"] in ("forward", "tag", "reply") and not rule["target"]:
+        raise RuleError(f"{rule['action']} needs a target")
+    try:
+        compiled = re.compile(rule["pattern"], re.IGNORECASE)
+    except re.error as e:
+        raise RuleError(f"invalid pattern: {e}")
+    try:
+        rule["extract_index"] = int(rule["extract_index"] or 0)
+    except (TypeError, ValueError):
+        raise RuleError("extract_index must be an integer")
+    if not 0 <= rule["extract_index"] <= compiled.groups:
+        raise RuleError(f"pattern has no group {rule['extract_index']}")
+    rule["enabled"] = bool(rule["enabled"])
+    rule["stop"] = bool(rule["stop"])
+    return rule
+
+
+class _Compiled:
+    __slots__ = ("order", "rule", "regex", "literals", "sender", "sender_prefix")
+
+    def __init__(self, order, rule):
+        self.order = order
+        self.rule = rule
+        self.regex, self.literals = _pattern_info(rule["pattern"])
+        sender = rule["sender"].lower()
+        self.sender_prefix = sender.endswith("*")
+        self.sender = sender.rstrip("*")
+
+    def check(self, sender, port, operator, text):
+        """Полная проверка условий; возвращает извлечённое значение или None."""
+        rule = self.rule
+        if self.sender:
+            if self.sender_prefix:
+                if not sender.startswith(self.sender):
+                    return None
+            elif sender != self.sender:
+                return None
+        if rule["port"] and rule["port"] != port:
+            return None
+        if rule["operator"] and rule["operator"] != operator:
+            return None
+        if self.regex is None:
+            return ""
+        m = self.regex.search(text)
+        if m is None:
+            return None
+        return m.group(rule["extract_index"]) or ""
+
+
+class RuleSet:
+    """Неизменяемый скомпилированный набор правил."""
+
+    def __init__(self, rules):
+        self.rules = [r for r in rules]
+        compiled = [_Compiled(i, r) for i, r in enumerate(self.rules) if r["enabled"]]
+        self.by_sender = {}
+        self.by_port = {}
+        self.by_operator = {}
+        self.always = []
+        words = []
+        for c in compiled:
+            if c.literals:
+                words.extend((c, lit) for lit in c.literals)
+            elif c.sender and not c.sender_prefix:
+                self.by_sender.setdefault(c.sender, []).append(c)
+            elif c.rule["port"]:
+                self.by_port.setdefault(c.rule["port"], []).append(c)
+            elif c.rule["operator"]:
+                self.by_operator.setdefault(c.rule["operator"], []).append(c)
+            else:
+                self.always.append(c)
+        self.automaton = AhoCorasick(words) if words else None
+
+    def candidates(self, sender, port, operator, text):
+        found = set(self.always)
+        if self.automaton is not None:
+            found.update(self.automaton.search(text.lower()))
+        for index, key in ((self.by_sender, sender), (self.by_port, port),
+                           (self.by_operator, operator)):
+            if key in index:
+                found.update(index[key])
+        return sorted(found, key=lambda c: c.order)
+
+    def match(self, sender, port, operator, text):
+        """Сработавшие правила по порядку: список (rule, извлечённое значение)."""
+        sender = (sender or "").lower()
+        text = text or ""
+        matched = []
+        for c in self.candidates(sender, port, operator, text):
+            value = c.check(sender, port, operator, text)
+            if value is None:
+                continue
+            matched.append((c.rule, value))
+            if c.rule["stop"]:
+                break
+        return matched
+
+
+class RuleEngine:
+    """Правила процесса: хранение в rules.json, компиляция и применение к SMS."""
+
+    def __init__(self, path=RULES_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self.ruleset = RuleSet(self._load())
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            return []
+        except ValueError as e:
+            print(f"Warning: {self.path} испорчен: {e}")
+            return []
+        rules = []
+        for item in raw:
+            try:
+                rules.append(normalize(item))
+            except RuleError as e:
+                print(f"Warning: правило {item.get('id') if isinstance(item, dict) else item} пропущено: {e}")
+        return rules
+
+    def _save(self, rules):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(rules, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _replace(self, rules):
+        ruleset = RuleSet(rules)
+        self._save(rules)
+        # Чтение идёт без блокировки: сопоставитель подменяется целиком
+        self.ruleset = ruleset
+
+    # ---------- изменение ----------
+    def list(self):
+        return [dict(r) for r in self.ruleset.rules]
+
+    def get(self, rule_id):
+        for rule in self.ruleset.rules:
+            if rule["id"] == rule_id:
+                return dict(rule)
+        return None
+
+    def add(self, rule):
+        rule = normalize(dict(rule, id=rule.get("id") or ""))
+        with self._lock:
+            rules = list(self.ruleset.rules)
+            if any(r["id"] == rule["id"] for r in rules):
+                raise RuleError("rule id already exists")
+            rules.append(rule)
+            self._replace(rules)
+        return rule
+
+    def update(self, rule_id, changes):
+        with self._lock:
+            rules = list(self.ruleset.rules)
+            for i, rule in enumerate(rules):
+                if rule["id"] == rule_id:
+                    rules[i] = normalize(dict(rule, **changes, id=rule_id))
+                    self._replace(rules)
+                    return rules[i]
+        return None
+
+    def delete(self, rule_id):
+        with self._lock:
+            rules = [r for r in self.ruleset.rules if r["id"] != rule_id]
+            if len(rules) == len(self.ruleset.rules):
+                return False
+            self._replace(rules)
+        return True
+
+    # ---------- применение ----------
+    def on_action(self, action, handler):
+        """handler(record, rule, value) выполняет действие action."""
+        self._handlers[action] = handler
+
+    def match(self, record, operator=None):
+        return self.ruleset.match(
+            record.get("phone"), record.get("port"), operator, record.get("text")
+        )
+
+    def apply(self, record, operator=None):
+        """Выполняет действия сработавших правил; возвращает их список."""
+        matched = self.match(record, operator)
+        for rule, value in matched:
+            handler = self._handlers.get(rule["action"])
+            if handler is None:
+                continue
+            try:
+                handler(record, rule, value)
+            except Exception as e:
+                event_logger.log_event(
+                    "rule_error", port=record.get("port"), phone=record.get("phone"),
+                    details=f"{rule['id']}: {e}",
+                )
+            if rule["action"] == "drop":
+                break
+        return matched
+
+
+def render_target(rule, value):
+    """target правила с подставленным извлечённым значением."""
+    return rule["target"].replace("{extract}", value or "")
+
+
+def attach(inbox, engine=None):
+    """
+    Подключает правила к приёму SMS: каждое сохранённое сообщение проходит
+    через engine.apply. tag пишет метку в inbox_tags, reply ставит ответ в
+    очередь отправки с того же порта, drop удаляет сообщение, forward
+    передаёт его адресату target в forwarding.
+    """
+    from . import sms_queue
+    from . import forwarding
+
+    engine = engine or get_engine()
+    engine.on_action("tag", lambda record, rule, value: inbox.tag(
+        record["id"], render_target(rule, value)))
+    engine.on_action("drop", lambda record, rule, value: inbox.delete(record["id"]))
+    engine.on_action("reply", lambda record, rule, value: sms_queue.get_queue().submit(
+        record["port"], record["phone"], render_target(rule, value)))
+    engine.on_action("forward", lambda record, rule, value: forwarding.get_forwarder().forward(
+        record, rule, value))
+
+    def listener(record):
+        if record.get("phone") or record.get("text"):
+            engine.apply(record, sharding.call(record["port"], "cached_operator"))
+
+    inbox.add_listener(listener)
+    return engine
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RuleEngine()
+    return _engine
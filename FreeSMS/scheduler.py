@@ -0,0 +1,203 @@
+# FreeSMS/scheduler.py
+
+"""
+Очередь команд к модемам: не больше одной операции на порт одновременно.
+
+/api/connect, /api/modem_info, монитор, чтение входящих, отправка SMS и
+AT-команды раньше открывали один и тот же порт наперегонки. Теперь
+каждая операция с портом ставится в очередь этого порта и выполняется
+его потоком по приоритету:
+  INTERACTIVE  действия пользователя и отправка: AT, USSD, SMS
+  CONNECT      подключение портов (/api/connect, опрос для рассылок)
+  POLL         фоновый опрос монитора и чтение входящих
+Выполняющаяся операция не прерывается, поэтому интерактивная команда
+ждёт не дольше одной операции, даже если идёт полный опрос всех портов.
+
+Одинаковые ожидающие get_modem_info (тот же порт, язык и full)
+выполняются один раз, все вызвавшие получают один результат; если
+к ожидающей операции присоединяется более срочный вызов, она поднимается
+до его приоритета. Функции, которые читают только кэши modem_utils,
+выполняются сразу, без очереди.
+
+Поток порта создаётся при первой операции и завершается после IDLE_TIMEOUT
+секунд без работы.
+"""
+
+import heapq
+import itertools
+import threading
+import concurrent.futures
+
+from . import modem_utils
+
+INTERACTIVE = 0
+CONNECT = 1
+POLL = 2
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", CONNECT: "connect", POLL: "poll"}
+
+# Приоритет операций, для которых вызывающий его не указал
+DEFAULT_PRIORITY = {
+    "send_at_command": INTERACTIVE,
+    "send_sms": INTERACTIVE,
+    "send_ussd": INTERACTIVE,
+    "release_port": INTERACTIVE,
+    "get_modem_info": CONNECT,
+    "read_sms": POLL,
+    "delete_sms": POLL,
+}
+# Операции, одинаковые вызовы которых можно объединять
+COALESCE = frozenset(("get_modem_info",))
+# Операции только с кэшами: выполняются сразу в потоке вызывающего
+DIRECT = frozenset(("routing_info", "cached_operator", "cached_iccid", "forget_port"))
+
+# Через сколько секунд без операций поток порта завершается
+IDLE_TIMEOUT = 60.0
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "name", "args", "kwargs", "key", "future", "started")
+
+    def __init__(self, priority, seq, name, args, kwargs, key):
+        self.priority = priority
+        self.seq = seq
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.future = concurrent.futures.Future()
+        self.started = False
+
+
+class _PortQueue:
+    def __init__(self, lock):
+        self.heap = []
+        # ключ объединения -> ожидающая операция
+        self.pending = {}
+        self.cond = threading.Condition(lock)
+        self.thread = None
+        self.running = None
+        self.executed = 0
+        self.coalesced = 0
+
+
+class Scheduler:
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._seq = itertools.count()
+
+    def submit(self, port, name, *args, priority=None, **kwargs):
+        """
+        Ставит modem_utils.<name>(port, *args, **kwargs) в очередь порта и
+        возвращает concurrent.futures.Future с результатом.
+        """
+        if priority is None:
+            priority = DEFAULT_PRIORITY.get(name, INTERACTIVE)
+        if name in DIRECT:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(getattr(modem_utils, name)(port, *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        if name not in DEFAULT_PRIORITY:
+            raise ValueError(f"unknown port operation {name!r}")
+        key = (name, args, tuple(sorted(kwargs.items()))) if name in COALESCE else None
+        with self._lock:
+            queue = self._queues.get(port)
+            if queue is None:
+                queue = self._queues[port] = _PortQueue(self._lock)
+            job = queue.pending.get(key) if key is not None else None
+            if job is not None:
+                queue.coalesced += 1
+                if priority < job.priority:
+                    # Старая запись в куче останется и будет пропущена
+                    job.priority = priority
+                    heapq.heappush(queue.heap, (priority, job.seq, job))
+                return job.future
+            job = _Job(priority, next(self._seq), name, args, kwargs, key)
+            heapq.heappush(queue.heap, (priority, job.seq, job))
+            if key is not None:
+                queue.pending[key] = job
+            if queue.thread is None:
+                queue.thread = threading.Thread(
+                    target=self._run, args=(port, queue), name=f"port-{port}", daemon=True
+                )
+                queue.thread.start()
+            else:
+                queue.cond.notify()
+        return job.future
+
+    def call(self, port, name, *args, priority=None, **kwargs):
+        """Как submit, но ждёт и возвращает результат (или пробрасывает ошибку)."""
+        return self.submit(port, name, *args, priority=priority, **kwargs).result()
+
+    def poll(self, ports, lang, priority=POLL):
+        """get_modem_info по всем ports через их очереди: {port: info или исключение}."""
+        futures = {
+            p: self.submit(p, "get_modem_info", lang, priority=priority) for p in ports
+        }
+        results = {}
+        for port, future in futures.items():
+            try:
+                results[port] = future.result()
+            except Exception as e:
+                results[port] = e
+        return results
+
+    def _next_job(self, port, queue):
+        with self._lock:
+            while True:
+                while queue.heap:
+                    priority, _, job = heapq.heappop(queue.heap)
+                    if job.started or priority != job.priority:
+                        continue
+                    job.started = True
+                    if job.key is not None:
+                        queue.pending.pop(job.key, None)
+                    queue.running = job
+                    return job
+                queue.running = None
+                if not queue.cond.wait(self.idle_timeout) and not queue.heap:
+                    queue.thread = None
+                    del self._queues[port]
+                    return None
+
+    def _run(self, port, queue):
+        while True:
+            job = self._next_job(port, queue)
+            if job is None:
+                return
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = getattr(modem_utils, job.name)(port, *job.args, **job.kwargs)
+            except BaseException as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(result)
+            queue.executed += 1
+
+    def stats(self):
+        """Очереди портов: ожидающие операции по приоритетам и текущая операция."""
+        result = {}
+        with self._lock:
+            for port, queue in self._queues.items():
+                waiting = {}
+                for priority, _, job in queue.heap:
+                    if not job.started and priority == job.priority:
+                        name = PRIORITY_NAMES[priority]
+                        waiting[name] = waiting.get(name, 0) + 1
+                running = queue.running
+                result[port] = {
+                    "waiting": waiting,
+                    "running": running.name if running is not None else None,
+                    "executed": queue.executed,
+                    "coalesced": queue.coalesced,
+                }
+        return result
+
+
+SCHEDULER = Scheduler()
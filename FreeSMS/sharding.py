@@ -0,0 +1,502 @@
+# FreeSMS/sharding.py
+
+"""
+Распределение портов модемов по нескольким процессам.
+
+В одном процессе опрос, разбор ответов и ведение кэшей всех портов
+упираются в один GIL. С "workers" > 0 порты делятся между процессами-
+обработчиками: каждый единолично открывает свои порты и держит для них
+пул сессий, кэши и port_health. Главный процесс (Flask, очереди, базы)
+сам к модемам не обращается: call() отправляет вызов функции modem_utils
+владельцу порта по Pipe и ждёт ответ, poll() опрашивает все порты одним
+запросом на обработчик, и монитор сводит их ответы в общий поток.
+
+Раз в rebalance_interval секунд список портов сверяется с бэкендом:
+новые порты достаются наименее загруженному обработчику, порты
+исчезнувших модемов освобождаются, и если загрузка разошлась больше
+чем на один порт, лишние порты переезжают (старый владелец закрывает
+сессию до того, как новый её откроет). Упавший обработчик
+перезапускается с теми же портами.
+
+Без раздела "sharding" или с "workers": 0 call() выполняет функцию
+modem_utils в этом же процессе. В обоих случаях операции с портом идут
+через его очередь в scheduler.
+
+Параметры (раздел "sharding" config.json):
+  workers             число процессов-обработчиков (0 — не делить)
+  worker_threads      потоков на вызовы в каждом обработчике (32)
+  rebalance_interval  период сверки списка портов, с (30)
+  call_timeout        сколько ждать ответ обработчика, с (60)
+"""
+
+import time
+import pickle
+import itertools
+import threading
+import concurrent.futures
+import multiprocessing
+
+from . import event_logger
+from . import modem_utils
+from .scheduler import SCHEDULER
+
+DEFAULTS = {
+    "workers": 0,
+    "worker_threads": 32,
+    "rebalance_interval": 30,
+    "call_timeout": 60,
+}
+
+# Пауза перед перезапуском упавшего обработчика, с
+RESTART_DELAY = 1.0
+
+# Функции modem_utils, которые обработчик выполняет для своих портов
+PORT_CALLS = frozenset((
+    "get_modem_info", "send_at_command", "send_sms", "send_ussd", "read_sms", "delete_sms",
+    "forget_port", "release_port", "routing_info", "cached_operator", "cached_iccid",
+))
+
+
+class ShardError(Exception):
+    """Обработчик недоступен или его ответ нельзя передать."""
+
+
+# ---------- процесс-обработчик ----------
+def _worker_call(name, args, kwargs):
+    if name == "poll":
+        return SCHEDULER.poll(*args)
+    if name == "release":
+        for port in args[0]:
+            SCHEDULER.call(port, "release_port")
+        return None
+    if name == "port_health":
+        return modem_utils.PORT_HEALTH.snapshot()
+    if name == "scheduler_stats":
+        return SCHEDULER.stats()
+    raise ShardError(f"unknown call {name!r}")
+
+
+def _portable_error(exc):
+    """Исключение, которое переживёт pickle; иначе ShardError с его текстом."""
+    try:
+        pickle.loads(pickle.dumps(exc))
+        return exc
+    except Exception:
+        return ShardError(f"{type(exc).__name__}: {exc}")
+
+
+def _worker_main(conn, threads, backend=None):
+    """
+    Цикл обработчика. Вызовы функций порта ставятся в очередь
+    планировщика, и ответ уходит, когда операция выполнена; остальные
+    (poll, release, ...) выполняются в пуле потоков.
+    """
+    if backend is not None:
+        from . import backends
+        backends.set_backend(backends.create_backend(*backend))
+    send_lock = threading.Lock()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    # call_id -> Future планировщика, пока операция порта не выполнена
+    jobs = {}
+
+    def reply(call_id, ok, value):
+        with send_lock:
+            try:
+                conn.send((call_id, ok, value))
+            except Exception as e:
+                conn.send((call_id, False, ShardError(f"unpicklable result: {e}")))
+
+    def done(call_id, future):
+        jobs.pop(call_id, None)
+        try:
+            reply(call_id, True, future.result())
+        except BaseException as e:
+            reply(call_id, False, _portable_error(e))
+
+    def run(call_id, name, args, kwargs):
+        try:
+            value = _worker_call(name, args, kwargs)
+        except BaseException as e:
+            reply(call_id, False, _portable_error(e))
+        else:
+            reply(call_id, True, value)
+
+    while True:
+        try:
+            call_id, name, args, kwargs = conn.recv()
+        except (EOFError, OSError):
+            # Главный процесс завершился
+            return
+        if name == "stop":
+            return
+        if name == "cancel":
+            # Снимает с очереди порта операцию args[0], если она ещё не началась;
+            # её собственный ответ (CancelledError) уходит раньше этого
+            job = jobs.get(args[0])
+            reply(call_id, True, job is not None and job.cancel())
+            continue
+        if name in PORT_CALLS:
+            try:
+                future = SCHEDULER.submit(args[0], name, *args[1:], **kwargs)
+            except Exception as e:
+                reply(call_id, False, _portable_error(e))
+                continue
+            jobs[call_id] = future
+            future.add_done_callback(lambda f, call_id=call_id: done(call_id, f))
+        else:
+            executor.submit(run, call_id, name, args, kwargs)
+
+
+# ---------- главный процесс ----------
+class _RemoteCall(concurrent.futures.Future):
+    """
+    Future вызова в обработчике. cancel() снимает операцию с очереди порта
+    в самом обработчике и удаётся, только если она там ещё не началась.
+    """
+
+    def __init__(self, worker, call_id):
+        super().__init__()
+        self._worker = worker
+        self._call_id = call_id
+
+    def cancel(self):
+        if self.done():
+            return self.cancelled()
+        return self._worker.cancel(self._call_id)
+
+
+class _Worker:
+    """Процесс-обработчик и клиент его Pipe."""
+
+    def __init__(self, manager, index):
+        self.manager = manager
+        self.index = index
+        self.process = None
+        self.conn = None
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count()
+
+    def start(self):
+        ctx = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.manager.config["worker_threads"], self.manager.backend),
+            name=f"freesms-shard-{self.index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        threading.Thread(
+            target=self._receive, args=(parent_conn,),
+            name=f"shard-{self.index}-recv", daemon=True,
+        ).start()
+
+    def submit(self, name, *args, **kwargs):
+        """Отправляет вызов и возвращает concurrent.futures.Future с ответом."""
+        call_id = next(self._ids)
+        future = _RemoteCall(self, call_id)
+        with self._pending_lock:
+            self._pending[call_id] = future
+        try:
+            with self._send_lock:
+                self.conn.send((call_id, name, args, kwargs))
+        except (OSError, ValueError) as e:
+            with self._pending_lock:
+                self._pending.pop(call_id, None)
+            future.set_exception(ShardError(f"shard {self.index}: {e}"))
+        return future
+
+    def call(self, name, *args, **kwargs):
+        future = self.submit(name, *args, **kwargs)
+        try:
+            return future.result(self.manager.config["call_timeout"])
+        except concurrent.futures.TimeoutError:
+            raise ShardError(f"shard {self.index}: {name} timed out")
+
+    def cancel(self, call_id):
+        """Отменяет в обработчике ещё не начатую операцию порта call_id."""
+        try:
+            return self.call("cancel", call_id)
+        except ShardError:
+            return False
+
+    def _receive(self, conn):
+        while True:
+            try:
+                call_id, ok, value = conn.recv()
+            except (EOFError, OSError):
+                break
+            except Exception as e:
+                # Ответ не удалось разобрать; его вызов дождётся таймаута
+                event_logger.log_event("shard_error", details=f"shard {self.index}: {e}")
+                continue
+            with self._pending_lock:
+                future = self._pending.pop(call_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(value)
+            elif isinstance(value, concurrent.futures.CancelledError):
+                # Операцию отменил cancel(): Future отменяется и здесь
+                concurrent.futures.Future.cancel(future)
+            else:
+                future.set_exception(value)
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ShardError(f"shard {self.index} exited"))
+        if conn is self.conn:
+            self.manager._worker_exited(self)
+
+    def stop(self):
+        try:
+            with self._send_lock:
+                self.conn.send((None, "stop", (), {}))
+        except (OSError, ValueError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class ShardManager:
+    """
+    backend — (имя, параметры) бэкенда для обработчиков (бенчмарки);
+    по умолчанию обработчики выбирают его по config.json, как и этот процесс.
+    """
+
+    def __init__(self, config=None, backend=None):
+        self.config = dict(DEFAULTS, **(config or {}))
+        self.backend = backend
+        self.workers = []
+        self._owner = {}
+        # Порты, которые сейчас переезжают: вызовы для них ждут конца переезда
+        self._moving = set()
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.workers = [_Worker(self, i) for i in range(self.config["workers"])]
+        for worker in self.workers:
+            worker.start()
+        self.rebalance()
+        self._thread = threading.Thread(target=self._loop, name="shard-rebalance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        for worker in self.workers:
+            worker.stop()
+
+    def _loop(self):
+        while not self._stopped.wait(self.config["rebalance_interval"]):
+            try:
+                self.rebalance()
+            except Exception as e:
+                event_logger.log_event("shard_error", details=str(e))
+
+    def _worker_exited(self, worker):
+        if self._stopped.is_set():
+            return
+        event_logger.log_event(
+            "shard_restart", details=f"shard {worker.index} exit code {worker.process.exitcode}"
+        )
+        # Пауза, чтобы обработчик, падающий при старте, не перезапускался без конца
+        time.sleep(RESTART_DELAY)
+        if not self._stopped.is_set():
+            worker.start()
+
+    # ---------- распределение портов ----------
+    def _loads(self):
+        loads = {w.index: 0 for w in self.workers}
+        for index in self._owner.values():
+            loads[index] += 1
+        return loads
+
+    def _assign(self, port):
+        loads = self._loads()
+        index = min(loads, key=lambda i: (loads[i], i))
+        self._owner[port] = index
+        return index
+
+    def rebalance(self, ports=None):
+        """Сверяет порты со списком бэкенда и выравнивает загрузку обработчиков."""
+        ports = set(ports if ports is not None else modem_utils.list_modem_ports())
+        released = {}
+        with self._cond:
+            for port in [p for p in self._owner if p not in ports]:
+                released.setdefault(self._owner.pop(port), []).append(port)
+            added = [p for p in sorted(ports) if p not in self._owner]
+            for port in added:
+                self._assign(port)
+            moves = []
+            loads = self._loads()
+            while loads and max(loads.values()) - min(loads.values()) > 1:
+                src = max(loads, key=loads.get)
+                dst = min(loads, key=loads.get)
+                port = max(p for p, i in self._owner.items() if i == src)
+                moves.append((port, src, dst))
+                loads[src] -= 1
+                loads[dst] += 1
+            # Переезжающий порт ждёт, пока старый владелец закроет сессию
+            for port, src, _ in moves:
+                self._owner.pop(port)
+                self._moving.add(port)
+                released.setdefault(src, []).append(port)
+        for index, gone in released.items():
+            try:
+                self.workers[index].call("release", gone)
+            except Exception as e:
+                event_logger.log_event("shard_error", details=f"shard {index}: {e}")
+        with self._cond:
+            for port, _, dst in moves:
+                self._owner[port] = dst
+                self._moving.discard(port)
+            self._cond.notify_all()
+        if added or moves or released:
+            event_logger.log_event(
+                "shard_rebalance",
+                details=f"added {len(added)}, moved {len(moves)}, "
+                        f"removed {sum(map(len, released.values())) - len(moves)}",
+            )
+
+    def owner(self, port):
+        """Обработчик порта; порт, появившийся между сверками, назначается сразу."""
+        with self._cond:
+            while port in self._moving:
+                self._cond.wait()
+            index = self._owner.get(port)
+            if index is None:
+                index = self._assign(port)
+            return self.workers[index]
+
+    def assignments(self):
+        """{номер обработчика: [порты]} и pid процессов — для /api/shards."""
+        with self._cond:
+            owner = dict(self._owner)
+        result = []
+        for worker in self.workers:
+            result.append({
+                "index": worker.index,
+                "pid": worker.process.pid,
+                "alive": worker.process.is_alive(),
+                "ports": sorted(p for p, i in owner.items() if i == worker.index),
+            })
+        return result
+
+    # ---------- вызовы ----------
+    def submit(self, port, name, *args, **kwargs):
+        """Отправляет modem_utils.<name>(port, *args) владельцу порта; Future с ответом."""
+        return self.owner(port).submit(name, port, *args, **kwargs)
+
+    def call(self, port, name, *args, **kwargs):
+        """Выполняет modem_utils.<name>(port, *args) в процессе-владельце порта."""
+        return self.owner(port).call(name, port, *args, **kwargs)
+
+    def poll(self, ports, lang):
+        """
+        get_modem_info по всем ports: по одному запросу на обработчик,
+        обработчики опрашивают свои порты параллельно. {port: info или исключение}.
+        """
+        groups = {}
+        for port in ports:
+            groups.setdefault(self.owner(port), []).append(port)
+        futures = {worker.submit("poll", group, lang): group for worker, group in groups.items()}
+        results = {}
+        timeout = self.config["call_timeout"]
+        for future, group in futures.items():
+            try:
+                results.update(future.result(timeout))
+            except Exception as e:
+                if isinstance(e, concurrent.futures.TimeoutError):
+                    e = ShardError("poll timed out")
+                for port in group:
+                    results[port] = e
+        return results
+
+    def gather(self, name):
+        """Объединённые словари {port: ...}, которые вернул вызов name у всех обработчиков."""
+        merged = {}
+        for future in [w.submit(name) for w in self.workers]:
+            try:
+                merged.update(future.result(self.config["call_timeout"]))
+            except Exception as e:
+                event_logger.log_event("shard_error", details=str(e))
+        return merged
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def start(config=None):
+    """
+    Запускает обработчики, если в config задано workers > 0; иначе None.
+    В самих обработчиках (дочерних процессах) ничего не делает.
+    """
+    global _manager
+    config = dict(DEFAULTS, **(config or {}))
+    if config["workers"] <= 0 or multiprocessing.parent_process() is not None:
+        return None
+    with _manager_lock:
+        if _manager is None:
+            _manager = ShardManager(config)
+            _manager.start()
+    return _manager
+
+
+def get_manager():
+    """Менеджер обработчиков или None, если порты не делятся."""
+    return _manager
+
+
+def call(port, name, *args, priority=None, **kwargs):
+    """
+    modem_utils.<name>(port, *args, **kwargs) через очередь порта (scheduler)
+    у процесса-владельца порта или в этом процессе. priority — приоритет
+    операции в очереди (по умолчанию scheduler.DEFAULT_PRIORITY).
+    """
+    if name not in PORT_CALLS:
+        raise ShardError(f"unknown call {name!r}")
+    if _manager is not None:
+        return _manager.call(port, name, *args, priority=priority, **kwargs)
+    return SCHEDULER.call(port, name, *args, priority=priority, **kwargs)
+
+
+def submit(port, name, *args, priority=None, **kwargs):
+    """
+    Как call(), но не ждёт: возвращает concurrent.futures.Future с результатом.
+    Таймаут ожидания выбирает вызывающий.
+    """
+    if name not in PORT_CALLS:
+        raise ShardError(f"unknown call {name!r}")
+    if _manager is not None:
+        return _manager.submit(port, name, *args, priority=priority, **kwargs)
+    return SCHEDULER.submit(port, name, *args, priority=priority, **kwargs)
+
+
+def poll(ports, lang):
+    """get_modem_info с приоритетом POLL по всем ports: {port: info или исключение}."""
+    if _manager is not None:
+        return _manager.poll(ports, lang)
+    return SCHEDULER.poll(ports, lang)
+
+
+def port_health():
+    """Снимок port_health всех портов, где бы они ни обслуживались."""
+    if _manager is not None:
+        return _manager.gather("port_health")
+    return modem_utils.PORT_HEALTH.snapshot()
+
+
+def scheduler_stats():
+    """Очереди команд всех портов (см. Scheduler.stats)."""
+    if _manager is not None:
+        return _manager.gather("scheduler_stats")
+    return SCHEDULER.stats()
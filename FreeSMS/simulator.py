@@ -0,0 +1,445 @@
+# FreeSMS/simulator.py
+
+"""
+Симулятор фермы модемов для нагрузочного тестирования без железа.
+
+SimulatorBackend отдаёт N виртуальных портов (sim0 … simN-1). Каждый
+вызов виртуального StateMachine спит заданную задержку с разбросом,
+с заданной вероятностью завершается ошибкой соединения, уровень сигнала
+случайно дрейфует, а SIM-карты время от времени меняются: на время
+замены GetSecurityStatus сообщает об отсутствии SIM.
+
+Параметры (раздел "simulator" в config.json):
+  ports            число виртуальных портов (256)
+  latency_ms       задержка одной команды (20)
+  jitter_ms        разброс задержки, ± (5)
+  init_latency_ms  задержка Init (300)
+  failure_rate     вероятность ошибки на команду (0.0)
+  sim_swap_interval среднее время между заменами SIM на порт, с (0 — без замен)
+  sim_swap_duration сколько секунд слот пуст при замене (2)
+  signal_drift     максимальный шаг изменения RSSI за запрос (2)
+  dead_ports       список портов, которые не отвечают вовсе
+  incoming_rate    входящих SMS в минуту на порт (0)
+  ussd_latency_ms  время ответа сети на USSD-запрос (1500)
+  ussd_timeout_rate вероятность, что сеть не ответит на USSD (0.0)
+  seed             зерно генератора случайных чисел
+
+USSD-коды виртуальной сети: *100# — баланс, *103# — собственный номер,
+*111# — меню (1 — баланс, 2 — номер, 3 — тариф с подменю: 1 — сменить,
+0 — назад).
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from .backends import ModemBackend, is_gsm7
+from . import operator_index
+
+DEFAULTS = {
+    "ports": 256,
+    "latency_ms": 20.0,
+    "jitter_ms": 5.0,
+    "init_latency_ms": 300.0,
+    "failure_rate": 0.0,
+    "sim_swap_interval": 0.0,
+    "sim_swap_duration": 2.0,
+    "signal_drift": 2,
+    "dead_ports": [],
+    "incoming_rate": 0.0,
+    "ussd_latency_ms": 1500.0,
+    "ussd_timeout_rate": 0.0,
+    "seed": None,
+}
+
+# Сколько отправленных SMS помнит каждый виртуальный модем
+SENT_HISTORY = 1000
+# Сколько входящих SMS помещается в память виртуальной SIM
+INBOX_CAPACITY = 50
+
+MODELS = (("Huawei", "E173"), ("ZTE", "MF190"), ("Quectel", "EC25"), ("SIMCOM", "SIM800"))
+
+USSD_MENUS = {
+    "main": "1. Balance\n2. My number\n3. Tariff",
+    "tariff": "Tariff: Basic\n1. Change tariff\n0. Back",
+}
+
+
+def split_text(text):
+    """Части SMS тех же размеров, что у Gammu: 160/153 символа GSM или 70/67 UCS-2."""
+    single, part = (160, 153) if is_gsm7(text) else (70, 67)
+    if len(text) <= single:
+        return [text]
+    return [text[i:i + part] for i in range(0, len(text), part)]
+
+
+def concat_udh(ref, number, total):
+    if total < 2:
+        return {"Type": "NoUDH"}
+    return {"Type": "ConcatenatedMessages", "ID8bit": ref, "ID16bit": -1,
+            "PartNumber": number, "AllParts": total}
+
+
+class SimulatedModemError(Exception):
+    """Ошибка связи с виртуальным модемом (аналог ERR_TIMEOUT/ERR_DEVICE*)."""
+
+
+class SimulatedCommandError(Exception):
+    """Модем ответил ошибкой, но соединение исправно (аналог ERR_NOTSUPPORTED)."""
+
+
+class VirtualSim:
+    def __init__(self, rng, operators):
+        mccmnc, _ = rng.choice(operators) if operators else ("25001", "")
+        tail = "".join(rng.choice("0123456789") for _ in range(15))
+        self.imsi = (mccmnc + tail)[:15]
+        self.iccid = ("89" + mccmnc + tail)[:19]
+        self.phone = "+" + "".join(rng.choice("0123456789") for _ in range(11))
+        self.balance = round(rng.uniform(0, 500), 2)
+
+
+class VirtualModem:
+    """Состояние одного виртуального модема."""
+
+    def __init__(self, farm, port, index):
+        rng = farm.rng
+        self.farm = farm
+        self.port = port
+        self.vendor, self.model = MODELS[index % len(MODELS)]
+        self.imei = f"{860000000000000 + index:015d}"
+        self.sim = VirtualSim(rng, farm.operators)
+        self.rssi = rng.randint(5, 31)
+        self.lock = threading.Lock()
+        self.swap_until = 0.0
+        self.next_swap = self._schedule_swap(time.monotonic())
+        self.sent = deque(maxlen=SENT_HISTORY)
+        self.message_ref = 0
+        # location -> входящее SMS в формате GetNextSMS
+        self.inbox = {}
+        self.next_location = 1
+        self.next_incoming = self._schedule_incoming(time.monotonic())
+        # Открытое USSD-меню ("main", "tariff") или None
+        self.ussd_menu = None
+
+    def _schedule_swap(self, now):
+        interval = self.farm.options["sim_swap_interval"]
+        if not interval:
+            return float("inf")
+        return now + self.farm.rng.expovariate(1.0 / interval)
+
+    def _schedule_incoming(self, now):
+        rate = self.farm.options["incoming_rate"]
+        if not rate:
+            return float("inf")
+        return now + self.farm.rng.expovariate(rate / 60.0)
+
+    def tick(self):
+        """Продвигает состояние модема: замена SIM и входящие SMS по расписанию."""
+        now = time.monotonic()
+        with self.lock:
+            if now >= self.next_swap:
+                self.swap_until = now + self.farm.options["sim_swap_duration"]
+                self.sim = VirtualSim(self.farm.rng, self.farm.operators)
+                self.inbox.clear()
+                self.next_swap = self._schedule_swap(now)
+            while now >= self.next_incoming:
+                rng = self.farm.rng
+                code = rng.randint(100000, 999999)
+                text = f"Your verification code is {code}"
+                if rng.random() < 0.2:
+                    # Длинное сообщение: части приходят в случайном порядке
+                    text += ". " + " ".join(["Never share this code with anyone."] * 8)
+                self._store_long(f"+1555{code}", text, shuffle=True)
+                self.next_incoming = self._schedule_incoming(self.next_incoming)
+
+    def _store_incoming(self, sender, text, udh=None):
+        if len(self.inbox) >= INBOX_CAPACITY:
+            return False
+        location = self.next_location
+        self.next_location += 1
+        self.inbox[location] = {
+            "Folder": 0, "Location": location, "Number": sender, "Text": text,
+            "DateTime": datetime.now(), "SMSC": {"Number": "+10000000000"},
+            "UDH": udh or {"Type": "NoUDH"}, "State": "UnRead",
+        }
+        return True
+
+    def _store_long(self, sender, text, shuffle=False, skip=()):
+        chunks = split_text(text)
+        ref = self.farm.rng.randrange(256)
+        parts = list(enumerate(chunks, 1))
+        if shuffle:
+            self.farm.rng.shuffle(parts)
+        for number, chunk in parts:
+            if number not in skip:
+                self._store_incoming(sender, chunk, concat_udh(ref, number, len(chunks)))
+
+    def deliver(self, sender, text, udh=None):
+        """Кладёт входящее SMS в память SIM (для прогонов и проверок)."""
+        with self.lock:
+            return self._store_incoming(sender, text, udh)
+
+    def deliver_long(self, sender, text, shuffle=False, skip=()):
+        """Кладёт длинное SMS частями; номера частей из skip теряются."""
+        with self.lock:
+            self._store_long(sender, text, shuffle, skip)
+
+    def sim_present(self):
+        return time.monotonic() >= self.swap_until
+
+    def record_sent(self, message):
+        with self.lock:
+            self.message_ref = (self.message_ref + 1) % 256
+            self.sent.append((time.time(), message.get("Number"), message.get("Text")))
+            return self.message_ref
+
+    def ussd(self, text):
+        """Ответ сети на USSD-запрос или пункт меню: (статус Gammu, текст)."""
+        with self.lock:
+            menu, self.ussd_menu = self.ussd_menu, None
+            if text.startswith("*"):
+                # Новый код закрывает открытое меню
+                menu = None
+            balance = f"Balance: {self.sim.balance:.2f} RUB"
+            number = f"Your number: {self.sim.phone}"
+            if menu is None:
+                if text == "*100#":
+                    return "NoActionNeeded", balance
+                if text == "*103#":
+                    return "NoActionNeeded", number
+                if text == "*111#":
+                    self.ussd_menu = "main"
+                    return "ActionNeeded", USSD_MENUS["main"]
+                return "Terminated", "Unknown request"
+            if menu == "main" and text in ("1", "2"):
+                return "NoActionNeeded", balance if text == "1" else number
+            if menu == "main" and text == "3":
+                self.ussd_menu = "tariff"
+                return "ActionNeeded", USSD_MENUS["tariff"]
+            if menu == "tariff" and text == "1":
+                return "NoActionNeeded", "Tariff change requested"
+            if menu == "tariff" and text == "0":
+                self.ussd_menu = "main"
+                return "ActionNeeded", USSD_MENUS["main"]
+            self.ussd_menu = menu
+            return "ActionNeeded", "Invalid choice\n" + USSD_MENUS[menu]
+
+    def cancel_ussd(self):
+        with self.lock:
+            self.ussd_menu = None
+
+    def drift_signal(self):
+        step = self.farm.options["signal_drift"]
+        with self.lock:
+            self.rssi = max(0, min(31, self.rssi + self.farm.rng.randint(-step, step)))
+            return self.rssi
+
+
+class SimulatedStateMachine:
+    """Подмножество интерфейса gammu.StateMachine поверх VirtualModem."""
+
+    def __init__(self, farm, modem):
+        self._farm = farm
+        self._modem = modem
+        self._open = False
+        self._callback = None
+        self._ussd_enabled = False
+        # (monotonic-время готовности, данные) ответов сети, ещё не прочитанных
+        self._incoming = []
+
+    def _io(self, latency_ms=None):
+        opts = self._farm.options
+        if latency_ms is None:
+            latency_ms = opts["latency_ms"]
+        delay = latency_ms + self._farm.rng.uniform(-opts["jitter_ms"], opts["jitter_ms"])
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if not self._open:
+            raise SimulatedModemError(f"{self._modem.port}: not connected")
+        if self._farm.rng.random() < opts["failure_rate"]:
+            self._open = False
+            raise SimulatedModemError(f"{self._modem.port}: timeout")
+        self._modem.tick()
+
+    def _require_sim(self):
+        if not self._modem.sim_present():
+            raise SimulatedCommandError("SIM not inserted")
+
+    # --- жизненный цикл ---
+    def Init(self):
+        self._open = True
+        self._io(self._farm.options["init_latency_ms"])
+
+    def Terminate(self):
+        self._open = False
+
+    # --- информация о модеме и SIM ---
+    def GetModel(self):
+        self._io()
+        return {"Model": self._modem.model}
+
+    def GetManufacturer(self):
+        self._io()
+        return {"Manufacturer": self._modem.vendor}
+
+    def GetIMEI(self):
+        self._io()
+        return self._modem.imei
+
+    def GetSIMIMSI(self):
+        self._io()
+        self._require_sim()
+        return self._modem.sim.imsi
+
+    def GetICC(self):
+        self._io()
+        self._require_sim()
+        return self._modem.sim.iccid
+
+    def GetOwnNumbers(self):
+        self._io()
+        self._require_sim()
+        return [{"Number": self._modem.sim.phone}]
+
+    def GetSecurityStatus(self):
+        self._io()
+        self._require_sim()
+        return None
+
+    def GetNetworkInfo(self):
+        self._io()
+        if not self._modem.sim_present():
+            return {}
+        return {"State": "HomeNetwork", "NetworkCode": self._modem.sim.imsi[:5]}
+
+    def GetSignalQuality(self):
+        self._io()
+        rssi = self._modem.drift_signal()
+        return {"SignalStrength": rssi, "SignalPercent": int(rssi * 100 / 31), "BitErrorRate": 0}
+
+    # --- SMS ---
+    def SendSMS(self, message):
+        self._io()
+        self._require_sim()
+        return self._modem.record_sent(message)
+
+    def GetSMSStatus(self):
+        self._io()
+        self._require_sim()
+        with self._modem.lock:
+            used = len(self._modem.inbox)
+        return {"SIMUsed": used, "SIMSize": INBOX_CAPACITY, "SIMUnRead": used,
+                "PhoneUsed": 0, "PhoneSize": 0, "PhoneUnRead": 0, "TemplatesUsed": 0}
+
+    def GetNextSMS(self, Folder=0, Start=False, Location=0):
+        self._io()
+        self._require_sim()
+        with self._modem.lock:
+            locations = sorted(
+                loc for loc in self._modem.inbox if Start or loc > Location
+            )
+            if not locations:
+                raise SimulatedCommandError("empty")
+            return [dict(self._modem.inbox[locations[0]])]
+
+    def DeleteSMS(self, Folder, Location):
+        self._io()
+        with self._modem.lock:
+            if self._modem.inbox.pop(Location, None) is None:
+                raise SimulatedCommandError("invalid location")
+
+    # --- USSD ---
+    def SetIncomingCallback(self, callback):
+        self._callback = callback
+
+    def SetIncomingUSSD(self, enable=True):
+        self._io()
+        self._ussd_enabled = enable
+
+    def DialService(self, number):
+        self._io()
+        self._require_sim()
+        opts = self._farm.options
+        rng = self._farm.rng
+        if rng.random() < opts["ussd_timeout_rate"]:
+            # Сеть потеряла запрос: ответа не будет
+            self._modem.cancel_ussd()
+            return
+        status, text = self._modem.ussd(number)
+        delay = opts["ussd_latency_ms"] + rng.uniform(-opts["jitter_ms"], opts["jitter_ms"])
+        self._incoming.append((time.monotonic() + delay / 1000.0, {"Status": status, "Text": text}))
+
+    def ReadDevice(self, Wait=False):
+        if not self._open:
+            raise SimulatedModemError(f"{self._modem.port}: not connected")
+        now = time.monotonic()
+        due = [data for ready, data in self._incoming if ready <= now]
+        self._incoming = [(ready, data) for ready, data in self._incoming if ready > now]
+        for data in due:
+            if self._ussd_enabled and self._callback is not None:
+                self._callback(self, "USSD", data)
+        return len(due)
+
+    def SendATCommand(self, command):
+        self._io()
+        cmd = command.strip().upper()
+        if cmd == "AT+CUSD=2":
+            self._modem.cancel_ussd()
+            return "OK"
+        if cmd == "AT+CSQ":
+            return f"+CSQ: {self._modem.drift_signal()},0\r\nOK"
+        if cmd == "AT+CIMI":
+            self._require_sim()
+            return f"{self._modem.sim.imsi}\r\nOK"
+        return "OK"
+
+
+class ModemFarm:
+    """Набор виртуальных модемов с общими параметрами."""
+
+    def __init__(self, options=None):
+        self.options = dict(DEFAULTS, **(options or {}))
+        self.rng = random.Random(self.options["seed"])
+        try:
+            self.operators = list(operator_index.get_index().items())
+        except Exception:
+            self.operators = []
+        self.ports = [f"sim{i}" for i in range(int(self.options["ports"]))]
+        self.dead = set(self.options["dead_ports"])
+        self.modems = {
+            port: VirtualModem(self, port, i) for i, port in enumerate(self.ports)
+        }
+
+
+class SimulatorBackend(ModemBackend):
+    name = "simulator"
+
+    def __init__(self, options=None):
+        self.farm = ModemFarm(options)
+
+    def open(self, port):
+        modem = self.farm.modems.get(port)
+        if modem is None or port in self.farm.dead:
+            # Мёртвый порт отвечает только по таймауту, как настоящий
+            time.sleep(self.farm.options["init_latency_ms"] / 1000.0)
+            raise SimulatedModemError(f"{port}: no response")
+        sm = SimulatedStateMachine(self.farm, modem)
+        sm.Init()
+        return sm
+
+    def list_ports(self):
+        return list(self.farm.ports)
+
+    def is_connection_error(self, exc):
+        return isinstance(exc, SimulatedModemError)
+
+    def encode_sms(self, phone, text):
+        chunks = split_text(text)
+        ref = self.farm.rng.randrange(256)
+        return [
+            {"Number": phone, "Text": chunk, "UDH": concat_udh(ref, n, len(chunks)),
+             "SMSC": {"Location": 1}}
+            for n, chunk in enumerate(chunks, 1)
+        ]
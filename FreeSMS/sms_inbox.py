@@ -0,0 +1,369 @@
+# FreeSMS/sms_inbox.py
+
+"""
+Приём входящих SMS.
+
+Для каждого порта работает фоновый поток, который раз в interval секунд
+проверяет память модема (GetSMSStatus — одна дешёвая команда), вычитывает
+новые сообщения через GetNextSMS, сохраняет их в таблицу inbox базы
+sms.db одной транзакцией и только после этого удаляет из модема. Если
+процесс упадёт между записью и удалением, сообщение сохранится дважды,
+но не потеряется.
+
+Части длинных SMS до записи собираются в целое сообщение (см.
+sms_reassembly), так что в inbox и к подписчикам попадают только целые
+сообщения.
+
+Текст сообщений индексируется FTS5 (внешний контент, синхронизация
+триггерами), поэтому поиск по миллионам SMS не сканирует таблицу.
+После записи сообщения передаются подписчикам (add_listener) — так к
+приёму подключаются правила и пересылка.
+
+Параметры (раздел "sms_inbox" config.json):
+  interval        период опроса памяти модема, с (5)
+  delete          удалять сообщения из модема после сохранения (true)
+  sync_interval   как часто сверять список потоков со списком портов, с (30)
+  reassembly_timeout  сколько ждать недостающие части длинного SMS, с (600)
+"""
+
+import time
+import sqlite3
+import threading
+
+from . import event_logger
+from . import modem_utils
+from . import sharding
+from . import sms_queue
+from . import sms_reassembly
+
+DEFAULTS = {
+    "interval": 5.0,
+    "delete": True,
+    "sync_interval": 30.0,
+    "reassembly_timeout": sms_reassembly.TIMEOUT,
+}
+
+# Сколько сообщений читается с модема за один проход
+MAX_READ = 100
+# Максимальный размер страницы в query_records
+MAX_PAGE_SIZE = 500
+# Сколько символов текста отдаётся в списке сообщений
+PREVIEW_LENGTH = 160
+
+# ts — время сохранения (мс Unix), sent_at — время отправки по данным SMSC.
+# Сообщения выдаются в порядке сохранения, то есть по id: этот порядок
+# умеют отдавать и FTS5 (по rowid), и индексы по port/phone (rowid в
+# конце ключа), поэтому страница не требует сортировки всех совпадений
+_schema = """
+CREATE TABLE IF NOT EXISTS inbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts INTEGER NOT NULL,
+    port TEXT NOT NULL,
+    phone TEXT,
+    text TEXT NOT NULL,
+    sent_at INTEGER,
+    smsc TEXT,
+    parts INTEGER NOT NULL DEFAULT 1,
+    incomplete INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_inbox_ts ON inbox(ts);
+CREATE INDEX IF NOT EXISTS idx_inbox_port ON inbox(port);
+CREATE INDEX IF NOT EXISTS idx_inbox_phone ON inbox(phone);
+
+CREATE TABLE IF NOT EXISTS inbox_tags (
+    tag TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    PRIMARY KEY (tag, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_inbox_tags_message ON inbox_tags(message_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS inbox_fts USING fts5(
+    text, content='inbox', content_rowid='id', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS inbox_ai AFTER INSERT ON inbox BEGIN
+    INSERT INTO inbox_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS inbox_ad AFTER DELETE ON inbox BEGIN
+    INSERT INTO inbox_fts(inbox_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    DELETE FROM inbox_tags WHERE message_id = old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS inbox_au AFTER UPDATE OF text ON inbox BEGIN
+    INSERT INTO inbox_fts(inbox_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    INSERT INTO inbox_fts(rowid, text) VALUES (new.id, new.text);
+END;
+"""
+
+_INSERT = (
+    "INSERT INTO inbox (ts, port, phone, text, sent_at, smsc, parts, incomplete) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_ROW_FIELDS = ("ts", "port", "phone", "text", "sent_at", "smsc", "parts", "incomplete")
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def fts_query(q):
+    """
+    Превращает пользовательскую строку в запрос FTS5: каждое слово —
+    отдельная фраза в кавычках (все должны встретиться), '*' в конце
+    слова — поиск по префиксу.
+    """
+    terms = []
+    for word in q.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def _migrate(conn):
+    """Добавляет колонки parts/incomplete в базы, созданные до сборки частей."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(inbox)")}
+    for column in ("parts INTEGER NOT NULL DEFAULT 1", "incomplete INTEGER NOT NULL DEFAULT 0"):
+        if column.split()[0] not in columns:
+            conn.execute(f"ALTER TABLE inbox ADD COLUMN {column}")
+
+
+def _message_row(port, msg, now):
+    sent_at = msg["SentAt"] if "SentAt" in msg else sms_reassembly.sent_at_ms(msg)
+    smsc = (msg.get("SMSC") or {}).get("Number")
+    return (
+        now, port, msg.get("Number") or None, msg.get("Text") or "", sent_at, smsc or None,
+        msg.get("Parts", 1), int(bool(msg.get("Incomplete"))),
+    )
+
+
+class Inbox:
+    def __init__(self, config=None, db_path=sms_queue.DB_PATH):
+        self.config = dict(DEFAULTS, **(config or {}))
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._readers = {}
+        self._listeners = []
+        self._thread = None
+        self.reassembler = None
+
+    # ---------- хранилище ----------
+    def init_db(self):
+        with self._lock:
+            if self._conn is not None:
+                return
+            conn = _connect(self.db_path)
+            conn.executescript(_schema)
+            _migrate(conn)
+            conn.commit()
+            self._conn = conn
+            self.reassembler = sms_reassembly.Reassembler(
+                conn, self._lock, self.store, timeout=self.config["reassembly_timeout"]
+            )
+        # Вне блокировки: сборщик сам берёт self._lock
+        self.reassembler.init_db()
+
+    def store(self, port, messages):
+        """Сохраняет сообщения одной транзакцией и оповещает подписчиков."""
+        if not messages:
+            return []
+        now = int(time.time() * 1000)
+        rows = [_message_row(port, msg, now) for msg in messages]
+        stored = []
+        with self._lock:
+            with self._conn:
+                for msg, row in zip(messages, rows):
+                    cur = self._conn.execute(_INSERT, row)
+                    self.reassembler.discard(self._conn, msg)
+                    record = dict(zip(_ROW_FIELDS, row), id=cur.lastrowid)
+                    record["incomplete"] = bool(record["incomplete"])
+                    stored.append(record)
+        for record in stored:
+            for listener in list(self._listeners):
+                try:
+                    listener(record)
+                except Exception as e:
+                    event_logger.log_event("inbox_listener_error", port=port, details=str(e))
+        return stored
+
+    def add_listener(self, callback):
+        """callback(record) вызывается для каждого сохранённого сообщения."""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def tag(self, record_id, tag):
+        """Помечает сообщение (метки видны в get и фильтре tag)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO inbox_tags (tag, message_id) VALUES (?, ?)",
+                (tag, record_id),
+            )
+
+    def delete(self, record_id):
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM inbox WHERE id = ?", (record_id,)).rowcount
+
+    def query_records(self, port=None, phone=None, q=None, since=None, until=None,
+                      before_id=None, limit=100, tag=None):
+        """
+        Страница сообщений от новых к старым и курсор следующей страницы.
+
+        q — полнотекстовый поиск по тексту (см. fts_query); tag — только
+        сообщения с этой меткой; since/until —
+        границы ts в миллисекундах Unix; before_id — id последней записи
+        предыдущей страницы. В записях вместо полного текста — первые
+        PREVIEW_LENGTH символов.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where = []
+        params = []
+        for column, value in (("i.port", port), ("i.phone", phone)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            where.append("i.ts >= ?")
+            params.append(int(since))
+        if until is not None:
+            where.append("i.ts <= ?")
+            params.append(int(until))
+        if tag is not None:
+            where.append("i.id IN (SELECT message_id FROM inbox_tags WHERE tag = ?)")
+            params.append(tag)
+        columns = (
+            f"i.id, i.ts, i.port, i.phone, substr(i.text, 1, {PREVIEW_LENGTH}), i.sent_at, "
+            "i.parts, i.incomplete"
+        )
+        match = fts_query(q) if q else ""
+        if match:
+            # FTS5 перебирает совпадения от больших rowid к меньшим, фильтры
+            # проверяются по ходу, и перебор останавливается на LIMIT
+            key = "inbox_fts.rowid"
+            sql = (
+                f"SELECT {columns} FROM inbox_fts JOIN inbox AS i ON i.id = inbox_fts.rowid"
+            )
+            where.insert(0, "inbox_fts MATCH ?")
+            params.insert(0, match)
+        else:
+            key = "i.id"
+            sql = f"SELECT {columns} FROM inbox AS i"
+        if before_id is not None:
+            where.append(f"{key} < ?")
+            params.append(int(before_id))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {key} DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit + 1]).fetchall()
+        records = [
+            dict(zip(("id", "ts", "port", "phone", "preview", "sent_at", "parts", "incomplete"), r))
+            for r in rows
+        ]
+        for record in records:
+            record["incomplete"] = bool(record["incomplete"])
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = records[-1]["id"]
+        return records, next_cursor
+
+    def get(self, record_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT id, {', '.join(_ROW_FIELDS)} FROM inbox WHERE id = ?",
+                (record_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        record = dict(zip(("id",) + _ROW_FIELDS, row))
+        record["incomplete"] = bool(record["incomplete"])
+        with self._lock:
+            record["tags"] = [r[0] for r in self._conn.execute(
+                "SELECT tag FROM inbox_tags WHERE message_id = ?", (record_id,)
+            )]
+        return record
+
+    # ---------- чтение модемов ----------
+    def read_port(self, port):
+        """Один проход по памяти модема: прочитать, сохранить, удалить."""
+        messages = sharding.call(port, "read_sms", MAX_READ)
+        if not messages:
+            return 0
+        # Части длинных SMS сохраняет сборщик; сюда возвращаются целые сообщения
+        whole = [m for m in (self.reassembler.add(port, msg) for msg in messages) if m]
+        self.store(port, whole)
+        if self.config["delete"]:
+            # Из модема удаляется только то, что уже сохранено в базе
+            sharding.call(port, "delete_sms", [
+                (msg.get("Folder", 0), msg["Location"]) for msg in messages
+            ])
+        return len(messages)
+
+    def _reader_loop(self, port, stop):
+        while not stop.is_set():
+            try:
+                self.read_port(port)
+            except Exception as e:
+                event_logger.log_event("inbox_error", port=port, details=str(e))
+            stop.wait(self.config["interval"])
+
+    def sync_readers(self, ports=None):
+        """Запускает потоки для новых портов и останавливает для исчезнувших."""
+        ports = set(ports if ports is not None else modem_utils.list_modem_ports())
+        for port in list(self._readers):
+            if port not in ports:
+                self._readers.pop(port).set()
+        for port in ports:
+            if port not in self._readers:
+                stop = self._readers[port] = threading.Event()
+                threading.Thread(
+                    target=self._reader_loop, args=(port, stop),
+                    name=f"sms-inbox-{port}", daemon=True,
+                ).start()
+
+    def start(self):
+        self.init_db()
+        if self._thread is not None:
+            return
+        self.reassembler.start()
+
+        def loop():
+            while True:
+                try:
+                    self.sync_readers()
+                except Exception as e:
+                    event_logger.log_event("inbox_error", details=str(e))
+                time.sleep(self.config["sync_interval"])
+
+        self._thread = threading.Thread(target=loop, name="sms-inbox", daemon=True)
+        self._thread.start()
+
+
+_inbox = None
+_inbox_lock = threading.Lock()
+
+
+def start(config=None):
+    """Создаёт хранилище входящих процесса и запускает потоки чтения."""
+    global _inbox
+    with _inbox_lock:
+        if _inbox is None:
+            _inbox = Inbox(config)
+        _inbox.start()
+    return _inbox
+
+
+def get_inbox(config=None):
+    """Хранилище входящих процесса (без запуска чтения модемов)."""
+    global _inbox
+    with _inbox_lock:
+        if _inbox is None:
+            _inbox = Inbox(config)
+        _inbox.init_db()
+    return _inbox
@@ -0,0 +1,393 @@
+# FreeSMS/sms_queue.py
+
+"""
+Очередь исходящих SMS.
+
+Сообщения сохраняются в таблицу outbox базы sms.db и сразу получают
+идентификатор; отправкой занимается отдельный поток на каждый порт,
+поэтому порты разгружают очередь параллельно, и пропускная способность
+растёт с числом модемов. Перед каждой отправкой поток берёт токен из
+корзины своего порта и из общей корзины оператора SIM-карты. Неудачная
+отправка повторяется с экспоненциальной паузой, после max_attempts
+попыток сообщение получает статус failed.
+
+Параметры (раздел "sms_queue" config.json):
+  port_rate       SMS в секунду с одного порта (0.2; 0 — без ограничения)
+  port_burst      сколько SMS порт может отправить подряд без паузы (3)
+  operator_rate   SMS в секунду со всех SIM одного оператора (0 — без ограничения)
+  operator_burst  запас корзины оператора (10)
+  max_attempts    число попыток отправки (5)
+  retry_base      пауза перед второй попыткой, с (30); дальше удваивается
+  retry_max       максимальная пауза между попытками, с (3600)
+"""
+
+import os
+import time
+import uuid
+import random
+import sqlite3
+import threading
+
+from . import event_logger
+from . import sharding
+
+DB_PATH = os.path.join(event_logger.BASE_DIR, "..", "sms.db")
+
+DEFAULTS = {
+    "port_rate": 0.2,
+    "port_burst": 3,
+    "operator_rate": 0,
+    "operator_burst": 10,
+    "max_attempts": 5,
+    "retry_base": 30,
+    "retry_max": 3600,
+}
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+# Сообщения приостановленной рассылки: потоки портов их не берут
+PAUSED = "paused"
+# Сообщения рассылки, загрузка которой оборвалась: не отправляются
+CANCELLED = "cancelled"
+
+# Время хранится в миллисекундах Unix, как ts в events.db
+_schema = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id TEXT PRIMARY KEY,
+    port TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    text TEXT NOT NULL,
+    operator TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at INTEGER NOT NULL,
+    created_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL,
+    campaign_id TEXT,
+    refs TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(port, status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_outbox_campaign ON outbox(campaign_id, status);
+"""
+
+_INSERT = (
+    "INSERT INTO outbox (id, port, phone, text, status, next_attempt_at, "
+    "created_at, updated_at, campaign_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+_COLUMNS = (
+    "id", "port", "phone", "text", "operator", "status", "attempts",
+    "next_attempt_at", "created_at", "updated_at", "campaign_id", "refs", "error",
+)
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+class TokenBucket:
+    """
+    Корзина токенов с резервированием: reserve() всегда забирает токен
+    и возвращает, сколько секунд нужно подождать, если токенов не было.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.capacity = float(max(1, burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class _PortWorker:
+    """Поток, отправляющий сообщения одного порта по очереди."""
+
+    def __init__(self, owner, port):
+        self.owner = owner
+        self.port = port
+        self.wake = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name=f"sms-sender-{port}", daemon=True
+        )
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                row, wait = self.owner._next_due(self.port)
+            except sqlite3.Error:
+                row, wait = None, 5.0
+            if row is None:
+                self.wake.wait(wait)
+                self.wake.clear()
+                continue
+            try:
+                self.owner._deliver(row)
+            except Exception as e:
+                # Поток порта не должен умирать: сообщение уходит на повтор
+                event_logger.log_event("sms_queue_error", port=self.port, details=str(e))
+                try:
+                    self.owner._retry_or_fail(row, str(e) or type(e).__name__)
+                except Exception as e:
+                    event_logger.log_event("sms_queue_error", port=self.port, details=str(e))
+                    self.wake.wait(5.0)
+                    self.wake.clear()
+
+
+class SmsQueue:
+    def __init__(self, config=None, db_path=DB_PATH):
+        self.config = dict(DEFAULTS, **(config or {}))
+        self.db_path = db_path
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self._workers = {}
+        self._port_buckets = {}
+        self._operator_buckets = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+
+    # ---------- база ----------
+    def start(self):
+        """Открывает базу, возвращает в очередь прерванные отправки и запускает потоки."""
+        with self._lock:
+            if self._conn is not None:
+                return
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_schema)
+            # Процесс остановился посреди отправки: повторяем (возможен дубль)
+            conn.execute(
+                "UPDATE outbox SET status = ? WHERE status = ?", (QUEUED, SENDING)
+            )
+            conn.commit()
+            self._conn = conn
+        ports = [
+            r[0] for r in self._query(
+                "SELECT DISTINCT port FROM outbox WHERE status = ?", (QUEUED,)
+            )
+        ]
+        for port in ports:
+            self._worker(port)
+
+    def _query(self, sql, params=()):
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _update(self, sql, params=()):
+        with self._db_lock:
+            cur = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cur.rowcount
+
+    # ---------- постановка в очередь ----------
+    def submit(self, port, phone, text, campaign_id=None):
+        """Ставит сообщение в очередь порта и возвращает его идентификатор."""
+        return self.submit_many([(port, phone, text, campaign_id)])[0]
+
+    def submit_many(self, messages, status=QUEUED):
+        """
+        Ставит в очередь пачку (port, phone, text, campaign_id) одной
+        транзакцией; возвращает идентификаторы в том же порядке.
+        С status=PAUSED сообщения сохраняются, но не отправляются до resume.
+        """
+        now = _now_ms()
+        rows = []
+        ports = set()
+        for port, phone, text, campaign_id in messages:
+            rows.append((uuid.uuid4().hex, port, phone, text, status, now, now, now, campaign_id))
+            ports.add(port)
+        with self._db_lock:
+            self._conn.executemany(_INSERT, rows)
+            self._conn.commit()
+        if status == QUEUED:
+            for port in ports:
+                self._worker(port).wake.set()
+        return [r[0] for r in rows]
+
+    def get(self, message_id):
+        """Состояние сообщения или None."""
+        rows = self._query(
+            f"SELECT {', '.join(_COLUMNS)} FROM outbox WHERE id = ?", (message_id,)
+        )
+        if not rows:
+            return None
+        message = dict(zip(_COLUMNS, rows[0]))
+        message["refs"] = [int(r) for r in message["refs"].split(",")] if message["refs"] else []
+        return message
+
+    def depths(self):
+        """Число неотправленных сообщений по портам: {port: count}."""
+        return dict(self._query(
+            "SELECT port, COUNT(*) FROM outbox WHERE status IN (?, ?) GROUP BY port",
+            (QUEUED, SENDING),
+        ))
+
+    def counts(self, campaign_id):
+        """Число сообщений рассылки по статусам: {status: count}."""
+        return dict(self._query(
+            "SELECT status, COUNT(*) FROM outbox WHERE campaign_id = ? GROUP BY status",
+            (campaign_id,),
+        ))
+
+    def pause_campaign(self, campaign_id):
+        """Снимает с очереди ещё не отправленные сообщения рассылки."""
+        return self._update(
+            "UPDATE outbox SET status = ?, updated_at = ? WHERE campaign_id = ? AND status = ?",
+            (PAUSED, _now_ms(), campaign_id, QUEUED),
+        )
+
+    def cancel_campaign(self, campaign_id):
+        """Отменяет ещё не отправленные сообщения рассылки."""
+        return self._update(
+            "UPDATE outbox SET status = ?, updated_at = ? WHERE campaign_id = ? AND status IN (?, ?)",
+            (CANCELLED, _now_ms(), campaign_id, QUEUED, PAUSED),
+        )
+
+    def resume_campaign(self, campaign_id):
+        """Возвращает в очередь приостановленные сообщения рассылки."""
+        ports = [r[0] for r in self._query(
+            "SELECT DISTINCT port FROM outbox WHERE campaign_id = ? AND status = ?",
+            (campaign_id, PAUSED),
+        )]
+        resumed = self._update(
+            "UPDATE outbox SET status = ?, updated_at = ? WHERE campaign_id = ? AND status = ?",
+            (QUEUED, _now_ms(), campaign_id, PAUSED),
+        )
+        for port in ports:
+            self._worker(port).wake.set()
+        return resumed
+
+    def wake(self, port):
+        """Будит поток порта, например после возврата сообщений в очередь."""
+        self._worker(port).wake.set()
+
+    # ---------- отправка ----------
+    def _worker(self, port):
+        with self._lock:
+            worker = self._workers.get(port)
+            if worker is None:
+                worker = self._workers[port] = _PortWorker(self, port)
+            return worker
+
+    def _bucket(self, buckets, key, rate, burst):
+        with self._lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = TokenBucket(rate, burst)
+            return bucket
+
+    def _next_due(self, port):
+        """Ближайшее сообщение порта, которое пора отправлять, или (None, сколько ждать)."""
+        now = _now_ms()
+        rows = self._query(
+            "SELECT id, phone, text, attempts FROM outbox "
+            "WHERE port = ? AND status = ? AND next_attempt_at <= ? "
+            "ORDER BY next_attempt_at LIMIT 1",
+            (port, QUEUED, now),
+        )
+        if rows:
+            return (port,) + rows[0], None
+        rows = self._query(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE port = ? AND status = ?",
+            (port, QUEUED),
+        )
+        upcoming = rows[0][0]
+        return None, None if upcoming is None else max(0.0, (upcoming - now) / 1000.0)
+
+    def _throttle(self, port, operator):
+        cfg = self.config
+        wait = 0.0
+        if cfg["port_rate"]:
+            wait = self._bucket(
+                self._port_buckets, port, cfg["port_rate"], cfg["port_burst"]
+            ).reserve()
+        if operator and cfg["operator_rate"]:
+            wait = max(wait, self._bucket(
+                self._operator_buckets, operator, cfg["operator_rate"], cfg["operator_burst"]
+            ).reserve())
+        if wait:
+            time.sleep(wait)
+
+    def _retry_delay(self, attempts):
+        cfg = self.config
+        delay = min(cfg["retry_max"], cfg["retry_base"] * (2 ** (attempts - 1)))
+        return self._rng.uniform(delay / 2, delay)
+
+    def _retry_or_fail(self, row, error):
+        """
+        Засчитывает неудачную попытку: сообщение возвращается в очередь с
+        паузой, а после max_attempts попыток получает статус failed.
+        """
+        port, message_id, phone, _, attempts = row
+        attempts += 1
+        now = _now_ms()
+        if attempts >= self.config["max_attempts"]:
+            self._update(
+                "UPDATE outbox SET status = ?, attempts = ?, updated_at = ?, error = ? "
+                "WHERE id = ? AND status IN (?, ?)",
+                (FAILED, attempts, now, error, message_id, QUEUED, SENDING),
+            )
+            event_logger.log_event("sms_failed", port=port, phone=phone, details=error)
+        else:
+            next_at = now + int(self._retry_delay(attempts) * 1000)
+            self._update(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, "
+                "updated_at = ?, error = ? WHERE id = ? AND status IN (?, ?)",
+                (QUEUED, attempts, next_at, now, error, message_id, QUEUED, SENDING),
+            )
+
+    def _deliver(self, row):
+        port, message_id, phone, text, attempts = row
+        operator = sharding.call(port, "cached_operator")
+        self._throttle(port, operator)
+        # Сообщение могли отменить, пока поток ждал токен
+        claimed = self._update(
+            "UPDATE outbox SET status = ?, operator = ?, updated_at = ? "
+            "WHERE id = ? AND status = ?",
+            (SENDING, operator, _now_ms(), message_id, QUEUED),
+        )
+        if not claimed:
+            return
+        try:
+            refs = sharding.call(port, "send_sms", phone, text)
+        except Exception as e:
+            self._retry_or_fail(row, str(e) or type(e).__name__)
+            return
+        attempts += 1
+        self._update(
+            "UPDATE outbox SET status = ?, attempts = ?, updated_at = ?, refs = ?, error = NULL "
+            "WHERE id = ?",
+            (SENT, attempts, _now_ms(), ",".join(str(r) for r in refs), message_id),
+        )
+        event_logger.log_event("sms_sent", port=port, phone=phone, details=message_id)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def start(config=None):
+    """Создаёт и запускает очередь процесса с параметрами config."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = SmsQueue(config)
+        _queue.start()
+    return _queue
+
+
+def get_queue():
+    """Очередь процесса; при первом обращении запускается с настройками по умолчанию."""
+    return _queue if _queue is not None else start()
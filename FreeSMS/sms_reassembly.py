@@ -0,0 +1,232 @@
+# FreeSMS/sms_reassembly.py
+
+"""
+Сборка длинных (составных) входящих SMS из частей.
+
+Части связаны заголовком UDH: ссылка (ID8bit/ID16bit), номер части и
+общее число частей. Части приходят в любом порядке и с любыми паузами,
+поэтому до прихода последней они ждут в памяти под ключом
+(порт, отправитель, ссылка) и в таблице inbox_parts — чтобы их можно
+было удалить из модема и не потерять при перезапуске. Как только набор
+полон, целое сообщение сразу уходит дальше (в inbox и подписчикам).
+
+Если недостающие части не пришли за timeout секунд после последней
+полученной, или незавершённых наборов стало больше max_pending,
+собранное выдаётся с пометкой incomplete. Наборы лежат в OrderedDict
+по времени последней части, так что ближайший к истечению всегда
+первый: поток таймаутов спит ровно до его срока и не перебирает ни
+наборы, ни сохранённые сообщения.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+from . import event_logger
+
+# Сколько секунд ждать недостающие части после последней полученной
+TIMEOUT = 600.0
+# Сколько незавершённых наборов держать одновременно
+MAX_PENDING = 10000
+# Чем заменяется недостающая часть в неполном сообщении
+MISSING_MARK = "[…]"
+
+_schema = """
+CREATE TABLE IF NOT EXISTS inbox_parts (
+    port TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    ref INTEGER NOT NULL,
+    part INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    sent_at INTEGER,
+    smsc TEXT,
+    ts INTEGER NOT NULL,
+    PRIMARY KEY (port, phone, ref, part)
+) WITHOUT ROWID;
+"""
+
+_CONCATENATED = ("ConcatenatedMessages", "ConcatenatedMessages16bit")
+
+
+def concat_info(msg):
+    """(ссылка, номер части, всего частей) для части составного SMS, иначе None."""
+    udh = msg.get("UDH") or {}
+    if udh.get("Type") not in _CONCATENATED:
+        return None
+    total = udh.get("AllParts") or 0
+    part = udh.get("PartNumber") or 0
+    if total < 2 or not 1 <= part <= total:
+        return None
+    # Gammu заполняет неиспользуемый вариант ссылки значением -1
+    ref = udh.get("ID16bit", -1)
+    if ref is None or ref < 0:
+        ref = udh.get("ID8bit", -1)
+    return ref, part, total
+
+
+def sent_at_ms(msg):
+    sent = msg.get("DateTime")
+    return int(sent.timestamp() * 1000) if hasattr(sent, "timestamp") else None
+
+
+class _Pending:
+    __slots__ = ("total", "parts", "deadline")
+
+    def __init__(self, total):
+        self.total = total
+        # номер части -> (text, sent_at, smsc)
+        self.parts = {}
+        self.deadline = 0.0
+
+
+class Reassembler:
+    """
+    Буфер частей. emit(port, [message]) получает собранные по таймауту
+    или вытесненные сообщения; полные сообщения возвращает add().
+    conn и db_lock — соединение с sms.db и блокировка, под которой оно
+    используется (общие с sms_inbox).
+    """
+
+    def __init__(self, conn, db_lock, emit, timeout=TIMEOUT, max_pending=MAX_PENDING):
+        self.conn = conn
+        self.db_lock = db_lock
+        self.emit = emit
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def init_db(self):
+        """Создаёт inbox_parts и поднимает в память части, ждавшие до перезапуска."""
+        with self.db_lock:
+            self.conn.executescript(_schema)
+            rows = self.conn.execute(
+                "SELECT port, phone, ref, part, total, text, sent_at, smsc, ts "
+                "FROM inbox_parts ORDER BY ts"
+            ).fetchall()
+        with self._cond:
+            for port, phone, ref, part, total, text, sent_at, smsc, ts in rows:
+                pending = self._pending.get((port, phone, ref))
+                if pending is None:
+                    pending = self._pending[(port, phone, ref)] = _Pending(total)
+                pending.parts[part] = (text, sent_at, smsc)
+                pending.deadline = ts / 1000.0 + self.timeout
+                self._pending.move_to_end((port, phone, ref))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._expire_loop, name="sms-reassembly", daemon=True
+            )
+            self._thread.start()
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def add(self, port, msg):
+        """
+        Принимает SMS, прочитанное из модема. Обычное сообщение и последнюю
+        часть набора возвращает целым сообщением, остальные части — None.
+        """
+        info = concat_info(msg)
+        if info is None:
+            return msg
+        ref, number, total = info
+        phone = msg.get("Number") or ""
+        key = (port, phone, ref)
+        part = (msg.get("Text") or "", sent_at_ms(msg), (msg.get("SMSC") or {}).get("Number"))
+        evicted = []
+        replaced = None
+        with self._cond:
+            pending = self._pending.get(key)
+            if pending is None or pending.total != total:
+                if pending is not None:
+                    # Та же ссылка с другим числом частей — начался новый набор;
+                    # части старого удаляются из базы здесь же
+                    replaced = self._pending.pop(key)
+                pending = self._pending[key] = _Pending(total)
+            if number in pending.parts:
+                return None
+            pending.parts[number] = part
+            if len(pending.parts) == total:
+                del self._pending[key]
+                complete = self._merge(key, pending, incomplete=False)
+            else:
+                complete = None
+                now = time.time()
+                pending.deadline = now + self.timeout
+                self._pending.move_to_end(key)
+                with self.db_lock, self.conn:
+                    if replaced is not None:
+                        self.conn.execute(
+                            "DELETE FROM inbox_parts WHERE port = ? AND phone = ? AND ref = ?",
+                            key,
+                        )
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO inbox_parts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (port, phone, ref, number, total, part[0], part[1], part[2],
+                         int(now * 1000)),
+                    )
+                while len(self._pending) > self.max_pending:
+                    evicted.append(self._pending.popitem(last=False))
+                self._cond.notify()
+        if replaced is not None:
+            message = self._merge(key, replaced, incomplete=True)
+            del message["_parts_key"]
+            self.emit(port, [message])
+        self._emit_incomplete(evicted)
+        return complete
+
+    def discard(self, conn, msg):
+        """Удаляет сохранённые части собранного сообщения (в транзакции вызывающего)."""
+        key = msg.get("_parts_key")
+        if key:
+            conn.execute(
+                "DELETE FROM inbox_parts WHERE port = ? AND phone = ? AND ref = ?", key
+            )
+
+    @staticmethod
+    def _merge(key, pending, incomplete):
+        texts = [
+            pending.parts[n][0] if n in pending.parts else MISSING_MARK
+            for n in range(1, pending.total + 1)
+        ]
+        first = pending.parts[min(pending.parts)]
+        return {
+            "Number": key[1] or None,
+            "Text": "".join(texts),
+            "SentAt": first[1],
+            "SMSC": {"Number": first[2]},
+            "Parts": pending.total,
+            "Incomplete": incomplete,
+            "_parts_key": key,
+        }
+
+    def _emit_incomplete(self, items):
+        for key, pending in items:
+            self.emit(key[0], [self._merge(key, pending, incomplete=True)])
+
+    def _expire_loop(self):
+        while True:
+            with self._cond:
+                expired = []
+                now = time.time()
+                while self._pending:
+                    key, pending = next(iter(self._pending.items()))
+                    if pending.deadline > now:
+                        break
+                    expired.append(self._pending.popitem(last=False))
+                if not expired:
+                    wait = None
+                    if self._pending:
+                        wait = next(iter(self._pending.values())).deadline - now
+                    self._cond.wait(wait)
+                    continue
+            try:
+                self._emit_incomplete(expired)
+            except Exception as e:
+                # Части остались в inbox_parts и будут выданы после перезапуска
+                event_logger.log_event("inbox_error", details=str(e))
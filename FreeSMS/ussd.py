@@ -0,0 +1,264 @@
+# FreeSMS/ussd.py
+
+"""
+USSD-запросы (баланс, номер, меню оператора) сразу на многих портах.
+
+run() набирает код на всех выбранных портах одновременно: запрос к порту —
+операция send_ussd в очереди этого порта (scheduler, приоритет
+INTERACTIVE), поэтому порты работают параллельно, а на одном порту
+USSD не пересекается с опросом и отправкой SMS. Результаты отдаются по
+мере готовности. Многошаговое меню проходится ответами replies — пунктами
+меню по порядку.
+
+Ответ сети ждётся не дольше step_timeout секунд на шаг, а весь запрос по
+всем портам — не дольше request_timeout. Порты, которые не успели,
+получают статус Timeout, и их ещё не начатые операции снимаются с очереди.
+
+Ответы кэшируются на cache_ttl секунд по ICCID SIM-карты, коду и ответам
+меню: повторное обновление страницы не набирает код заново, а после
+замены SIM старый ответ порта не отдаётся. ICCID порта берётся из
+опроса модема, а для портов, которые ещё не опрашивались, — из прошлого
+USSD-ответа. Одинаковый запрос к порту,
+пока первый ещё выполняется, получает его результат; операция порта
+снимается с очереди, только когда её перестали ждать все такие запросы.
+Ошибки и таймауты не кэшируются.
+
+Параметры (раздел "ussd" config.json):
+  cache_ttl        сколько секунд хранить ответ (300; 0 — не кэшировать)
+  step_timeout     ожидание ответа сети на шаг меню, с (20)
+  request_timeout  ожидание всех портов одного запроса, с (120)
+  max_replies      наибольшее число ответов меню (5)
+"""
+
+import re
+import time
+import functools
+import threading
+import concurrent.futures
+
+from . import event_logger
+from . import sharding
+from .campaigns import normalize_phone
+from .modem_utils import list_modem_ports
+from .scheduler import INTERACTIVE
+
+DEFAULTS = {
+    "cache_ttl": 300,
+    "step_timeout": 20,
+    "request_timeout": 120,
+    "max_replies": 5,
+}
+
+# Допустимый USSD-код или ответ меню
+_CODE_RE = re.compile(r"^[0-9*#+]{1,40}$")
+# Статусы, которые не кэшируются
+_UNCACHED = ("Timeout", "Error")
+# С какого размера кэша при записи выбрасываются устаревшие ответы
+CACHE_PRUNE_SIZE = 4096
+
+
+class UssdError(ValueError):
+    """Недопустимый USSD-код или ответы меню."""
+
+
+class UssdEngine:
+    def __init__(self, config=None):
+        self.config = dict(DEFAULTS, **(config or {}))
+        self._lock = threading.Lock()
+        # (iccid, code, replies) -> (monotonic-время истечения, результат)
+        self._cache = {}
+        # (port, code, replies) -> [Future результата, Future операции порта,
+        #                          число ожидающих]
+        self._inflight = {}
+        # port -> ICCID из последнего USSD-ответа
+        self._port_iccid = {}
+
+    def validate(self, code, replies=()):
+        """Проверяет код и ответы меню; возвращает (code, tuple(replies)) или бросает UssdError."""
+        code = str(code or "").strip()
+        if isinstance(replies, str):
+            replies = [replies]
+        replies = tuple(str(r).strip() for r in replies or ())
+        if not _CODE_RE.match(code):
+            raise UssdError(f"invalid USSD code {code!r}")
+        if len(replies) > self.config["max_replies"]:
+            raise UssdError(f"too many menu replies (max {self.config['max_replies']})")
+        for reply in replies:
+            if not _CODE_RE.match(reply):
+                raise UssdError(f"invalid menu reply {reply!r}")
+        return code, replies
+
+    # ---------- кэш ----------
+    def cached(self, iccid, code, replies=()):
+        """Сохранённый ответ для SIM iccid или None; в нём cached=True и age, с."""
+        key = (iccid, code, tuple(replies))
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expires, result = entry
+            if time.monotonic() >= expires:
+                del self._cache[key]
+                return None
+        return dict(result, cached=True, age=round(time.time() - result["time"]))
+
+    def _store(self, result, code, replies):
+        ttl = self.config["cache_ttl"]
+        if ttl <= 0 or not result.get("iccid") or result["status"] in _UNCACHED:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._port_iccid[result["port"]] = result["iccid"]
+            if len(self._cache) >= CACHE_PRUNE_SIZE:
+                for key in [k for k, (expires, _) in self._cache.items() if expires <= now]:
+                    del self._cache[key]
+            self._cache[(result["iccid"], code, replies)] = (now + ttl, result)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+            self._port_iccid.clear()
+
+    # ---------- запросы ----------
+    def submit(self, port, code, replies=(), force=False):
+        """
+        Запрос на одном порту; возвращает concurrent.futures.Future с
+        результатом (см. modem_utils.send_ussd, плюс code, replies, time и
+        cached). Исключений Future не содержит: ошибка — статус Error и
+        текст в error. force — набрать код, даже если ответ есть в кэше.
+        """
+        replies = tuple(replies)
+        if not force and self.config["cache_ttl"] > 0:
+            iccid = sharding.call(port, "cached_iccid") or self._port_iccid.get(port)
+            hit = self.cached(iccid, code, replies) if iccid else None
+            if hit is not None:
+                future = concurrent.futures.Future()
+                future.set_result(hit)
+                return future
+        key = (port, code, replies)
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is not None:
+                entry[2] += 1
+                return entry[0]
+            future = concurrent.futures.Future()
+            try:
+                job = sharding.submit(
+                    port, "send_ussd", code, replies, self.config["step_timeout"],
+                    priority=INTERACTIVE,
+                )
+            except Exception as e:
+                job = concurrent.futures.Future()
+                job.set_exception(e)
+            self._inflight[key] = [future, job, 1]
+        # Вне блокировки: уже готовая операция вызывает _finish сразу
+        job.add_done_callback(functools.partial(self._finish, key, future))
+        return future
+
+    def _finish(self, key, future, job):
+        port, code, replies = key
+        with self._lock:
+            self._inflight.pop(key, None)
+        if job.cancelled():
+            result = _failure(port, "Timeout", "request timed out")
+        else:
+            try:
+                result = dict(job.result())
+            except Exception as e:
+                result = _failure(port, "Error", str(e))
+        result.update(code=code, replies=list(replies), time=time.time(), cached=False)
+        self._store(result, code, replies)
+        event_logger.log_event(
+            "ussd", port=port,
+            details=f"{code} {result['status']}: {result.get('response') or result.get('error') or ''}",
+        )
+        future.set_result(result)
+
+    def run(self, ports, code, replies=(), force=False, timeout=None):
+        """
+        Запрос на всех ports одновременно; генератор результатов в порядке
+        готовности. Порты, не ответившие за timeout (request_timeout)
+        секунд, отдаются последними со статусом Timeout.
+        """
+        replies = tuple(replies)
+        if timeout is None:
+            timeout = self.config["request_timeout"]
+        futures = {self.submit(p, code, replies, force): p for p in dict.fromkeys(ports)}
+        waiting = dict(futures)
+        try:
+            for future in concurrent.futures.as_completed(futures, timeout):
+                del waiting[future]
+                yield future.result()
+        except concurrent.futures.TimeoutError:
+            timed_out, waiting = waiting, {}
+            for future, port in timed_out.items():
+                self.cancel(port, code, replies, future)
+            for port in timed_out.values():
+                yield timeout_result(port, code, replies)
+        finally:
+            # Генератор закрыт раньше времени: клиент ушёл, не дождавшись
+            for future, port in waiting.items():
+                self.cancel(port, code, replies, future)
+
+    def cancel(self, port, code, replies=(), future=None):
+        """
+        Один ожидающий отказывается от запроса. Операция порта снимается с
+        очереди (в том числе в процессе-обработчике), когда от неё отказались
+        все, кто её ждал, и если она ещё не началась; тогда возвращается True.
+        future — Future из submit(), от которого отказываются; по умолчанию —
+        текущий запрос с этими параметрами.
+        """
+        with self._lock:
+            entry = self._inflight.get((port, code, tuple(replies)))
+            if entry is None or (future is not None and entry[0] is not future):
+                return False
+            entry[2] -= 1
+            if entry[2] > 0:
+                return False
+        return entry[1].cancel()
+
+    def status(self):
+        with self._lock:
+            return {"cached": len(self._cache), "running": len(self._inflight)}
+
+
+def _failure(port, status, error):
+    return {"port": port, "iccid": None, "status": status, "response": None,
+            "steps": [], "error": error}
+
+
+def timeout_result(port, code, replies=()):
+    """Результат для порта, не ответившего за request_timeout."""
+    result = _failure(port, "Timeout", "request timed out")
+    result.update(code=code, replies=list(replies), time=time.time(), cached=False)
+    return result
+
+
+def find_port(number, ports=None):
+    """Порт, на котором стоит SIM с номером number (по последнему опросу), или None."""
+    phone = normalize_phone(number)
+    if phone is None:
+        return None
+    for port in ports or list_modem_ports():
+        info = sharding.call(port, "routing_info")
+        if info and info["phone"] and normalize_phone(info["phone"]) == phone:
+            return port
+    return None
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def start(config=None):
+    """Создаёт USSD-движок процесса с параметрами config."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = UssdEngine(config)
+    return _engine
+
+
+def get_engine():
+    """USSD-движок процесса; при первом обращении создаётся с настройками по умолчанию."""
+    return _engine if _engine is not None else start()
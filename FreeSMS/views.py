@@ -1,31 +1,38 @@
 # FreeSMS/views.py
 
 import json
-import time
 import os
 import concurrent.futures
-import asyncio
+from datetime import datetime
 from flask import (
     render_template, request, jsonify, make_response, current_app
 )
-from deepdiff import DeepDiff
 from . import app
 from . import event_logger
-from .modem_utils import (
-    list_modem_ports,
-    get_modem_info,
-    get_modem_info_async,
-)
-from .i18n import t, get_language, set_language
+from . import event_retention
+from . import monitor
+from . import campaigns
+from . import sms_queue
+from . import sms_inbox
+from . import forwarding
+from . import sharding
+from . import scheduler
+from . import ussd
+from .rules import get_engine as get_rule_engine, RuleError
+from .modem_utils import list_modem_ports, lookup_many
+from .i18n import t, available_languages, resolve_language
 
 # Maximum number of worker threads for concurrent modem operations
 MAX_WORKERS = 10
+# Largest identifier list accepted by /api/lookup_operators in one request
+LOOKUP_MAX_ITEMS = 100000
+# Seconds of silence after which /api/monitor sends an SSE keepalive comment
+MONITOR_KEEPALIVE = 15.0
 
 
 def render_page(template: str, **context):
     """Render template with common translation context."""
-    lang = request.cookies.get("lang", get_language())
-    set_language(lang)
+    lang = resolve_language(request.cookies.get("lang"))
     base_ctx = {
         "buttons": current_app.config["TRANSLATIONS"]["buttons"],
         "tabs": current_app.config["TRANSLATIONS"]["tabs"],
@@ -37,16 +44,15 @@ def render_page(template: str, **context):
     base_ctx.update(context)
     return render_template(template, **base_ctx)
 
-# Заглушки для правил и USSD-конфига
-RULES = []
-USSD_CONFIG = {}
+def _port_call(port, name, *args, **kwargs):
+    """Run ``modem_utils.<name>(port, ...)`` in the process that owns the port."""
+    return sharding.call(port, name, *args, **kwargs)
 
 # ---------- Основная страница ----------
 @app.route("/", methods=["GET"])
 def index():
     """Display the modem overview page."""
-    lang = request.cookies.get("lang", get_language())
-    set_language(lang)
+    lang = resolve_language(request.cookies.get("lang"))
 
     ports = list_modem_ports()
     translations = current_app.config["TRANSLATIONS"]["table_headers"]
@@ -81,7 +87,7 @@ def sent():
 @app.route("/rules", methods=["GET"])
 def rules():
     """Display rules configuration."""
-    return render_page("rules.html", rules_list=RULES)
+    return render_page("rules.html", rules_list=get_rule_engine().list())
 
 @app.route("/no_rules", methods=["GET"])
 def no_rules():
@@ -91,7 +97,10 @@ def no_rules():
 @app.route("/forward", methods=["GET"])
 def forward():
     """Display SIM forwarding configuration."""
-    return render_page("forward.html")
+    forwarder = forwarding.get_forwarder()
+    return render_page(
+        "forward.html", destinations=forwarder.destinations(), status=forwarder.status()
+    )
 
 @app.route("/settings", methods=["GET"])
 def settings():
@@ -101,11 +110,13 @@ def settings():
 # ---------- Смена языка ----------
 @app.route("/set_language", methods=["POST"])
 def set_lang():
-    """Persist selected language in the config and cookie."""
+    """Remember the selected language in this client's cookie.
+
+    The server-wide default (``language`` in config.json) is left alone.
+    """
     data = request.get_json(force=True) or {}
     lang = data.get("lang")
-    if lang:
-        set_language(lang)
+    if lang and lang in available_languages():
         resp = make_response(jsonify(success=True))
         resp.set_cookie("lang", lang, max_age=30*24*3600)
         return resp
@@ -122,7 +133,10 @@ def api_modem_info():
     port = data.get("port")
     if not port:
         return jsonify(error="no port"), 400
-    info = get_modem_info(port, get_language())
+    info = _port_call(
+        port, "get_modem_info", resolve_language(request.cookies.get("lang")), True,
+        priority=scheduler.INTERACTIVE,
+    )
     return jsonify(info)
 
 @app.route("/api/connect", methods=["GET", "POST"])
@@ -147,7 +161,7 @@ def api_connect():
         if not ports:
             ports = list_modem_ports()
 
-        lang = request.cookies.get("lang", get_language())
+        lang = resolve_language(request.cookies.get("lang"))
 
         def generate():
             try:
@@ -155,7 +169,7 @@ def api_connect():
                     max_workers=min(len(ports), MAX_WORKERS)
                 ) as executor:
                     future_map = {
-                        executor.submit(get_modem_info, p, lang): p for p in ports
+                        executor.submit(_port_call, p, "get_modem_info", lang, True): p for p in ports
                     }
                     for future in concurrent.futures.as_completed(future_map):
                         p = future_map[future]
@@ -178,7 +192,7 @@ def api_connect():
     # POST behaviour - return aggregated JSON for all ports
     data = request.get_json(force=True) or {}
     ports = data.get("ports") or list_modem_ports()
-    lang = request.cookies.get("lang", get_language())
+    lang = resolve_language(request.cookies.get("lang"))
 
     # Check if the client expects streaming responses
     if request.headers.get("Accept") == "text/event-stream":
@@ -188,7 +202,7 @@ def api_connect():
                     max_workers=min(len(ports), MAX_WORKERS)
                 ) as executor:
                     future_map = {
-                        executor.submit(get_modem_info, p, lang): p for p in ports
+                        executor.submit(_port_call, p, "get_modem_info", lang, True): p for p in ports
                     }
                     for future in concurrent.futures.as_completed(future_map):
                         p = future_map[future]
@@ -214,7 +228,7 @@ def api_connect():
         max_workers=min(len(ports), MAX_WORKERS)
     ) as executor:
         future_map = {
-            executor.submit(get_modem_info, p, lang): p for p in ports
+            executor.submit(_port_call, p, "get_modem_info", lang, True): p for p in ports
         }
         for future in concurrent.futures.as_completed(future_map):
             p = future_map[future]
@@ -231,9 +245,110 @@ def api_disconnect():
     data = request.get_json(force=True) or {}
     sel = data.get("ports") or list_modem_ports()
     for p in sel:
+        _port_call(p, "release_port")
         event_logger.log_event("port_disconnected", port=p)
     return jsonify(success=True, ports=sel)
 
+def _parse_time_arg(value):
+    """Convert ``since``/``until`` query values to Unix milliseconds.
+
+    Accepts Unix seconds (``1718000000`` or ``1718000000.5``) or an ISO
+    8601 date/time in server local time (``2024-06-10T12:00:00``).
+    """
+    if not value:
+        return None
+    try:
+        return int(float(value) * 1000)
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+@app.route("/api/events", methods=["GET"])
+def api_events():
+    """Return logged events, newest first, one page at a time.
+
+    Filters: ``port``, ``event_type``, ``phone``, ``since``, ``until``.
+    Pass the returned ``next_cursor`` as ``before_id`` to get the next page.
+    """
+    args = request.args
+    try:
+        since = _parse_time_arg(args.get("since"))
+        until = _parse_time_arg(args.get("until"))
+        before_id = args.get("before_id", type=int)
+        limit = args.get("limit", 100, type=int)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    events, next_cursor = event_logger.query_events(
+        port=args.get("port"),
+        event_type=args.get("event_type"),
+        phone=args.get("phone"),
+        since=since,
+        until=until,
+        before_id=before_id,
+        limit=limit,
+    )
+    return jsonify(events=events, next_cursor=next_cursor)
+
+@app.route("/api/events/rollups", methods=["GET"])
+def api_event_rollups():
+    """Return hourly event counters kept after raw events expire."""
+    args = request.args
+    try:
+        since = _parse_time_arg(args.get("since"))
+        until = _parse_time_arg(args.get("until"))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    rollups = event_retention.query_rollups(
+        port=args.get("port"),
+        event_type=args.get("event_type"),
+        since=since,
+        until=until,
+    )
+    return jsonify(rollups=rollups)
+
+@app.route("/api/port_health", methods=["GET"])
+def api_port_health():
+    """Return backoff state of ports that have failed at least once.
+
+    Suspect ports are not probed until ``retry_in`` seconds pass; until
+    then ``/api/connect`` and the monitor report their last known info
+    with ``stale: true``.
+    """
+    ports = sharding.port_health()
+    port = request.args.get("port")
+    if port:
+        ports = {port: ports[port]} if port in ports else {}
+    return jsonify(ports=ports)
+
+@app.route("/api/shards", methods=["GET"])
+def api_shards():
+    """Return worker processes and the ports each one owns.
+
+    Empty when ports are served by this process (``sharding.workers`` is 0).
+    """
+    manager = sharding.get_manager()
+    return jsonify(shards=manager.assignments() if manager else [])
+
+@app.route("/api/scheduler", methods=["GET"])
+def api_scheduler():
+    """Return per-port command queues: waiting jobs by priority and the running one.
+
+    Ports whose queue has been idle for a while are not listed.
+    """
+    return jsonify(ports=sharding.scheduler_stats())
+
+@app.route("/api/lookup_operators", methods=["POST"])
+def api_lookup_operators():
+    """Resolve operator and country for a JSON array of IMSI/ICCID strings."""
+    data = request.get_json(force=True)
+    if isinstance(data, dict):
+        data = data.get("identifiers")
+    if not isinstance(data, list) or not all(isinstance(c, str) for c in data):
+        return jsonify(error="expected a JSON array of strings"), 400
+    if len(data) > LOOKUP_MAX_ITEMS:
+        return jsonify(error=f"at most {LOOKUP_MAX_ITEMS} identifiers"), 413
+    return jsonify(results=lookup_many(data))
+
 @app.route("/api/port_find", methods=["POST"])
 def api_port_find():
     return jsonify(success=True)
@@ -242,30 +357,285 @@ def api_port_find():
 def api_port_sort():
     return jsonify(success=True)
 
-@app.route("/api/ussd", methods=["POST"])
+def _ussd_params(data):
+    """Return ``(code, replies, force)`` from a JSON body or query string."""
+    if hasattr(data, "getlist"):
+        code, replies = data.get("code"), data.getlist("replies")
+        force = data.get("force", "") in ("1", "true", "yes")
+    else:
+        code, replies = data.get("code"), data.get("replies") or []
+        force = bool(data.get("force"))
+    code, replies = ussd.get_engine().validate(code, replies)
+    return code, replies, force
+
+def _ussd_stream(ports, code, replies, force):
+    engine = ussd.get_engine()
+
+    def generate():
+        try:
+            for result in engine.run(ports, code, replies, force):
+                yield f"data: {json.dumps(result)}\n\n"
+        except GeneratorExit:
+            # Начатые запросы доработают и попадут в кэш; неначатые run()
+            # снимает с очереди, если их больше никто не ждёт
+            return
+        except Exception as e:
+            event_logger.log_event("sse_error", details=str(e))
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
+    return current_app.response_class(generate(), mimetype="text/event-stream")
+
+@app.route("/api/ussd", methods=["GET", "POST"])
 def api_ussd():
-    return jsonify(success=True)
+    """Dial a USSD code on several ports at once.
+
+    Takes ``ports`` (every detected port when empty), ``code`` such as
+    ``*100#``, optional ``replies`` - menu choices sent in order while the
+    network keeps a menu open - and ``force`` to dial even when a cached
+    answer for the SIM is still fresh.
+
+    POST  - returns ``{"results": {port: result}}`` once every port has
+            answered or timed out; streams like GET with
+            ``Accept: text/event-stream``
+    GET   - streams one result per port via Server-Sent Events as ports
+            finish (``?ports=sim0,sim1&code=*111%23&replies=1``)
+    """
+    if request.method == "GET":
+        data = request.args
+        ports = [p.strip() for item in data.getlist("ports") for p in item.split(",") if p.strip()]
+    else:
+        data = request.get_json(force=True) or {}
+        ports = data.get("ports") or []
+    try:
+        code, replies, force = _ussd_params(data)
+    except ussd.UssdError as e:
+        return jsonify(error=str(e)), 400
+    ports = ports or list_modem_ports()
+
+    if request.method == "GET" or request.headers.get("Accept") == "text/event-stream":
+        return _ussd_stream(ports, code, replies, force)
+    results = {r["port"]: r for r in ussd.get_engine().run(ports, code, replies, force)}
+    return jsonify(success=True, code=code, results=results)
 
 @app.route("/api/sms_records", methods=["GET"])
 def api_sms_records():
-    return jsonify(records=[])
+    """Return received SMS, newest first, one page at a time.
+
+    Filters: ``port``, ``phone``, ``tag``, ``since``, ``until`` and ``q`` (full-text
+    search; every word must match, ``word*`` matches a prefix). Records
+    carry a text preview; pass ``next_cursor`` as ``before_id`` to page.
+    """
+    args = request.args
+    try:
+        since = _parse_time_arg(args.get("since"))
+        until = _parse_time_arg(args.get("until"))
+        before_id = args.get("before_id", type=int)
+        limit = args.get("limit", 100, type=int)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    records, next_cursor = sms_inbox.get_inbox().query_records(
+        port=args.get("port"),
+        phone=args.get("phone"),
+        q=args.get("q"),
+        since=since,
+        until=until,
+        before_id=before_id,
+        limit=limit,
+        tag=args.get("tag"),
+    )
+    return jsonify(records=records, next_cursor=next_cursor)
+
+@app.route("/api/rules", methods=["GET"])
+def api_rules():
+    return jsonify(rules=get_rule_engine().list())
+
+@app.route("/api/rules", methods=["POST"])
+def api_rule_create():
+    """Add a rule; it applies to every SMS received from now on."""
+    try:
+        rule = get_rule_engine().add(request.get_json(force=True) or {})
+    except RuleError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(rule), 201
+
+@app.route("/api/rules/<rule_id>", methods=["PUT", "PATCH"])
+def api_rule_update(rule_id):
+    try:
+        rule = get_rule_engine().update(rule_id, request.get_json(force=True) or {})
+    except RuleError as e:
+        return jsonify(error=str(e)), 400
+    if rule is None:
+        return jsonify(error="unknown rule"), 404
+    return jsonify(rule)
+
+@app.route("/api/rules/<rule_id>", methods=["DELETE"])
+def api_rule_delete(rule_id):
+    if not get_rule_engine().delete(rule_id):
+        return jsonify(error="unknown rule"), 404
+    return jsonify(success=True)
+
+@app.route("/api/rules/test", methods=["POST"])
+def api_rule_test():
+    """Show which rules would fire for a sample message, without acting."""
+    data = request.get_json(force=True) or {}
+    matched = get_rule_engine().match(
+        {"phone": data.get("phone"), "port": data.get("port"), "text": data.get("text", "")},
+        data.get("operator"),
+    )
+    return jsonify(matches=[
+        {"id": rule["id"], "action": rule["action"], "extract": value}
+        for rule, value in matched
+    ])
+
+@app.route("/api/forward", methods=["GET"])
+def api_forward():
+    """Return configured forwarding destinations and their delivery state.
+
+    ``status`` holds per-destination counters (``sent``, ``retried``,
+    ``failed``, ``in_memory``, ``last_error``) and ``stored``, the number
+    of jobs in the persistent retry queue by status.
+    """
+    forwarder = forwarding.get_forwarder()
+    return jsonify(destinations=forwarder.destinations(), status=forwarder.status())
+
+@app.route("/api/forward/failed", methods=["GET"])
+def api_forward_failed():
+    """Return forwarding jobs that ran out of attempts, newest first."""
+    limit = min(max(request.args.get("limit", 100, type=int), 1), sms_inbox.MAX_PAGE_SIZE)
+    return jsonify(jobs=forwarding.get_forwarder().failed(request.args.get("destination"), limit))
+
+@app.route("/api/forward/retry", methods=["POST"])
+def api_forward_retry():
+    """Requeue failed forwarding jobs, optionally for one ``destination``."""
+    data = request.get_json(silent=True) or {}
+    count = forwarding.get_forwarder().retry_failed(data.get("destination"))
+    return jsonify(success=True, requeued=count)
+
+@app.route("/api/forward/test", methods=["POST"])
+def api_forward_test():
+    """Queue a sample message for ``destination`` to check its settings."""
+    data = request.get_json(force=True) or {}
+    destination = data.get("destination")
+    if not destination:
+        return jsonify(error="destination is required"), 400
+    payload = {
+        "id": None,
+        "ts": int(datetime.now().timestamp() * 1000),
+        "port": data.get("port"),
+        "phone": data.get("phone", "test"),
+        "text": data.get("text", "FreeSMS forwarding test"),
+        "rule": None,
+        "extract": None,
+    }
+    try:
+        forwarding.get_forwarder().submit(destination, payload)
+    except forwarding.ForwardError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(success=True)
 
 @app.route("/api/sms_content", methods=["GET"])
 def api_sms_content():
-    return jsonify(content={})
+    """Return the full text and metadata of one received SMS."""
+    record_id = request.args.get("id", type=int)
+    if record_id is None:
+        return jsonify(error="id is required"), 400
+    content = sms_inbox.get_inbox().get(record_id)
+    if content is None:
+        return jsonify(error="unknown message id"), 404
+    return jsonify(content=content)
 
 @app.route("/api/send_sms", methods=["POST"])
 def api_send_sms():
+    """Queue an SMS for sending from ``port`` and return its ``message_id``.
+
+    The request returns as soon as the message is stored; poll
+    ``/api/sms_status?id=<message_id>`` for the delivery state.
+    """
     data = request.get_json(force=True) or {}
     port = data.get("port")
     phone = data.get("phone")
     text = data.get("text", "")
+    if not port or not phone or not isinstance(text, str):
+        return jsonify(success=False, error="port, phone and text are required"), 400
+    message_id = sms_queue.get_queue().submit(port, phone, text)
     event_logger.log_event("sms_outgoing", port=port, phone=phone, details=text)
-    return jsonify(success=True)
+    return jsonify(success=True, message_id=message_id, status=sms_queue.QUEUED)
+
+@app.route("/api/campaigns", methods=["POST"])
+def api_campaign_create():
+    """Create a bulk SMS campaign from a streamed CSV or JSONL recipient list.
+
+    Send the list as the ``file`` field of a multipart form or as the raw
+    request body. ``text``, ``name``, ``format`` (``csv``/``jsonl``) and
+    ``ports`` (comma separated) come from form fields or query arguments.
+    CSV rows are ``phone[,text]`` with an optional header; JSONL lines
+    are ``{"phone": ..., "text": ...}``.
+    """
+    upload = request.files.get("file")
+    params = request.form if upload else request.args
+    fmt = params.get("format")
+    if not fmt:
+        filename = upload.filename if upload else ""
+        is_jsonl = filename.endswith((".jsonl", ".ndjson")) or "json" in (request.mimetype or "")
+        fmt = "jsonl" if is_jsonl else "csv"
+    if fmt not in ("csv", "jsonl"):
+        return jsonify(error="format must be csv or jsonl"), 400
+    ports = [p for p in (params.get("ports") or "").split(",") if p] or None
+    recipients = campaigns.iter_recipients(upload.stream if upload else request.stream, fmt)
+    try:
+        campaign = campaigns.get_manager().create(
+            recipients, params.get("text", ""), name=params.get("name"), ports=ports
+        )
+    except campaigns.CampaignIngestError as e:
+        # The campaign exists by now: it is marked failed and its queued rows cancelled
+        event_logger.log_event("campaign_failed", details=f"{e.campaign_id}: {e}")
+        return jsonify(error=str(e), campaign_id=e.campaign_id), 400
+    except campaigns.CampaignError as e:
+        return jsonify(error=str(e)), 409
+    event_logger.log_event("campaign_created", details=campaign["id"])
+    return jsonify(campaign)
+
+@app.route("/api/campaigns", methods=["GET"])
+def api_campaign_list():
+    return jsonify(campaigns=campaigns.get_manager().list())
+
+@app.route("/api/campaigns/<campaign_id>", methods=["GET"])
+def api_campaign_get(campaign_id):
+    """Return a campaign with per-status message counters."""
+    campaign = campaigns.get_manager().get(campaign_id)
+    if campaign is None:
+        return jsonify(error="unknown campaign"), 404
+    return jsonify(campaign)
+
+@app.route("/api/campaigns/<campaign_id>/<action>", methods=["POST"])
+def api_campaign_action(campaign_id, action):
+    """Pause or resume a campaign; paused messages stay in the outbox."""
+    manager = campaigns.get_manager()
+    if action not in ("pause", "resume"):
+        return jsonify(error="unknown action"), 404
+    if manager.get(campaign_id) is None:
+        return jsonify(error="unknown campaign"), 404
+    try:
+        campaign = manager.pause(campaign_id) if action == "pause" else manager.resume(campaign_id)
+    except campaigns.CampaignError as e:
+        return jsonify(error=str(e)), 409
+    event_logger.log_event(f"campaign_{action}d", details=campaign_id)
+    return jsonify(campaign)
 
 @app.route("/api/sms_status", methods=["GET"])
 def api_sms_status():
-    return jsonify(status="sent")
+    """Return the queue state of one outgoing message.
+
+    ``status`` is ``queued``, ``sending``, ``sent`` or ``failed``;
+    ``attempts`` and ``error`` describe retries so far.
+    """
+    message_id = request.args.get("id")
+    if not message_id:
+        return jsonify(error="id is required"), 400
+    message = sms_queue.get_queue().get(message_id)
+    if message is None:
+        return jsonify(error="unknown message id"), 404
+    return jsonify(message)
 
 @app.route("/api/dial_number", methods=["POST"])
 def api_dial_number():
@@ -277,11 +647,36 @@ def api_dial_port():
 
 @app.route("/api/ussd_number", methods=["POST"])
 def api_ussd_number():
-    return jsonify(success=True)
+    """Dial a USSD code on the port whose SIM has the given own number.
+
+    Body: ``{"number": "+7...", "code": "*100#", "replies": [], "force": false}``.
+    The number is matched against the last poll of each port.
+    """
+    data = request.get_json(force=True) or {}
+    try:
+        code, replies, force = _ussd_params(data)
+    except ussd.UssdError as e:
+        return jsonify(error=str(e)), 400
+    port = ussd.find_port(data.get("number"))
+    if port is None:
+        return jsonify(error="number not found"), 404
+    return jsonify(next(ussd.get_engine().run([port], code, replies, force)))
 
 @app.route("/api/ussd_port", methods=["POST"])
 def api_ussd_port():
-    return jsonify(success=True)
+    """Dial a USSD code on one port and return its result.
+
+    Body: ``{"port": "sim0", "code": "*111#", "replies": ["1"], "force": false}``.
+    """
+    data = request.get_json(force=True) or {}
+    port = data.get("port")
+    if not port:
+        return jsonify(error="no port"), 400
+    try:
+        code, replies, force = _ussd_params(data)
+    except ussd.UssdError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(next(ussd.get_engine().run([port], code, replies, force)))
 
 @app.route("/api/at_number", methods=["POST"])
 def api_at_number():
@@ -341,92 +736,27 @@ def api_set_port_state():
 
 @app.route("/api/monitor", methods=["GET"])
 def api_monitor():
-    """Stream modem state changes via Server-Sent Events."""
+    """Stream modem state changes via Server-Sent Events.
+
+    All clients share one background poller (see ``monitor.MonitorHub``);
+    ``?ports=`` only filters which events this stream receives.
+    """
     requested_ports = request.args.getlist("ports")
-    lang = request.cookies.get("lang", get_language())
+    lang = resolve_language(request.cookies.get("lang"))
 
     def generate():
-        prev_by_port = {}
-        prev_by_sim = {}
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        sub = monitor.subscribe(lang, requested_ports)
         try:
             while True:
-                current_ports = requested_ports or list_modem_ports()
-                tasks = [get_modem_info_async(p, lang) for p in current_ports]
-                results = loop.run_until_complete(
-                    asyncio.gather(*tasks, return_exceptions=True)
-                )
-                new_by_port = {}
-                new_by_sim = {}
-                for p, res in zip(current_ports, results):
-                    if isinstance(res, Exception):
-                        event_logger.log_event(
-                            "monitor_error", port=p, details=str(res)
-                        )
-                        info = prev_by_port.get(p)
-                        if info:
-                            new_by_port[p] = info
-                            iccid_saved = info.get("iccid")
-                            if iccid_saved:
-                                new_by_sim[iccid_saved] = info
-                        continue
-                    info = res
-                    port = info.get("port")
-                    iccid = info.get("iccid")
-                    if not iccid or iccid == "\u2014":
-                        iccid = None
-                    imsi = info.get("imsi")
-                    if not iccid and imsi and imsi != "\u2014":
-                        iccid = imsi
-
-                    old_info_sim = prev_by_sim.get(iccid) if iccid else None
-                    old_info_port = prev_by_port.get(port)
-                    old_info = old_info_sim if old_info_sim is not None else old_info_port
-                    dd = DeepDiff(old_info or {}, info, ignore_order=True).to_dict()
-                    diff = {}
-                    for path, change in dd.get("values_changed", {}).items():
-                        key = path.strip("root[").strip("]'").split("['")[-1]
-                        if key != "port":
-                            diff[key] = change.get("new_value")
-                    for path in dd.get("dictionary_item_added", []):
-                        key = path.strip("root[").strip("]'").split("['")[-1]
-                        if key != "port":
-                            diff[key] = info.get(key)
-                    for path in dd.get("dictionary_item_removed", []):
-                        key = path.strip("root[").strip("]'").split("['")[-1]
-                        if key != "port":
-                            diff[key] = None
-
-                    old_port = old_info.get("port") if old_info else None
-                    if iccid and old_port and old_port != port:
-                        diff["moved_from"] = old_port
-
-                    if diff:
-                        diff["port"] = port
-                        yield f"data: {json.dumps(diff)}\n\n"
-                    new_by_port[port] = info
-                    if iccid:
-                        new_by_sim[iccid] = info
-
-                removed_ports = set(prev_by_port) - set(new_by_port)
-                for rp in removed_ports:
-                    yield f"data: {json.dumps({'port': rp, 'removed': True})}\n\n"
-                removed_sims = set(prev_by_sim) - set(new_by_sim)
-                for sim in removed_sims:
-                    rp = prev_by_sim[sim].get("port")
-                    if rp and rp not in removed_ports:
-                        yield f"data: {json.dumps({'port': rp, 'removed': True})}\n\n"
-
-                prev_by_port = new_by_port
-                prev_by_sim = new_by_sim
-                time.sleep(1.0)
+                event = sub.get(timeout=MONITOR_KEEPALIVE)
+                if event is None:
+                    # Комментарий SSE: помогает заметить закрытое соединение
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
         except GeneratorExit:
             return
-        except Exception as e:
-            event_logger.log_event("monitor_stream_error", details=str(e))
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
         finally:
-            loop.close()
+            sub.close()
 
     return current_app.response_class(generate(), mimetype="text/event-stream")
@@ -0,0 +1,126 @@
+"""
+Общая обвязка микробенчмарков: скорость, память и сравнение с базовой линией.
+
+Каждый бенчмарк — функция, вызываемая по очереди на элементах корпуса.
+Скорость считается как лучший из нескольких повторов прохода по корпусу
+(ops/s), память — как средний пик tracemalloc на один вызов (B/call),
+то есть сколько временных объектов создаёт функция.
+"""
+
+import os
+import json
+import time
+import tracemalloc
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def measure(fn, corpus, repeat=5, min_time=0.2, alloc_samples=200):
+    """Возвращает {"ops_per_sec": ..., "bytes_per_call": ...} для fn на corpus."""
+    corpus = list(corpus)
+    # Подбираем число проходов, чтобы один повтор длился не меньше min_time
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            for item in corpus:
+                fn(item)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            for item in corpus:
+                fn(item)
+        best = min(best, time.perf_counter() - start)
+    ops_per_sec = loops * len(corpus) / best
+
+    sample = corpus[:alloc_samples]
+    tracemalloc.start()
+    try:
+        total_peak = 0
+        for item in sample:
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            fn(item)
+            _, peak = tracemalloc.get_traced_memory()
+            total_peak += max(0, peak - base)
+    finally:
+        tracemalloc.stop()
+    return {
+        "ops_per_sec": ops_per_sec,
+        "bytes_per_call": total_peak / max(1, len(sample)),
+    }
+
+
+def load_baseline(name):
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(name, results):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+    return path
+
+
+def report(results, baseline, threshold):
+    """
+    Печатает таблицу и возвращает список регрессий: бенчмарков, которые
+    стали медленнее базовой линии больше чем на threshold (доля).
+    """
+    regressions = []
+    print(f"{'benchmark':32} {'ops/s':>12} {'B/call':>9} {'vs base':>9}")
+    for name, res in results.items():
+        base = baseline.get(name)
+        delta = ""
+        if base:
+            change = res["ops_per_sec"] / base["ops_per_sec"] - 1.0
+            delta = f"{change:+.1%}"
+            if change < -threshold:
+                regressions.append(name)
+                delta += " !"
+        print(
+            f"{name:32} {res['ops_per_sec']:12,.0f} "
+            f"{res['bytes_per_call']:9.0f} {delta:>9}"
+        )
+    return regressions
+
+
+def run_suite(suite_name, benchmarks, argv=None, description=None):
+    """Запуск набора {имя: (fn, corpus)} с ключами --save/--threshold/--filter."""
+    import argparse
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--save", action="store_true", help="сохранить результат как базовую линию")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="допустимое замедление относительно базовой линии (0.2 = 20%%)")
+    parser.add_argument("--filter", default="", help="запускать только бенчмарки с этой подстрокой")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, (fn, corpus) in benchmarks.items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(fn, corpus, repeat=args.repeat)
+
+    baseline = load_baseline(suite_name)
+    regressions = report(results, baseline, args.threshold)
+    if args.save:
+        merged = dict(baseline, **results)
+        print(f"baseline saved to {save_baseline(suite_name, merged)}")
+        return 0
+    if regressions:
+        print(f"regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
@@ -0,0 +1,125 @@
+"""
+Сравнение движка диффов delta.diff_states с прежним вариантом на DeepDiff.
+
+Прогоняет тики монитора на 500 портах (у ~10% портов меняется сигнал,
+несколько SIM переезжают между портами) через оба варианта, проверяет,
+что события совпадают, и печатает время одного тика.
+
+    python benchmarks/bench_delta.py [--ports 500] [--ticks 20]
+
+Для сравнения нужен установленный deepdiff; без него замеряется только
+новый движок.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import importlib.util
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FreeSMS import delta  # noqa: E402
+
+
+def deepdiff_states(prev_by_port, prev_by_sim, results):
+    """Прежняя реализация из api_monitor: DeepDiff и разбор путей root['key']."""
+    from deepdiff import DeepDiff
+
+    new_by_port, new_by_sim, events = {}, {}, []
+    for p, info in results:
+        port = info.get("port")
+        iccid = delta.sim_key(info)
+        old_info = prev_by_sim.get(iccid) if iccid else None
+        if old_info is None:
+            old_info = prev_by_port.get(port)
+        dd = DeepDiff(old_info or {}, info, ignore_order=True).to_dict()
+        diff = {}
+        for path, change in dd.get("values_changed", {}).items():
+            key = path.strip("root[").strip("]'").split("['")[-1]
+            if key != "port":
+                diff[key] = change.get("new_value")
+        for path in dd.get("dictionary_item_added", []):
+            key = path.strip("root[").strip("]'").split("['")[-1]
+            if key != "port":
+                diff[key] = info.get(key)
+        for path in dd.get("dictionary_item_removed", []):
+            key = path.strip("root[").strip("]'").split("['")[-1]
+            if key != "port":
+                diff[key] = None
+        old_port = old_info.get("port") if old_info else None
+        if iccid and old_port and old_port != port:
+            diff["moved_from"] = old_port
+        if diff:
+            diff["port"] = port
+            events.append(diff)
+        new_by_port[port] = info
+        if iccid:
+            new_by_sim[iccid] = info
+    return events, new_by_port, new_by_sim
+
+
+def make_ticks(rng, ports, ticks):
+    infos = []
+    for i in range(ports):
+        infos.append({
+            "port": f"/dev/ttyUSB{i}", "status": "OK", "model": "E173", "vendor": "Huawei",
+            "imsi": f"25001{i:010d}", "iccid": f"8970101{i:012d}", "operator": "rus-mts",
+            "sim_country": "rus", "imei": f"86{i:013d}", "phone": f"+7{i:010d}",
+            "network": "Connected", "signal": "20 (Good)", "cpin": "READY",
+            "sms": 0, "voice": 0, "ussd": "",
+        })
+    states = []
+    prev_by_port = {info["port"]: info for info in infos}
+    prev_by_sim = {info["iccid"]: info for info in infos}
+    for _ in range(ticks):
+        results = []
+        for info in prev_by_port.values():
+            new = dict(info)
+            if rng.random() < 0.1:
+                new["signal"] = f"{rng.randint(0, 31)} (Medium)"
+            if rng.random() < 0.02:
+                new["sms"] = new["sms"] + 1
+            results.append((new["port"], new))
+        # Пара SIM меняется слотами
+        a, b = rng.sample(range(len(results)), 2)
+        pa, pb = results[a][0], results[b][0]
+        ia, ib = dict(results[b][1], port=pa), dict(results[a][1], port=pb)
+        results[a], results[b] = (pa, ia), (pb, ib)
+        states.append((prev_by_port, prev_by_sim, results))
+        _, prev_by_port, prev_by_sim = delta.diff_states(prev_by_port, prev_by_sim, results)
+    return states
+
+
+def timed(fn, states):
+    start = time.perf_counter()
+    out = [fn(*state)[0] for state in states]
+    return (time.perf_counter() - start) / len(states), out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ports", type=int, default=500)
+    parser.add_argument("--ticks", type=int, default=20)
+    args = parser.parse_args()
+
+    states = make_ticks(random.Random(7), args.ports, args.ticks)
+    new_time, new_events = timed(delta.diff_states, states)
+    print(f"{args.ports} ports, {args.ticks} ticks")
+    print(f"delta.diff_states:  {new_time * 1000:9.3f} ms/tick")
+    if importlib.util.find_spec("deepdiff") is None:
+        print("deepdiff is not installed; skipping the comparison")
+        return 0
+    old_time, old_events = timed(deepdiff_states, states)
+    print(f"DeepDiff:           {old_time * 1000:9.3f} ms/tick")
+    print(f"speedup:            {old_time / new_time:9.1f}x")
+    if old_events != new_events:
+        print("MISMATCH: the engines produced different events")
+        return 1
+    print("events identical")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
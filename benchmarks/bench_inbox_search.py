@@ -0,0 +1,88 @@
+"""
+Время поиска во входящих SMS (sms_inbox.query_records) на большой базе.
+
+Заполняет временную базу сообщениями, похожими на поток OTP с сотен SIM,
+и замеряет типичные запросы /api/sms_records: первая страница, страница
+по порту, полнотекстовый поиск частого и редкого слова, поиск с фильтром
+по порту и переход на следующую страницу.
+
+    python benchmarks/bench_inbox_search.py [--messages 1000000] [--ports 256]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FreeSMS import sms_inbox  # noqa: E402
+
+SERVICES = ("Google", "Telegram", "WhatsApp", "Bank", "Uber", "Amazon", "Steam", "Yandex")
+
+
+def fill(inbox, rng, messages, ports, batch=10000):
+    now = int(time.time() * 1000) - messages * 10
+    rows = []
+    conn = inbox._conn
+    for i in range(messages):
+        service = rng.choice(SERVICES)
+        code = rng.randint(100000, 999999)
+        text = f"{service}: your verification code is {code}. Do not share it."
+        if i % 50000 == 7:
+            text += " rareword"
+        rows.append((now + i * 10, f"/dev/ttyUSB{i % ports}", f"+1555{rng.randint(0, 9999999):07d}",
+                     text, None, None))
+        if len(rows) >= batch:
+            with conn:
+                conn.executemany(sms_inbox._INSERT, rows)
+            rows = []
+    if rows:
+        with conn:
+            conn.executemany(sms_inbox._INSERT, rows)
+
+
+def timed(fn, repeat=20):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.95) - 1], result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--ports", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inbox = sms_inbox.Inbox(db_path=os.path.join(tmp, "sms.db"))
+        inbox.init_db()
+        start = time.perf_counter()
+        fill(inbox, random.Random(args.seed), args.messages, args.ports)
+        print(f"заполнение {args.messages} сообщений: {time.perf_counter() - start:.1f} с")
+
+        _, cursor = inbox.query_records(limit=100)
+        queries = {
+            "первая страница": lambda: inbox.query_records(limit=100),
+            "порт": lambda: inbox.query_records(port="/dev/ttyUSB7", limit=100),
+            "q=частое слово": lambda: inbox.query_records(q="telegram", limit=100),
+            "q=редкое слово": lambda: inbox.query_records(q="rareword", limit=100),
+            "q=префикс": lambda: inbox.query_records(q="whats*", limit=100),
+            "q + порт": lambda: inbox.query_records(q="bank", port="/dev/ttyUSB7", limit=100),
+            "следующая страница": lambda: inbox.query_records(before_id=cursor, limit=100),
+        }
+        print(f"{'запрос':<22}{'p50, мс':>10}{'p95, мс':>10}{'строк':>8}")
+        for name, fn in queries.items():
+            p50, p95, (rows, _) = timed(fn)
+            print(f"{name:<22}{p50:>10.2f}{p95:>10.2f}{len(rows):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Микробенчмарки горячих путей modem_utils и монитора.
+
+Корпуса генерируются детерминированно: ответы модемов на AT-команды в
+типичных видах (эхо команды, \\r\\n, OK, кавычки), IMSI и ICCID реальных
+операторов из operators.json вперемешку с неизвестными, и снимки
+состояния 500 портов для диффа монитора.
+
+    python benchmarks/bench_modem_utils.py            # сравнить с базовой линией
+    python benchmarks/bench_modem_utils.py --save     # записать базовую линию
+    python benchmarks/bench_modem_utils.py --filter iccid
+
+Базовая линия (benchmarks/baselines/modem_utils.json) зависит от машины:
+сохраняйте её на той же машине, где сравниваете.
+"""
+
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FreeSMS import modem_utils, operator_index, delta  # noqa: E402
+from _harness import run_suite  # noqa: E402
+
+SEED = 12345
+CORPUS_SIZE = 2000
+MONITOR_PORTS = 500
+
+
+def _digits(rng, n):
+    return "".join(rng.choice("0123456789") for _ in range(n))
+
+
+def at_responses(rng):
+    templates = [
+        "AT+CSQ\r\n+CSQ: {rssi},99\r\n\r\nOK\r\n",
+        "\r\n+CSQ: {rssi},0\r\n\r\nOK\r\n",
+        "AT+CIMI\r\n{imsi}\r\n\r\nOK\r\n",
+        "AT+CCID\r\n+CCID: \"{iccid}\"\r\n\r\nOK\r\n",
+        "\r\n+ICCID: {iccid}\r\n\r\nOK\r\n",
+        "AT+CPIN?\r\n+CPIN: READY\r\n\r\nOK\r\n",
+        "AT+COPS?\r\n+COPS: 0,0,\"MTS RUS\",7\r\n\r\nOK\r\n",
+        "AT+CGSN\r\n{imei}\r\n\r\nOK\r\n",
+        "AT+CNUM\r\n+CNUM: \"\",\"+7{phone}\",145\r\n\r\nOK\r\n",
+        "\r\nERROR\r\n",
+    ]
+    for _ in range(CORPUS_SIZE):
+        yield rng.choice(templates).format(
+            rssi=rng.choice([rng.randint(0, 31), 99]),
+            imsi="25001" + _digits(rng, 10),
+            iccid="8970101" + _digits(rng, 12),
+            imei="86" + _digits(rng, 13),
+            phone=_digits(rng, 10),
+        )
+
+
+def identifiers(rng):
+    known = [k for k, _ in operator_index.get_index().items()]
+    imsis, iccids = [], []
+    for i in range(CORPUS_SIZE):
+        # Три четверти — известные MCC+MNC, остальные — случайные
+        prefix = rng.choice(known) if i % 4 else _digits(rng, 5)
+        imsis.append((prefix + _digits(rng, 15))[:15])
+        iccid = ("89" + prefix + _digits(rng, 19))[:19]
+        iccids.append(iccid if i % 10 else iccid + "F")
+    return imsis, iccids
+
+
+def monitor_states(rng):
+    """Пары (предыдущее состояние, результаты опроса) для MONITOR_PORTS портов."""
+    prev_by_port, prev_by_sim, ticks = {}, {}, []
+    infos = {}
+    for i in range(MONITOR_PORTS):
+        port = f"/dev/ttyUSB{i}"
+        info = {
+            "port": port, "status": "OK", "model": "E173", "vendor": "Huawei",
+            "imsi": "25001" + _digits(rng, 10), "iccid": "8970101" + _digits(rng, 12),
+            "operator": "rus-mts", "sim_country": "rus", "imei": "86" + _digits(rng, 13),
+            "phone": "+7" + _digits(rng, 10), "network": "Connected",
+            "signal": "20 (Good)", "cpin": None, "sms": 0, "voice": 0, "ussd": "",
+        }
+        infos[port] = info
+        prev_by_port[port] = info
+        prev_by_sim[info["iccid"]] = info
+    for _ in range(4):
+        results = []
+        for port, info in infos.items():
+            new = dict(info)
+            # Типичный тик: у ~10% портов меняется сигнал
+            if rng.random() < 0.1:
+                new["signal"] = f"{rng.randint(0, 31)} (Medium)"
+            results.append((port, new))
+        ticks.append((prev_by_port, prev_by_sim, results))
+    return ticks
+
+
+def main():
+    rng = random.Random(SEED)
+    responses = list(at_responses(rng))
+    csq = [r for r in responses if "+CSQ" in r] or ["+CSQ: 10,0"]
+    imsis, iccids = identifiers(rng)
+    ticks = monitor_states(rng)
+
+    benchmarks = {
+        "extract_data": (modem_utils.extract_data, responses),
+        "parse_signal": (lambda r: modem_utils.parse_signal(r, "en"), csq),
+        "get_operator_from_imsi": (modem_utils.get_operator_from_imsi, imsis),
+        "get_country_from_imsi": (modem_utils.get_country_from_imsi, imsis),
+        "get_operator_from_iccid": (modem_utils.get_operator_from_iccid, iccids),
+        "get_country_from_iccid": (modem_utils.get_country_from_iccid, iccids),
+        f"monitor_diff_{MONITOR_PORTS}_ports": (
+            lambda tick: delta.diff_states(*tick), ticks,
+        ),
+    }
+    return run_suite("modem_utils", benchmarks, description=__doc__.strip().splitlines()[0])
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,112 @@
+"""
+Пропускная способность правил входящих SMS (rules.RuleSet) при 1k и 10k правил.
+
+Правила похожи на настоящие: большинство ищут по тексту код конкретного
+сервиса, часть привязана к отправителю, порту или оператору, несколько
+не имеют якоря вовсе. Для сравнения замеряется прямой перебор всех
+правил (так работал бы движок без общего сопоставителя); результаты
+обоих вариантов сверяются.
+
+    python benchmarks/bench_rules.py [--rules 1000 10000] [--messages 20000]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FreeSMS import rules  # noqa: E402
+
+OPERATORS = ("rus-mts", "rus-beeline", "rus-megafon", "rus-tele2")
+WORDS = ("alpha", "bravo", "delta", "kilo", "lima", "oscar", "tango", "zulu")
+
+
+def make_rules(rng, count):
+    result = []
+    for i in range(count):
+        kind = rng.random()
+        rule = {"id": str(i), "action": "tag", "target": f"t{i}"}
+        if kind < 0.70:
+            rule["pattern"] = rf"{rng.choice(WORDS)}{i}:? (?:code|pin) (\d{{4,6}})"
+            rule["extract_index"] = 1
+        elif kind < 0.85:
+            rule["sender"] = f"+7900{i:07d}"
+        elif kind < 0.95:
+            rule["port"] = f"/dev/ttyUSB{i % 256}"
+            rule["pattern"] = r"\d{6}"
+        elif kind < 0.999:
+            rule["operator"] = rng.choice(OPERATORS)
+            rule["pattern"] = rf"ref{i}\b"
+        else:
+            rule["pattern"] = r"^\W+$"
+        result.append(rules.normalize(rule))
+    return result
+
+
+def make_messages(rng, count, rule_count):
+    messages = []
+    for _ in range(count):
+        i = rng.randrange(rule_count)
+        code = rng.randint(1000, 999999)
+        if rng.random() < 0.5:
+            text = f"{rng.choice(WORDS)}{i} code {code}. Do not share it with anyone."
+        else:
+            text = f"Your verification code is {code}. It expires in 10 minutes."
+        messages.append((
+            f"+7900{rng.randrange(rule_count * 2):07d}",
+            f"/dev/ttyUSB{rng.randrange(256)}",
+            rng.choice(OPERATORS),
+            text,
+        ))
+    return messages
+
+
+def naive_match(compiled, sender, port, operator, text):
+    sender = sender.lower()
+    matched = []
+    for c in compiled:
+        value = c.check(sender, port, operator, text)
+        if value is not None:
+            matched.append((c.rule, value))
+    return matched
+
+
+def run(fn, messages):
+    start = time.perf_counter()
+    results = [fn(*m) for m in messages]
+    return len(messages) / (time.perf_counter() - start), results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rules", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    print(f"{'правил':>8}{'компиляция, мс':>16}{'сообщ/с':>12}{'перебор, сообщ/с':>18}")
+    for count in args.rules:
+        rng = random.Random(args.seed)
+        rule_list = make_rules(rng, count)
+        messages = make_messages(rng, args.messages, count)
+
+        start = time.perf_counter()
+        ruleset = rules.RuleSet(rule_list)
+        compile_ms = (time.perf_counter() - start) * 1000
+        rate, results = run(ruleset.match, messages)
+
+        # Перебор медленный: хватает части сообщений
+        sample = messages[:max(100, args.messages * 100 // count // 10)]
+        compiled = [rules._Compiled(i, r) for i, r in enumerate(rule_list)]
+        naive_rate, naive_results = run(lambda *m: naive_match(compiled, *m), sample)
+        for got, expected in zip(results, naive_results):
+            assert [r["id"] for r, _ in got] == [r["id"] for r, _ in expected], (got, expected)
+
+        print(f"{count:>8}{compile_ms:>16.1f}{rate:>12.0f}{naive_rate:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
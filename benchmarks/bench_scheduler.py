@@ -0,0 +1,135 @@
+"""
+Задержка интерактивных команд под нагрузкой: очередь портов против прямых вызовов.
+
+На симуляторе из --ports модемов одновременно идут:
+  * непрерывный опрос монитора (get_modem_info по всем портам);
+  * «шторм» подключений: --clients клиентов раз за разом подключают все
+    порты (get_modem_info с full=True, как /api/connect);
+  * пробная AT-команда на случайном порту каждые --probe-ms мс.
+
+Режим direct вызывает modem_utils напрямую из потоков (порт делят через
+блокировку сессии, кто первый успел), scheduled — через FreeSMS.scheduler.
+Выводятся p50/p95/max задержки AT-команды и сколько раз на самом деле
+выполнился get_modem_info.
+
+    python benchmarks/bench_scheduler.py --ports 16 --latency-ms 20 --clients 8
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+import concurrent.futures
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FreeSMS import backends, modem_utils, scheduler  # noqa: E402
+from FreeSMS.simulator import SimulatorBackend  # noqa: E402
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Direct:
+    """Те же вызовы, что у Scheduler, но сразу в потоке вызывающего."""
+
+    def call(self, port, name, *args, priority=None, **kwargs):
+        return getattr(modem_utils, name)(port, *args, **kwargs)
+
+
+def run(mode, ports, args):
+    runner = scheduler.Scheduler() if mode == "scheduled" else Direct()
+    executions = [0]
+    original = modem_utils.get_modem_info
+
+    def counted(*a, **kw):
+        executions[0] += 1
+        return original(*a, **kw)
+
+    modem_utils.get_modem_info = counted
+    stop = threading.Event()
+    latency = []
+
+    def poller():
+        # Как монитор: все порты параллельно, затем следующий обход
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ports)) as ex:
+            while not stop.is_set():
+                list(ex.map(
+                    lambda p: runner.call(p, "get_modem_info", "en", priority=scheduler.POLL),
+                    ports,
+                ))
+
+    def connect_client():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ports)) as ex:
+            while not stop.is_set():
+                list(ex.map(
+                    lambda p: runner.call(p, "get_modem_info", "en", True,
+                                          priority=scheduler.CONNECT),
+                    ports,
+                ))
+
+    def prober():
+        rng = random.Random(1)
+        while not stop.is_set():
+            port = rng.choice(ports)
+            start = time.perf_counter()
+            runner.call(port, "send_at_command", "AT", priority=scheduler.INTERACTIVE)
+            latency.append(time.perf_counter() - start)
+            stop.wait(args.probe_ms / 1000.0)
+
+    threads = [threading.Thread(target=poller)]
+    threads += [threading.Thread(target=connect_client) for _ in range(args.clients)]
+    threads.append(threading.Thread(target=prober))
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        modem_utils.get_modem_info = original
+    return latency, executions[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ports", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--clients", type=int, default=8, help="клиентов шторма подключений")
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на режим")
+    parser.add_argument("--probe-ms", type=float, default=50.0)
+    parser.add_argument("--modes", nargs="+", default=["direct", "scheduled"],
+                        choices=["direct", "scheduled"])
+    args = parser.parse_args()
+
+    backends.set_backend(SimulatorBackend({
+        "ports": args.ports,
+        "latency_ms": args.latency_ms,
+        "jitter_ms": 0,
+        "init_latency_ms": 0,
+        "seed": 1,
+    }))
+    ports = modem_utils.list_modem_ports()
+    # Сессии открываются заранее, чтобы оба режима мерили установившийся опрос
+    for port in ports:
+        modem_utils.get_modem_info(port, "en", True)
+    print(f"{len(ports)} virtual ports, {args.latency_ms} ms/command, "
+          f"{args.clients} connect clients, {args.duration:.0f} s per mode")
+    print(f"{'mode':<10}{'AT p50':>9}{'AT p95':>9}{'AT max':>9}{'probes':>8}{'get_modem_info':>16}")
+    for mode in args.modes:
+        latency, executions = run(mode, ports, args)
+        print(
+            f"{mode:<10}{percentile(latency, 0.5) * 1000:>7.0f}ms"
+            f"{percentile(latency, 0.95) * 1000:>7.0f}ms{max(latency) * 1000:>7.0f}ms"
+            f"{len(latency):>8}{executions:>16}",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+USSD-запрос по всей ферме на симуляторе: параллельный набор и повтор из кэша.
+
+Набирает --code (с ответами меню --replies) на --ports виртуальных портах
+через FreeSMS.ussd и выводит время до первого и последнего ответа, затем
+повторяет тот же запрос (ответы из кэша по ICCID) и для сравнения
+оценивает время последовательного набора порт за портом.
+
+    python benchmarks/bench_ussd.py --ports 256 --ussd-latency-ms 1500
+    python benchmarks/bench_ussd.py --ports 64 --code "*111#" --replies 3 0 1
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FreeSMS import backends, modem_utils, ussd  # noqa: E402
+from FreeSMS.simulator import SimulatorBackend  # noqa: E402
+
+
+def sweep(engine, ports, code, replies, force=False):
+    start = time.perf_counter()
+    first = None
+    statuses = {}
+    for result in engine.run(ports, code, replies, force):
+        if first is None:
+            first = time.perf_counter() - start
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    return first, time.perf_counter() - start, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ports", type=int, default=256)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--ussd-latency-ms", type=float, default=1500.0)
+    parser.add_argument("--code", default="*100#")
+    parser.add_argument("--replies", nargs="*", default=[])
+    args = parser.parse_args()
+
+    backends.set_backend(SimulatorBackend({
+        "ports": args.ports,
+        "latency_ms": args.latency_ms,
+        "ussd_latency_ms": args.ussd_latency_ms,
+        "init_latency_ms": 0,
+        "seed": 1,
+    }))
+    ports = modem_utils.list_modem_ports()
+    engine = ussd.UssdEngine()
+    code, replies = engine.validate(args.code, args.replies)
+    steps = 1 + len(replies)
+    print(f"{len(ports)} virtual ports, {code} with {len(replies)} menu replies, "
+          f"{args.ussd_latency_ms:.0f} ms network reply")
+
+    first, total, statuses = sweep(engine, ports, code, replies)
+    print(f"parallel dial:  first {first:6.2f} s, all {total:6.2f} s  {statuses}")
+    first, total, statuses = sweep(engine, ports, code, replies)
+    print(f"cached refresh: first {first:6.3f} s, all {total:6.3f} s  {statuses}")
+    # Порт за портом: каждый шаг — набор плюс ответ сети
+    serial = len(ports) * steps * (args.ussd_latency_ms + args.latency_ms) / 1000.0
+    print(f"serial dial:    ~{serial:.0f} s (estimate)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Проверка времени холодного импорта пакета FreeSMS.
+
+Для каждого модуля из import_budget.json запускает
+``python -X importtime -c "import <модуль>"`` несколько раз, берёт
+минимальное суммарное время импортов (без того, что интерпретатор
+загружает сам при старте) и сравнивает с бюджетом. Заодно проверяет,
+что тяжёлые зависимости из списка forbidden не загружаются.
+
+    python benchmarks/import_time.py            # проверка, код возврата 1 при регрессии
+    python benchmarks/import_time.py --top 15   # плюс самые дорогие импорты
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BUDGET_PATH = os.path.join(HERE, "import_budget.json")
+
+
+def _importtime(statement):
+    """Список (имя, self_us, cumulative_us, уровень вложенности) из -X importtime."""
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        self_us, cumulative, name = int(parts[0]), int(parts[1]), parts[2]
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((name.strip(), self_us, cumulative, depth))
+    return rows
+
+
+def measure(module, repeat):
+    """Минимальное по запускам время импорта module (мс) и загруженные им модули."""
+    startup = {name for name, *_ in _importtime("pass")}
+    best = None
+    loaded = set()
+    rows_best = []
+    for _ in range(repeat):
+        rows = _importtime(f"import {module}")
+        loaded = {name for name, *_ in rows} - startup
+        total = sum(cum for name, _, cum, depth in rows if depth == 0 and name not in startup)
+        if best is None or total < best:
+            best, rows_best = total, rows
+    return best / 1000.0, loaded, rows_best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=0, help="показать N самых дорогих модулей")
+    args = parser.parse_args()
+
+    with open(BUDGET_PATH, encoding="utf-8") as f:
+        budgets = json.load(f)
+
+    failed = False
+    for module, spec in budgets.items():
+        ms, loaded, rows = measure(module, args.repeat)
+        budget = spec["budget_ms"]
+        leaked = sorted(
+            dep for dep in spec.get("forbidden", [])
+            if any(name == dep or name.startswith(dep + ".") for name in loaded)
+        )
+        ok = ms <= budget and not leaked
+        failed |= not ok
+        status = "ok" if ok else "FAIL"
+        print(f"{status:4} {module:28} {ms:8.1f} ms  (budget {budget} ms)")
+        if leaked:
+            print(f"     loads forbidden modules: {', '.join(leaked)}")
+        if args.top:
+            for name, self_us, _, _ in sorted(rows, key=lambda r: -r[1])[:args.top]:
+                print(f"     {self_us / 1000.0:8.2f} ms  {name}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
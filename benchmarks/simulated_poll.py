@@ -0,0 +1,106 @@
+"""
+Нагрузочный прогон опроса модемов на симуляторе (без железа).
+
+Поднимает виртуальную ферму из --ports модемов и измеряет:
+  * время первого подключения ко всем портам (Init + полный опрос),
+  * время тиков монитора (get_modem_info по всем портам) в установившемся режиме,
+  * задержку /api/connect (POST) через тестовый клиент Flask.
+
+С --shards N порты опрашивают N процессов-обработчиков (FreeSMS.sharding),
+а этот процесс только сводит их ответы.
+
+    python benchmarks/simulated_poll.py --ports 256 --latency-ms 20 --ticks 5
+    python benchmarks/simulated_poll.py --ports 300 --latency-ms 0 --shards 4
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import concurrent.futures
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FreeSMS import backends, modem_utils, sharding  # noqa: E402
+from FreeSMS.simulator import SimulatorBackend  # noqa: E402
+
+
+def sweep(ports, workers, full=False):
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+            lambda p: modem_utils.get_modem_info(p, "en", full), ports
+        ))
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ports", type=int, default=256)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--init-latency-ms", type=float, default=300.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--ticks", type=int, default=5)
+    parser.add_argument("--api", action="store_true", help="также замерить POST /api/connect")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="опрашивать порты из N процессов (sharding) вместо потоков")
+    args = parser.parse_args()
+
+    options = {
+        "ports": args.ports,
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "init_latency_ms": args.init_latency_ms,
+        "failure_rate": args.failure_rate,
+        "seed": 1,
+    }
+    backends.set_backend(SimulatorBackend(options))
+    ports = modem_utils.list_modem_ports()
+    print(f"{len(ports)} virtual ports, {args.latency_ms} ms/command, {args.workers} workers"
+          + (f", {args.shards} shards" if args.shards else ""))
+
+    manager = None
+    if args.shards:
+        manager = sharding.ShardManager(
+            {"workers": args.shards, "worker_threads": args.workers},
+            backend=("simulator", options),
+        )
+        manager.start()
+
+    def poll(full=False):
+        if manager is None:
+            return sweep(ports, args.workers, full)
+        start = time.perf_counter()
+        results = manager.poll(ports, "en")
+        return time.perf_counter() - start, [results[p] for p in ports]
+
+    elapsed, results = poll(full=True)
+    ok = sum(1 for r in results if isinstance(r, dict) and "model" in r)
+    print(f"connect sweep:  {elapsed:7.3f} s  ({ok}/{len(ports)} answered)")
+
+    ticks = []
+    cpu = time.process_time()
+    for _ in range(args.ticks):
+        elapsed, _ = poll()
+        ticks.append(elapsed)
+    cpu = (time.process_time() - cpu) / args.ticks
+    print(
+        f"monitor tick:   {statistics.median(ticks):7.3f} s median, "
+        f"{min(ticks):.3f}-{max(ticks):.3f} s over {len(ticks)} ticks, "
+        f"{cpu:.3f} s CPU of this process per tick"
+    )
+
+    if args.api:
+        from FreeSMS import app
+        client = app.test_client()
+        start = time.perf_counter()
+        resp = client.post("/api/connect", json={"ports": ports})
+        elapsed = time.perf_counter() - start
+        print(f"/api/connect:   {elapsed:7.3f} s  (HTTP {resp.status_code})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Нагрузочный тест SSE: сколько одновременных потоков /api/monitor держит сервер.
+
+Для каждого режима (flask — текущий сервер runserver.py, asgi —
+SERVER_MODE=asgi) запускает сервер на симуляторе модемов, открывает
+--streams одновременных потоков /api/monitor и в течение --duration
+секунд считает:
+  * сколько потоков подключилось и получило первое событие;
+  * время до первого события (p50/p95);
+  * сколько событий доставлено всем клиентам;
+  * задержку обычного запроса (/api/port_health) при открытых потоках;
+  * число потоков и память (RSS) процессов сервера — из /proc, только Linux.
+
+    python benchmarks/sse_loadtest.py [--modes flask asgi] [--streams 100 500 1000]
+    python benchmarks/sse_loadtest.py --url http://127.0.0.1:5555 --streams 200
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _children(pid):
+    result = [pid]
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as fh:
+                ppid = int(fh.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            result.extend(_children(int(entry)))
+    return result
+
+
+def process_stats(pid):
+    """(потоков, RSS в МБ) процесса pid и его потомков."""
+    threads = rss_kb = 0
+    for p in _children(pid):
+        try:
+            with open(f"/proc/{p}/status") as fh:
+                for line in fh:
+                    if line.startswith("Threads:"):
+                        threads += int(line.split()[1])
+                    elif line.startswith("VmRSS:"):
+                        rss_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return threads, rss_kb / 1024
+
+
+def spawn(mode, port):
+    env = dict(
+        os.environ,
+        SERVER_MODE=mode,
+        SERVER_PORT=str(port),
+        FREESMS_MODEM_BACKEND="simulator",
+        PYTHONPATH=ROOT,
+    )
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "runserver.py")],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(session, url, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{url}/api/port_health") as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError(f"server at {url} did not start")
+
+
+async def stream(session, url, ports, stop, stats):
+    started = time.monotonic()
+    params = [("ports", p) for p in ports]
+    try:
+        async with session.get(f"{url}/api/monitor", params=params) as resp:
+            if resp.status != 200:
+                stats["errors"] += 1
+                return
+            stats["connected"] += 1
+            first = True
+            while not stop.is_set():
+                line = await resp.content.readline()
+                if not line:
+                    break
+                if line.startswith(b"data:"):
+                    if first:
+                        stats["first_event"].append(time.monotonic() - started)
+                        first = False
+                    stats["events"] += 1
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        stats["errors"] += 1
+
+
+async def probe_latency(session, url, stop, samples):
+    while not stop.is_set():
+        start = time.monotonic()
+        try:
+            async with session.get(f"{url}/api/port_health", timeout=aiohttp.ClientTimeout(total=10)) as resp:
+                await resp.read()
+            samples.append(time.monotonic() - start)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            samples.append(float("inf"))
+        await asyncio.sleep(0.2)
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run_level(url, count, duration, ports, pid):
+    stats = {"connected": 0, "errors": 0, "events": 0, "first_event": []}
+    latency = []
+    stop = asyncio.Event()
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        tasks = [
+            asyncio.ensure_future(stream(session, url, ports, stop, stats))
+            for _ in range(count)
+        ]
+        probe = asyncio.ensure_future(probe_latency(session, url, stop, latency))
+        await asyncio.sleep(duration)
+        threads, rss = process_stats(pid) if pid else (None, None)
+        stop.set()
+        for task in tasks + [probe]:
+            task.cancel()
+        await asyncio.gather(*tasks, probe, return_exceptions=True)
+    return {
+        "connected": stats["connected"],
+        "first_p50": percentile(stats["first_event"], 0.5),
+        "first_p95": percentile(stats["first_event"], 0.95),
+        "got_event": len(stats["first_event"]),
+        "events": stats["events"],
+        "errors": stats["errors"],
+        "api_p95": percentile(latency, 0.95),
+        "threads": threads,
+        "rss": rss,
+    }
+
+
+def print_row(mode, count, r):
+    threads = "-" if r["threads"] is None else r["threads"]
+    rss = "-" if r["rss"] is None else f"{r['rss']:.0f}"
+    print(
+        f"{mode:<6}{count:>8}{r['connected']:>10}{r['got_event']:>9}"
+        f"{r['first_p50'] * 1000:>10.0f}{r['first_p95'] * 1000:>10.0f}"
+        f"{r['events']:>10}{r['api_p95'] * 1000:>10.0f}{threads:>9}{rss:>8}",
+        flush=True,
+    )
+
+
+async def main_async(args):
+    print(f"{'режим':<6}{'потоков':>8}{'подключ.':>10}{'событие':>9}"
+          f"{'1-е p50':>10}{'1-е p95':>10}{'событий':>10}{'API p95':>10}"
+          f"{'нитей':>9}{'RSS МБ':>8}")
+    targets = [("url", args.url, None)] if args.url else [(m, None, None) for m in args.modes]
+    for mode, url, proc in targets:
+        if url is None:
+            proc = spawn(mode, args.port)
+            url = f"http://127.0.0.1:{args.port}"
+        try:
+            async with aiohttp.ClientSession() as session:
+                await wait_ready(session, url)
+                async with session.get(f"{url}/api/scan_ports") as resp:
+                    ports = (await resp.json())["ports"][:args.monitor_ports]
+            if proc is not None:
+                threads, rss = process_stats(proc.pid)
+                print(f"{mode:<6}{'покой':>8}{'':>59}{threads:>9}{rss:>8.0f}", flush=True)
+            for count in args.streams:
+                result = await run_level(url, count, args.duration, ports,
+                                         proc.pid if proc else None)
+                print_row(mode, count, result)
+                # Сервер закрывает брошенные потоки не мгновенно
+                await asyncio.sleep(2)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait(10)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", nargs="+", default=["flask", "asgi"], choices=["flask", "asgi"])
+    parser.add_argument("--streams", type=int, nargs="+", default=[100, 500, 1000])
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на уровень")
+    parser.add_argument("--monitor-ports", type=int, default=8,
+                        help="сколько портов смотрит каждый поток (0 — все)")
+    parser.add_argument("--port", type=int, default=5600)
+    parser.add_argument("--url", help="уже запущенный сервер вместо запуска своего")
+    args = parser.parse_args(argv)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
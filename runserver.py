@@ -1,9 +1,17 @@
-from FreeSMS import app
 if __name__ == "__main__":
     import os
+    # Приложение импортируется только здесь: процессы-обработчики портов
+    # (sharding) запускаются через spawn и заново импортируют этот файл
+    from FreeSMS import app
     host = os.environ.get("SERVER_HOST", "127.0.0.1")
     try:
         port = int(os.environ.get("SERVER_PORT", "5555"))
     except ValueError:
         port = 5555
-    app.run(host=host, port=port, debug=True)
+    if os.environ.get("SERVER_MODE") == "asgi":
+        # SSE-потоки — корутины, остальное — тот же Flask (см. FreeSMS/asgi.py)
+        import uvicorn
+        from FreeSMS.asgi import app as asgi_app
+        uvicorn.run(asgi_app, host=host, port=port)
+    else:
+        app.run(host=host, port=port, debug=True)
@@ -0,0 +1,16 @@
+import sys
+from FreeSMS import operator_index
+
+
+def main():
+    src = sys.argv[1] if len(sys.argv) > 1 else operator_index.OPS_PATH
+    dst = sys.argv[2] if len(sys.argv) > 2 else operator_index.INDEX_PATH
+    data = operator_index.build(src, dst)
+    index = operator_index.OperatorIndex(data)
+    operators = sum(1 for _ in index.items())
+    countries = sum(1 for _ in index.countries())
+    print(f"{dst}: {len(data)} bytes, {operators} operators, {countries} MCC countries")
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,24 +1,86 @@
 import sys
-from FreeSMS.modem_utils import (
-    get_operator_from_imsi,
-    get_operator_from_iccid,
-    get_country_from_imsi,
-    get_country_from_iccid,
-)
+import csv
+import json
+import argparse
+from itertools import islice
+
+from FreeSMS.modem_utils import lookup_identifier, lookup_many
+
+FIELDS = ["id", "type", "operator", "country"]
+
+
+def _chunks(lines, size):
+    lines = iter(lines)
+    while True:
+        chunk = [line.strip() for line in islice(lines, size)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def _results(chunks, jobs):
+    """Результаты по чанкам в исходном порядке, при jobs > 1 — в нескольких процессах."""
+    if jobs <= 1:
+        for chunk in chunks:
+            yield lookup_many(chunk)
+        return
+    import multiprocessing
+    with multiprocessing.Pool(jobs) as pool:
+        yield from pool.imap(lookup_many, chunks)
+
+
+def run_batch(src, dst, fmt="csv", chunk_size=10000, jobs=1):
+    """Читает идентификаторы по одному в строке из src и пишет результаты в dst."""
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(dst, fieldnames=FIELDS)
+        writer.writeheader()
+    count = 0
+    for rows in _results(_chunks(src, chunk_size), jobs):
+        if writer:
+            writer.writerows(rows)
+        else:
+            dst.write("".join(json.dumps(row) + "\n" for row in rows))
+        count += len(rows)
+    return count
 
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: lookup_operator.py <IMSI|ICCID>")
-        return 1
-    code = sys.argv[1].strip()
-    if code.isdigit() and len(code) >= 5:
-        operator = get_operator_from_imsi(code)
-        country = get_country_from_imsi(code)
-    else:
-        operator = get_operator_from_iccid(code)
-        country = get_country_from_iccid(code)
-    print(f"operator: {operator}\ncountry: {country}")
+    parser = argparse.ArgumentParser(
+        description="Определение оператора и страны по IMSI/ICCID"
+    )
+    parser.add_argument("code", nargs="?", help="IMSI или ICCID")
+    parser.add_argument(
+        "--batch", metavar="FILE",
+        help="файл с идентификаторами по одному в строке ('-' — stdin)",
+    )
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    parser.add_argument("--output", "-o", help="файл результата (по умолчанию stdout)")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=1,
+        help="число процессов для очень больших файлов",
+    )
+    args = parser.parse_args()
+
+    if not args.batch:
+        if not args.code:
+            print("Usage: lookup_operator.py <IMSI|ICCID>")
+            return 1
+        res = lookup_identifier(args.code)
+        print(f"operator: {res['operator']}\ncountry: {res['country']}")
+        return 0
+
+    src = sys.stdin if args.batch == "-" else open(args.batch, encoding="utf-8")
+    dst = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        run_batch(src, dst, args.format, args.chunk_size, args.jobs)
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+    return 0
 
 
 if __name__ == "__main__":
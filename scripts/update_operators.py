@@ -3,6 +3,8 @@ import re
 import requests
 import pycountry
 
+from FreeSMS import operator_index
+
 # Source with up‑to‑date MCC/MNC information.  We rely on the dataset from
 # the pbakondy/mcc-mnc-list GitHub project, which is distributed as a JSON
 # array of objects describing MCC/MNC pairs.  The JSON file is fetched from
@@ -88,6 +90,8 @@ def main():
     ops_list = generate_ops_list(data)
     with open("operators.json", "w", encoding="utf-8") as f:
         json.dump(ops_list, f, ensure_ascii=False, indent=2)
+    # Пересобираем бинарный индекс, чтобы сервер не делал этого при старте
+    operator_index.build("operators.json", operator_index.INDEX_PATH)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,104 @@
+"""
+Локальный приёмник веб-хуков для проверки пересылки SMS (forwarding).
+
+Принимает POST с JSON, печатает по строке на запрос и отвечает 200.
+Держит соединения keep-alive (HTTP/1.1), поэтому по номеру соединения в
+выводе видно, переиспользует ли отправитель пул. --delay и --fail-rate
+имитируют медленный или нестабильный адресат.
+
+    python scripts/webhook_stub.py [--port 8099] [--delay 0.5] [--fail-rate 0.2]
+
+В config.json: "forwarding": {"destinations": {"stub": {"url": "http://127.0.0.1:8099/"}}}
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import itertools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Отправитель закрыл соединение из пула — это не ошибка
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_handler(args):
+    connections = itertools.count(1)
+    stats = {"requests": 0, "failed": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            self.conn_id = next(connections)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length)
+            if args.delay:
+                time.sleep(args.delay)
+            fail = random.random() < args.fail_rate
+            with lock:
+                stats["requests"] += 1
+                stats["failed"] += fail
+                count = stats["requests"]
+            status = args.fail_status if fail else 200
+            try:
+                payload = json.loads(body or b"null")
+            except ValueError:
+                payload = body.decode("utf-8", "replace")
+            if not args.quiet:
+                summary = payload
+                if isinstance(payload, dict):
+                    summary = {k: payload.get(k) for k in ("id", "port", "phone", "text")}
+                print(f"#{count} conn={self.conn_id} {status} "
+                      f"{json.dumps(summary, ensure_ascii=False)}", flush=True)
+            reply = json.dumps({"ok": not fail}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+
+        do_PUT = do_POST
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler, stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--delay", type=float, default=0.0, help="пауза перед ответом, с")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="доля ответов с ошибкой")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--quiet", action="store_true", help="не печатать запросы")
+    args = parser.parse_args(argv)
+
+    handler, stats = make_handler(args)
+    server = StubServer((args.host, args.port), handler)
+    print(f"webhook stub on http://{args.host}:{args.port}/", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"requests: {stats['requests']}, failed: {stats['failed']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
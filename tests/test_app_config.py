@@ -0,0 +1,57 @@
+"""create_app передаёт подсистемам их разделы config.json."""
+
+import json
+
+import FreeSMS
+from FreeSMS import (
+    backends, event_logger, event_retention, forwarding, rules, sharding,
+    sms_inbox, sms_queue, ussd,
+)
+
+SECTIONS = ("event_retention", "sharding", "sms_queue", "forwarding", "ussd", "sms_inbox")
+
+
+class _Inbox:
+    def start(self):
+        pass
+
+
+def _capture(monkeypatch):
+    captured = {}
+
+    def recorder(name, result=None):
+        def record(config=None):
+            captured[name] = config
+            return result
+        return record
+
+    monkeypatch.setattr(event_logger, "init_db", lambda: None)
+    monkeypatch.setattr(event_retention, "start", recorder("event_retention"))
+    monkeypatch.setattr(sharding, "start", recorder("sharding"))
+    monkeypatch.setattr(sms_queue, "start", recorder("sms_queue"))
+    monkeypatch.setattr(forwarding, "start", recorder("forwarding"))
+    monkeypatch.setattr(ussd, "start", recorder("ussd"))
+    monkeypatch.setattr(sms_inbox, "get_inbox", recorder("sms_inbox", _Inbox()))
+    monkeypatch.setattr(rules, "attach", lambda inbox: None)
+    return captured
+
+
+def test_sections_come_from_config_json(monkeypatch):
+    captured = _capture(monkeypatch)
+    FreeSMS.create_app()
+    with open(backends.CONFIG_PATH, encoding="utf-8") as fh:
+        config = json.load(fh)
+    for name in SECTIONS:
+        assert captured[name] == config.get(name), name
+
+
+def test_sharding_workers_reach_sharding_start(monkeypatch):
+    captured = _capture(monkeypatch)
+    monkeypatch.setattr(backends, "read_config", lambda: {
+        "sharding": {"workers": 2},
+        "forwarding": {"destinations": {"hook": {"type": "http", "url": "http://127.0.0.1/"}}},
+    })
+    FreeSMS.create_app()
+    assert captured["sharding"] == {"workers": 2}
+    assert "hook" in captured["forwarding"]["destinations"]
+    assert captured["ussd"] is None
@@ -0,0 +1,48 @@
+"""Рассылка, загрузка которой оборвалась, не продолжает отправку."""
+
+import threading
+
+import pytest
+
+from FreeSMS import campaigns, event_logger, sharding, sms_queue
+
+
+def test_broken_ingest_fails_campaign_and_cancels_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_logger, "log_event", lambda *a, **kw: None)
+    monkeypatch.setattr(campaigns, "INGEST_BATCH", 3)
+    monkeypatch.setattr(campaigns, "load_prefixes", lambda config=None: {})
+    release = threading.Event()
+
+    def call(port, name, *args, **kwargs):
+        if name == "cached_operator":
+            return None
+        # Отправка «зависает», чтобы сообщения оставались в очереди
+        release.wait(5)
+        return [1]
+
+    monkeypatch.setattr(sharding, "call", call)
+    queue = sms_queue.SmsQueue({"port_rate": 0}, db_path=str(tmp_path / "sms.db"))
+    queue.start()
+    manager = campaigns.CampaignManager(queue)
+    monkeypatch.setattr(manager, "_ports_info", lambda ports=None: [
+        {"port": "sim0", "operator": None, "phone": None, "rssi": 20},
+    ])
+
+    def recipients():
+        for n in range(7):
+            yield f"+1555000{n:04d}", None
+        raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+
+    try:
+        with pytest.raises(campaigns.CampaignIngestError) as info:
+            manager.create(recipients(), "hello")
+        campaign = manager.get(info.value.campaign_id)
+        assert str(info.value) == "recipient list must be UTF-8"
+        assert campaign["status"] == campaigns.FAILED
+        progress = campaign["progress"]
+        assert progress[sms_queue.QUEUED] == 0
+        assert progress[sms_queue.CANCELLED] + progress[sms_queue.SENDING] == 6
+        with pytest.raises(campaigns.CampaignError):
+            manager.resume(campaign["id"])
+    finally:
+        release.set()
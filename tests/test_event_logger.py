@@ -0,0 +1,22 @@
+"""События пишутся и в процессе, где create_app (и init_db) не вызывался."""
+
+import sqlite3
+
+from FreeSMS import event_logger
+
+
+def test_writer_creates_schema_without_init_db(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "events.db")
+    monkeypatch.setattr(event_logger, "DB_PATH", db_path)
+    writer = event_logger._Writer()
+    writer.start()
+    writer.put(event_logger._row("ussd", "sim0", None, "*100# OK"))
+    writer.flush(5)
+    writer.stop()
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT port, event_type, details FROM events").fetchall()
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+    assert rows == [("sim0", "ussd", "*100# OK")]
+    assert "idx_events_ts" in indexes
@@ -0,0 +1,52 @@
+"""Веб-хук с {extract} в адресе — один адресат на шаблон правила."""
+
+import time
+
+from FreeSMS import event_logger, forwarding
+
+TEMPLATE = "https://hooks.example/{extract}"
+RULE = {"id": 1, "target": TEMPLATE}
+
+
+class _RecordingSink:
+    def __init__(self):
+        self.targets = []
+
+    async def send(self, payload, timeout, target=None):
+        self.targets.append(target)
+
+
+def _forwarder(tmp_path, monkeypatch, **config):
+    monkeypatch.setattr(event_logger, "log_event", lambda *a, **kw: None)
+    forwarder = forwarding.Forwarder(config, db_path=str(tmp_path / "sms.db"))
+    forwarder.start()
+    return forwarder
+
+
+def test_templated_webhook_is_one_destination(tmp_path, monkeypatch):
+    # queue_size=0: все задачи остаются в forward_queue
+    forwarder = _forwarder(tmp_path, monkeypatch, queue_size=0)
+    try:
+        for value in ("a", "b", "c"):
+            forwarder.forward({"id": value, "port": "sim0"}, RULE, value)
+        status = forwarder.status()
+        assert list(status) == [TEMPLATE]
+        assert status[TEMPLATE]["stored"] == {forwarding.QUEUED: 3}
+        targets = [r[0] for r in forwarder._query("SELECT target FROM forward_queue ORDER BY id")]
+        assert targets == [f"https://hooks.example/{v}" for v in ("a", "b", "c")]
+    finally:
+        forwarder.stop()
+
+
+def test_templated_webhook_delivers_to_rendered_url(tmp_path, monkeypatch):
+    forwarder = _forwarder(tmp_path, monkeypatch)
+    try:
+        sink = forwarder.destination(TEMPLATE).sink = _RecordingSink()
+        forwarder.forward({"id": 1, "port": "sim0"}, RULE, "42")
+        deadline = time.monotonic() + 5
+        while forwarder.status()[TEMPLATE]["sent"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert sink.targets == ["https://hooks.example/42"]
+        assert len(forwarder._destinations) == 1
+    finally:
+        forwarder.stop()
@@ -0,0 +1,99 @@
+"""
+port_health отличает отказ открыть сессию от ошибки самой команды;
+замена SIM между редкими опросами не оставляет старые поля в кэше.
+"""
+
+import pytest
+
+from FreeSMS import modem_utils
+from FreeSMS.port_health import PORT_HEALTH
+
+
+class _CommandError(Exception):
+    """Модем ответил ошибкой; бэкенд не считает её ошибкой соединения."""
+
+
+class _Modem:
+    def SendATCommand(self, command):
+        raise _CommandError("ERROR")
+
+    def Terminate(self):
+        pass
+
+
+class _Backend:
+    def __init__(self, opens):
+        self.opens = opens
+
+    def open(self, port):
+        if not self.opens:
+            # Например, нет прав на tty: ошибка не из списка ошибок соединения
+            raise _CommandError("Init failed")
+        return _Modem()
+
+    def is_connection_error(self, exc):
+        return False
+
+    def encode_sms(self, phone, text):
+        return [{"Number": phone, "Text": text}]
+
+
+@pytest.fixture
+def port(monkeypatch):
+    port = "test-port"
+    yield port
+    modem_utils.SESSION_POOL.invalidate(port)
+    PORT_HEALTH.forget(port)
+
+
+def test_failed_open_backs_the_port_off(monkeypatch, port):
+    monkeypatch.setattr(modem_utils, "get_backend", lambda: _Backend(opens=False))
+    assert modem_utils.send_at_command(port, "AT") == ""
+    assert PORT_HEALTH.is_suspect(port)
+    with pytest.raises(modem_utils.PortUnavailableError):
+        modem_utils.send_sms(port, "+15550001", "hi")
+
+
+def test_command_error_keeps_the_port_healthy(monkeypatch, port):
+    monkeypatch.setattr(modem_utils, "get_backend", lambda: _Backend(opens=True))
+    assert modem_utils.send_at_command(port, "AT") == ""
+    assert not PORT_HEALTH.is_suspect(port)
+
+
+class _SimSlot:
+    """Модем, в котором SIM меняют, пока порт никто не опрашивает."""
+
+    def __init__(self):
+        self.iccid = "8970101000000000001"
+
+    def GetNetworkInfo(self):
+        return {"State": "HomeNetwork"}
+
+    def GetSignalQuality(self):
+        return {"SignalStrength": 20}
+
+    def GetSecurityStatus(self):
+        return "READY"
+
+    def GetICC(self):
+        return self.iccid
+
+    def Terminate(self):
+        pass
+
+
+def test_unobserved_sim_swap_refreshes_static_fields(monkeypatch, port):
+    slot = _SimSlot()
+    backend = _Backend(opens=True)
+    backend.open = lambda p: slot
+    monkeypatch.setattr(modem_utils, "get_backend", lambda: backend)
+    assert modem_utils.get_modem_info(port, "en")["iccid"] == slot.iccid
+    old = slot.iccid
+    slot.iccid = "8970101000000000002"
+    # Частые опросы: CPIN не менялся, поля берутся из кэша
+    assert modem_utils.get_modem_info(port, "en")["iccid"] == old
+    # Порт долго не опрашивали: замена SIM могла пройти незамеченной
+    modem_utils._static_cache[port]["checked"] -= modem_utils.UNOBSERVED_GAP
+    assert modem_utils.get_modem_info(port, "en")["iccid"] == slot.iccid
+    assert modem_utils.cached_iccid(port) == slot.iccid
+    modem_utils.forget_port(port)
@@ -0,0 +1,44 @@
+"""Подписка на монитор."""
+
+import threading
+
+from FreeSMS import monitor, sharding
+
+
+def _hub(monkeypatch, ports):
+    monkeypatch.setattr(sharding, "poll", lambda ports, lang: {})
+    monkeypatch.setattr(monitor, "list_modem_ports", lambda: [])
+    # Без опроса: тик с пустым списком портов стёр бы снимок посреди теста
+    monkeypatch.setattr(monitor.MonitorHub, "_run", lambda self: None)
+    hub = monitor.MonitorHub()
+    hub._prev_by_port = {p: {"port": p, "signal": "20 (Good)"} for p in ports}
+    return hub
+
+
+def test_subscribe_with_snapshot_larger_than_queue(monkeypatch):
+    ports = [f"sim{i}" for i in range(monitor.SUBSCRIBER_QUEUE_SIZE + 5)]
+    hub = _hub(monkeypatch, ports)
+    subs = []
+    thread = threading.Thread(target=lambda: subs.append(hub.subscribe()), daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive(), "subscribe() deadlocked on a full queue"
+    assert subs[0].get(timeout=1)["port"] in ports
+    subs[0].close()
+
+
+def test_one_poller_localizes_per_subscriber(monkeypatch):
+    hub = _hub(monkeypatch, ["sim0"])
+    hub._prev_by_port["sim0"].update(status="No response", network="Connected")
+    ru = hub.subscribe(lang="ru")
+    en = hub.subscribe(lang="en")
+    assert ru.get(timeout=1) == {
+        "port": "sim0", "signal": "20 (Хороший)", "status": "Нет ответа", "network": "Подключено",
+    }
+    assert en.get(timeout=1)["signal"] == "20 (Good)"
+    hub._publish({"port": "sim0", "signal": "3 (Bad)"})
+    assert ru.get(timeout=1) == {"port": "sim0", "signal": "3 (Плохой)"}
+    assert en.get(timeout=1) == {"port": "sim0", "signal": "3 (Bad)"}
+    assert monitor.get_hub() is monitor.get_hub()
+    ru.close()
+    en.close()
@@ -0,0 +1,60 @@
+"""Поток порта очереди SMS переживает неожиданные ошибки."""
+
+import time
+
+from FreeSMS import event_logger, sharding, sms_queue
+
+
+def _wait_status(queue, message_id, statuses, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        message = queue.get(message_id)
+        if message["status"] in statuses:
+            return message
+        time.sleep(0.02)
+    return queue.get(message_id)
+
+
+def test_sender_survives_unexpected_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_logger, "log_event", lambda *a, **kw: None)
+    failures = ["shard 0 exited"]
+
+    def call(port, name, *args, **kwargs):
+        if name == "cached_operator" and failures:
+            raise sharding.ShardError(failures.pop())
+        if name == "cached_operator":
+            return None
+        return [1]
+
+    monkeypatch.setattr(sharding, "call", call)
+    queue = sms_queue.SmsQueue(
+        {"port_rate": 0, "retry_base": 0.01, "retry_max": 0.01},
+        db_path=str(tmp_path / "sms.db"),
+    )
+    queue.start()
+    message_id = queue.submit("sim0", "+15550001", "hello")
+
+    message = _wait_status(queue, message_id, (sms_queue.SENT, sms_queue.FAILED))
+    assert message["status"] == sms_queue.SENT
+    assert message["attempts"] == 2
+    assert queue._workers["sim0"].thread.is_alive()
+
+
+def test_persistent_error_marks_message_failed(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_logger, "log_event", lambda *a, **kw: None)
+
+    def call(port, name, *args, **kwargs):
+        raise sharding.ShardError("no worker")
+
+    monkeypatch.setattr(sharding, "call", call)
+    queue = sms_queue.SmsQueue(
+        {"port_rate": 0, "max_attempts": 2, "retry_base": 0.01, "retry_max": 0.01},
+        db_path=str(tmp_path / "sms.db"),
+    )
+    queue.start()
+    message_id = queue.submit("sim0", "+15550001", "hello")
+
+    message = _wait_status(queue, message_id, (sms_queue.FAILED,))
+    assert message["status"] == sms_queue.FAILED
+    assert message["error"] == "no worker"
+    assert queue._workers["sim0"].thread.is_alive()
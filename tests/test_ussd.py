@@ -0,0 +1,63 @@
+"""Отмена USSD-запросов: общий запрос снимается, только когда его никто не ждёт."""
+
+import concurrent.futures
+
+from FreeSMS import event_logger, sharding, ussd
+
+
+def _engine(monkeypatch, answered=()):
+    """Движок, у которого операции портов — Future в jobs; порты answered отвечают сразу."""
+    monkeypatch.setattr(event_logger, "log_event", lambda *a, **kw: None)
+    jobs = []
+
+    def submit(port, name, *args, **kwargs):
+        jobs.append(concurrent.futures.Future())
+        if port in answered:
+            jobs[-1].set_result({"port": port, "iccid": None, "status": "OK",
+                                 "response": "ok", "steps": [], "error": None})
+        return jobs[-1]
+
+    monkeypatch.setattr(sharding, "submit", submit)
+    return ussd.UssdEngine({"cache_ttl": 0}), jobs
+
+
+def test_shared_request_cancelled_by_last_waiter(monkeypatch):
+    engine, jobs = _engine(monkeypatch)
+    first = engine.submit("sim0", "*100#")
+    second = engine.submit("sim0", "*100#")
+    assert first is second and len(jobs) == 1
+
+    assert not engine.cancel("sim0", "*100#", future=first)
+    assert not jobs[0].cancelled()
+    assert engine.cancel("sim0", "*100#", future=second)
+    assert jobs[0].cancelled()
+    assert first.result(1)["status"] == "Timeout"
+
+
+def test_closed_run_leaves_its_requests(monkeypatch):
+    engine, jobs = _engine(monkeypatch, answered=("sim1",))
+    other = engine.submit("sim0", "*100#")
+    results = engine.run(["sim0", "sim1", "sim2"], "*100#", timeout=5)
+    assert next(results)["port"] == "sim1"
+    results.close()
+    # sim2 ждал только закрытый run(), sim0 ждёт ещё и other
+    assert jobs[2].cancelled()
+    assert not jobs[0].cancelled() and not other.done()
+
+
+def test_cancel_reaches_shard_worker():
+    manager = sharding.ShardManager(
+        {"workers": 1, "worker_threads": 2, "rebalance_interval": 3600},
+        backend=("simulator", {"ports": 1, "latency_ms": 0, "init_latency_ms": 0,
+                               "ussd_latency_ms": 300, "failure_rate": 0, "seed": 1}),
+    )
+    manager.start()
+    try:
+        running = manager.submit("sim0", "send_ussd", "*100#", (), 5)
+        queued = manager.submit("sim0", "send_ussd", "*100#", (), 5)
+        assert queued.cancel()
+        assert queued.cancelled()
+        assert running.result(10)["status"] != "Error"
+        assert not running.cancel()
+    finally:
+        manager.stop()
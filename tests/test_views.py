@@ -0,0 +1,24 @@
+"""Выбор языка в интерфейсе касается только своего клиента."""
+
+import FreeSMS
+from FreeSMS import backends, i18n
+
+from test_app_config import _capture
+
+
+def test_set_language_only_sets_cookie(monkeypatch):
+    _capture(monkeypatch)
+    client = FreeSMS.app.test_client()
+    with open(backends.CONFIG_PATH, "rb") as fh:
+        before = fh.read()
+    default = i18n.get_language()
+    lang = next(code for code in i18n.available_languages() if code != default)
+
+    resp = client.post("/set_language", json={"lang": lang})
+    assert resp.status_code == 200
+    assert f"lang={lang}" in resp.headers["Set-Cookie"]
+    assert i18n.get_language() == default
+    with open(backends.CONFIG_PATH, "rb") as fh:
+        assert fh.read() == before
+
+    assert client.post("/set_language", json={"lang": "xx"}).status_code == 400